@@ -0,0 +1,165 @@
+"""Pluggable AutoEncoder backends for HybridDeployedModel.
+
+Each backend is registered with the model artifacts it can load and a cheap
+availability probe. Its heavy imports (tensorrt/pycuda, onnxruntime, torch)
+happen only inside its factory, i.e. only when that backend is chosen.
+
+Every runtime returned honours the same contract:
+
+    score_batch(X) -> np.ndarray (n_samples,)   per-sample reconstruction MSE
+    score(X)       -> float                     mean MSE over X
+"""
+
+import importlib.util
+import os
+from collections import OrderedDict
+
+import numpy as np
+
+# name -> (artifact filenames in preference order, probe(), factory(path))
+_BACKENDS = OrderedDict()
+
+# Auto-detection order; TensorRT is only tried on Jetson (see config.USE_TENSORRT)
+AUTO_ORDER = ("tensorrt", "numpy", "onnxruntime", "torch")
+
+
+def _has_module(*names):
+    return all(importlib.util.find_spec(name) is not None for name in names)
+
+
+def register_backend(name, artifacts, probe=lambda: True):
+    """Decorator registering `factory(path) -> runtime` under `name`."""
+    def decorator(factory):
+        _BACKENDS[name] = (tuple(artifacts), probe, factory)
+        return factory
+    return decorator
+
+
+def available_backends():
+    """Names of registered backends whose dependencies are importable."""
+    return [name for name, (_, probe, _) in _BACKENDS.items() if probe()]
+
+
+class ReconstructionScorer:
+    """Adapts a runtime exposing `infer(x) -> reconstruction` to the scoring contract."""
+
+    def __init__(self, runtime, input_rank=2):
+        self.runtime = runtime
+        self.input_rank = input_rank
+
+    def score_batch(self, X):
+        X = np.asarray(X, dtype=np.float32)
+        if X.ndim == 1:
+            X = X.reshape(1, -1)
+        n, dim = X.shape
+        # Conv exports take (batch, 1, features, 1); dense exports (batch, features)
+        x_in = X.reshape(n, 1, dim, 1) if self.input_rank == 4 else X
+        recon = np.asarray(self.runtime.infer(x_in), dtype=np.float32).reshape(n, -1)
+        return np.mean((X - recon[:, :dim]) ** 2, axis=1)
+
+    def score(self, X):
+        return float(np.mean(self.score_batch(X)))
+
+
+@register_backend("tensorrt", ("ae.engine",), probe=lambda: _has_module("tensorrt", "pycuda"))
+def _tensorrt_backend(path):
+    from app.trt.ae_runtime import AERuntime
+    return AERuntime(path)
+
+
+@register_backend("onnxruntime", ("ae.onnx",), probe=lambda: _has_module("onnxruntime"))
+def _onnxruntime_backend(path):
+    from app import config, thread_budget
+    from app.cnn.trt_runtime import ONNXRuntimeCNNFallback
+    threads = thread_budget.current()
+    runtime = ONNXRuntimeCNNFallback(
+        path,
+        intra_op_threads=threads["ort_intra"] or 0,
+        inter_op_threads=threads["ort_inter"] or 0,
+        graph_optimization=config.ORT_GRAPH_OPT,
+        optimized_model_path=None if config.ORT_OPTIMIZED_MODEL == "none" else config.ORT_OPTIMIZED_MODEL,
+        batch_buckets=config.ORT_BATCH_BUCKETS,
+    )
+    rank = len(runtime.session.get_inputs()[0].shape)
+    return ReconstructionScorer(runtime, input_rank=rank)
+
+
+@register_backend("torch", ("ae.pth",), probe=lambda: _has_module("torch"))
+def _torch_backend(path):
+    from app import thread_budget
+    from app.ae_runtime import AERuntime
+    runtime = AERuntime(path)
+    thread_budget.set_torch_threads(thread_budget.current()["torch"])
+    return runtime
+
+
+@register_backend("numpy", ("ae.npz", "ae.pth", "ae.onnx"))
+def _numpy_backend(path):
+    from app.ae_numpy import NumpyAERuntime
+    if path.endswith(".onnx") and not _has_module("onnx"):
+        raise ImportError("onnx not installed; cannot read {}".format(path))
+    return NumpyAERuntime(path)
+
+
+def _artifact(models_dir, artifacts):
+    for filename in artifacts:
+        path = os.path.join(models_dir, filename)
+        if os.path.exists(path):
+            return path
+    return None
+
+
+def _candidates(backend, use_tensorrt):
+    if backend != "auto":
+        if backend not in _BACKENDS:
+            raise ValueError("unknown AE backend '{}' (registered: {})".format(
+                backend, ", ".join(_BACKENDS)))
+        return [backend]
+    candidates = [name for name in AUTO_ORDER if name != "tensorrt" or use_tensorrt]
+    return candidates + [name for name in _BACKENDS if name not in candidates and name != "tensorrt"]
+
+
+def resolve_backend(models_dir, backend="auto", use_tensorrt=False):
+    """Name of the backend `create_ae_runtime` would try first, without loading it.
+
+    Returns:
+        backend name, or None if no backend has both its artifact and dependencies
+    """
+    for name in _candidates(backend, use_tensorrt):
+        artifacts, probe, _ = _BACKENDS[name]
+        if _artifact(models_dir, artifacts) is not None and probe():
+            return name
+    return None
+
+
+def create_ae_runtime(models_dir, backend="auto", use_tensorrt=False):
+    """Instantiate the configured (or first working) AE backend.
+
+    Args:
+        models_dir: directory holding ae.engine / ae.onnx / ae.pth / ae.npz
+        backend: registered backend name, or "auto"
+        use_tensorrt: allow TensorRT during auto-detection (Jetson only)
+
+    Returns:
+        (backend_name, runtime)
+
+    Raises:
+        ValueError: unknown backend name
+        RuntimeError: no backend could be initialized
+    """
+    errors = []
+    for name in _candidates(backend, use_tensorrt):
+        artifacts, probe, factory = _BACKENDS[name]
+        path = _artifact(models_dir, artifacts)
+        if path is None:
+            errors.append("{}: none of {} in {}".format(name, "/".join(artifacts), models_dir))
+            continue
+        if not probe():
+            errors.append("{}: dependencies not installed".format(name))
+            continue
+        try:
+            return name, factory(path)
+        except Exception as e:
+            errors.append("{}: {}".format(name, e))
+
+    raise RuntimeError("no AE backend available ({})".format("; ".join(errors)))
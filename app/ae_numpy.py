@@ -0,0 +1,348 @@
+"""Pure-NumPy AutoEncoder backend with BatchNorm folding.
+
+Scores the Linear/ReLU/BatchNorm `CNNAutoEncoder` from `app/ae_runtime.py`
+without importing torch. Weights come from `ae.pth` (read straight from the
+torch zip archive), an `.npz` of the same state_dict keys, or an ONNX export
+of the same network. At load every eval-mode BatchNorm is folded into the
+neighbouring Linear layer, so the forward pass is a chain of float32
+matmul + bias (+ ReLU) steps.
+"""
+
+import os
+import pickle
+import re
+import zipfile
+from collections import OrderedDict
+
+import numpy as np
+
+BN_EPS = 1e-5
+
+_STORAGE_DTYPES = {
+    "FloatStorage": np.float32,
+    "DoubleStorage": np.float64,
+    "HalfStorage": np.float16,
+    "LongStorage": np.int64,
+    "IntStorage": np.int32,
+    "ShortStorage": np.int16,
+    "CharStorage": np.int8,
+    "ByteStorage": np.uint8,
+    "BoolStorage": np.bool_,
+}
+
+
+# ----------------------------------------------------------------------
+# Weight loading
+# ----------------------------------------------------------------------
+def _rebuild_tensor(storage, storage_offset, size, stride, *args):
+    itemsize = storage.dtype.itemsize
+    if not size:
+        return storage[storage_offset:storage_offset + 1].reshape(()).copy()
+    view = np.lib.stride_tricks.as_strided(
+        storage[storage_offset:],
+        shape=tuple(size),
+        strides=tuple(s * itemsize for s in stride),
+    )
+    return np.array(view)
+
+
+def _rebuild_parameter(data, *args):
+    return data
+
+
+class _StateDictUnpickler(pickle.Unpickler):
+    """Unpickles a torch zip-format state_dict into NumPy arrays."""
+
+    def __init__(self, fileobj, archive, prefix):
+        super(_StateDictUnpickler, self).__init__(fileobj)
+        self.archive = archive
+        self.prefix = prefix
+
+    def find_class(self, module, name):
+        if module == "collections" and name == "OrderedDict":
+            return OrderedDict
+        if module == "torch._utils" and name == "_rebuild_tensor_v2":
+            return _rebuild_tensor
+        if module == "torch._utils" and name == "_rebuild_parameter":
+            return _rebuild_parameter
+        if module == "torch" and name in _STORAGE_DTYPES:
+            return name
+        raise pickle.UnpicklingError("unsupported global in state_dict: {}.{}".format(module, name))
+
+    def persistent_load(self, pid):
+        # ('storage', storage_type, key, location, numel)
+        _, storage_type, key, _, numel = pid
+        dtype = np.dtype(_STORAGE_DTYPES[storage_type])
+        raw = self.archive.read("{}data/{}".format(self.prefix, key))
+        return np.frombuffer(raw, dtype=dtype.newbyteorder("<"), count=numel)
+
+
+def load_state_dict(path):
+    """Load a state_dict as {name: np.ndarray} without importing torch.
+
+    Supports torch zip checkpoints (`torch.save`, torch >= 1.6) and `.npz`.
+
+    Raises:
+        FileNotFoundError: if `path` does not exist
+        ValueError: if the file is not a supported checkpoint format
+    """
+    if not os.path.exists(path):
+        raise FileNotFoundError("AE weights not found: {}".format(path))
+    if path.endswith(".npz"):
+        with np.load(path) as data:
+            return OrderedDict((k, data[k]) for k in data.files)
+    if not zipfile.is_zipfile(path):
+        raise ValueError("{} is a legacy (non-zip) torch checkpoint; re-save it with "
+                         "torch >= 1.6 or export to .npz".format(path))
+
+    with zipfile.ZipFile(path) as archive:
+        pkl = [n for n in archive.namelist() if n.endswith("data.pkl")]
+        if not pkl:
+            raise ValueError("no data.pkl in {}".format(path))
+        prefix = pkl[0][:-len("data.pkl")]
+        with archive.open(pkl[0]) as f:
+            state = _StateDictUnpickler(f, archive, prefix).load()
+    if isinstance(state, dict) and "state_dict" in state:
+        state = state["state_dict"]
+    return OrderedDict((k, np.asarray(v)) for k, v in state.items())
+
+
+def layers_from_state_dict(state, eps=BN_EPS):
+    """Turn a Sequential Linear/ReLU/BatchNorm state_dict into an op list.
+
+    ReLUs carry no parameters, so one is assumed wherever a Sequential index
+    is skipped between two parameterized modules (Linear / BatchNorm1d).
+    """
+    modules = OrderedDict()
+    for key, value in state.items():
+        m = re.match(r"^(.*)\.(\d+)\.(\w+)$", key)
+        if m is None:
+            continue
+        seq, idx, param = m.group(1), int(m.group(2)), m.group(3)
+        modules.setdefault((seq, idx), {})[param] = np.asarray(value)
+
+    # encoder before decoder, then by position inside each Sequential
+    order = []
+    for seq, idx in modules:
+        if seq not in order:
+            order.append(seq)
+    keys = sorted(modules, key=lambda k: (order.index(k[0]), k[1]))
+
+    ops = []
+    prev = None
+    for seq, idx in keys:
+        params = modules[(seq, idx)]
+        if prev is not None and prev[0] == seq and idx > prev[1] + 1:
+            ops.append(("relu",))
+        if "running_mean" in params:
+            scale = params["weight"] / np.sqrt(params["running_var"] + eps)
+            shift = params["bias"] - params["running_mean"] * scale
+            ops.append(("affine", scale.astype(np.float64), shift.astype(np.float64)))
+        elif params.get("weight") is not None and params["weight"].ndim == 2:
+            bias = params.get("bias")
+            if bias is None:
+                bias = np.zeros(params["weight"].shape[0])
+            ops.append(("linear", params["weight"].astype(np.float64), bias.astype(np.float64)))
+        else:
+            raise ValueError("unsupported module {}.{} ({})".format(seq, idx, sorted(params)))
+        prev = (seq, idx)
+    return ops
+
+
+def layers_from_onnx(onnx_path):
+    """Read a chain of Gemm/MatMul/Add/Relu/BatchNormalization nodes from ONNX."""
+    import onnx
+    from onnx import numpy_helper
+
+    model = onnx.load(onnx_path)
+    init = {t.name: numpy_helper.to_array(t).astype(np.float64) for t in model.graph.initializer}
+    ops = []
+    for node in model.graph.node:
+        attrs = {a.name: onnx.helper.get_attribute_value(a) for a in node.attribute}
+        if node.op_type == "Gemm":
+            W = init[node.input[1]] * attrs.get("alpha", 1.0)
+            if not attrs.get("transB", 0):
+                W = W.T
+            b = init[node.input[2]] * attrs.get("beta", 1.0) if len(node.input) > 2 else np.zeros(W.shape[0])
+            ops.append(("linear", W, np.broadcast_to(b, (W.shape[0],)).copy()))
+        elif node.op_type == "MatMul":
+            W = init[node.input[1]].T
+            ops.append(("linear", W, np.zeros(W.shape[0])))
+        elif node.op_type == "Add" and ops and ops[-1][0] == "linear":
+            b = init.get(node.input[1], init.get(node.input[0]))
+            ops[-1] = ("linear", ops[-1][1], ops[-1][2] + b)
+        elif node.op_type == "Relu":
+            ops.append(("relu",))
+        elif node.op_type == "BatchNormalization":
+            gamma, beta, mean, var = (init[name] for name in node.input[1:5])
+            scale = gamma / np.sqrt(var + attrs.get("epsilon", BN_EPS))
+            ops.append(("affine", scale, beta - mean * scale))
+        elif node.op_type == "Identity" and node.input[0] in init:
+            # Exporters alias deduplicated weights through Identity nodes
+            init[node.output[0]] = init[node.input[0]]
+        elif node.op_type == "Constant":
+            init[node.output[0]] = numpy_helper.to_array(attrs["value"]).astype(np.float64)
+        elif node.op_type in ("Identity", "Flatten"):
+            continue
+        else:
+            raise ValueError("unsupported ONNX op for NumPy AE backend: {}".format(node.op_type))
+    return ops
+
+
+def fold_layers(ops):
+    """Fold every affine (BatchNorm) op into a neighbouring Linear.
+
+    BN after ReLU folds forward into the next Linear (W' = W*s, b' = W@t + b);
+    BN directly after a Linear folds backward (W' = s*W, b' = s*b + t).
+
+    Returns:
+        list of (W^T float32 (in, out), b float32 (out,), relu: bool)
+    """
+    dense = []
+    pending = None
+    for op in ops:
+        kind = op[0]
+        if kind == "linear":
+            W, b = op[1], op[2]
+            if pending is not None:
+                b = b + W @ pending[1]
+                W = W * pending[0][None, :]
+                pending = None
+            dense.append([W, b, False])
+        elif kind == "relu":
+            if pending is not None or not dense:
+                raise ValueError("ReLU must follow a Linear layer")
+            dense[-1][2] = True
+        elif kind == "affine":
+            if dense and not dense[-1][2] and pending is None:
+                W, b, _ = dense[-1]
+                dense[-1] = [W * op[1][:, None], b * op[1] + op[2], False]
+            elif pending is None:
+                pending = (op[1], op[2])
+            else:
+                pending = (pending[0] * op[1], pending[1] * op[1] + op[2])
+    if pending is not None:
+        # Trailing BatchNorm with no Linear after it: identity-weighted layer
+        dense.append([np.diag(pending[0]), pending[1], False])
+    return [(np.ascontiguousarray(W.T, dtype=np.float32), b.astype(np.float32), relu)
+            for W, b, relu in dense]
+
+
+# ----------------------------------------------------------------------
+# Runtime
+# ----------------------------------------------------------------------
+class NumpyAERuntime:
+    """AutoEncoder runtime using float32 NumPy matmuls (no torch import).
+
+    Provides the same `score` / `score_batch` contract as the torch runtime.
+    """
+
+    def __init__(self, model_path, eps=BN_EPS):
+        """
+        Args:
+            model_path: ae.pth, .npz state_dict or .onnx export
+            eps: BatchNorm epsilon used at training (torch default 1e-5)
+        """
+        if model_path.endswith(".onnx"):
+            ops = layers_from_onnx(model_path)
+        else:
+            ops = layers_from_state_dict(load_state_dict(model_path), eps=eps)
+        self.layers = fold_layers(ops)
+        if not self.layers:
+            raise ValueError("no layers found in {}".format(model_path))
+        self.input_dim = self.layers[0][0].shape[0]
+        self.model_path = model_path
+
+    @classmethod
+    def from_layers(cls, layers, source):
+        """Runtime over already folded [(W^T, b, relu)] layers (e.g. a model bundle)."""
+        runtime = cls.__new__(cls)
+        runtime.layers = list(layers)
+        if not runtime.layers:
+            raise ValueError("no layers found in {}".format(source))
+        runtime.input_dim = runtime.layers[0][0].shape[0]
+        runtime.model_path = source
+        return runtime
+
+    def reconstruct(self, X):
+        h = np.asarray(X, dtype=np.float32)
+        for WT, b, relu in self.layers:
+            h = h @ WT
+            h += b
+            if relu:
+                np.maximum(h, 0.0, out=h)
+        return h
+
+    def score(self, X):
+        """
+        Compute reconstruction error (anomaly score)
+
+        Args:
+            X: numpy array of shape (n_samples, n_features)
+
+        Returns:
+            float: Mean squared reconstruction error
+        """
+        return float(np.mean(self.score_batch(X)))
+
+    def score_batch(self, X):
+        """
+        Compute per-sample reconstruction errors
+
+        Args:
+            X: numpy array of shape (n_samples, n_features)
+
+        Returns:
+            numpy array of shape (n_samples,): Per-sample MSE scores
+        """
+        X = np.asarray(X, dtype=np.float32)
+        if X.ndim == 1:
+            X = X.reshape(1, -1)
+        diff = self.reconstruct(X)
+        np.subtract(X, diff, out=diff)
+        np.square(diff, out=diff)
+        return diff.mean(axis=1)
+
+
+if __name__ == "__main__":
+    """Parity check against the torch runtime (if installed) and timing."""
+    import argparse
+    import time
+
+    parser = argparse.ArgumentParser(description="NumPy AE backend parity/benchmark")
+    parser.add_argument("model_path", nargs="?", default="models/ae.pth")
+    parser.add_argument("--repeat", type=int, default=200)
+    args = parser.parse_args()
+
+    runtime = NumpyAERuntime(args.model_path)
+    print("[NumPy AE] {} dense layers, input_dim={}".format(len(runtime.layers), runtime.input_dim))
+    X = np.random.default_rng(0).standard_normal((4096, runtime.input_dim)).astype(np.float32)
+
+    reference = None
+    try:
+        from app.ae_runtime import AERuntime
+        if not args.model_path.endswith(".onnx"):
+            reference = AERuntime(args.model_path)
+    except ImportError:
+        print("[NumPy AE] torch not installed; skipping parity check")
+
+    if reference is not None:
+        ref = reference.score_batch(X)
+        got = runtime.score_batch(X)
+        rel = float(np.max(np.abs(ref - got) / np.maximum(np.abs(ref), 1e-12)))
+        print("[NumPy AE] parity vs torch: max rel err = {:.3e} -> {}".format(
+            rel, "OK" if rel <= 1e-4 else "MISMATCH"))
+        print("[NumPy AE] score(): torch={:.6f} numpy={:.6f}".format(
+            reference.score(X[:8]), runtime.score(X[:8])))
+
+    for bs in (1, 16, 256, 4096):
+        Xb = X[:bs]
+        backends = [("numpy", runtime)] + ([("torch", reference)] if reference is not None else [])
+        line = []
+        for name, rt in backends:
+            rt.score_batch(Xb)
+            t0 = time.perf_counter()
+            for _ in range(args.repeat):
+                rt.score_batch(Xb)
+            line.append("{}={:.3f} ms".format(name, (time.perf_counter() - t0) / args.repeat * 1000.0))
+        print("  batch {:>5}: {}".format(bs, "  ".join(line)))
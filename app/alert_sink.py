@@ -0,0 +1,256 @@
+import atexit
+import contextlib
+import datetime
+import json
+import os
+import queue
+import threading
+import time
+
+try:
+    import fcntl
+except ImportError:  # not POSIX: rotation is not coordinated across processes
+    fcntl = None
+
+_STOP = object()
+
+
+class AlertSink:
+    """Background JSONL writer for anomaly alerts.
+
+    Request threads only enqueue a record; a worker thread serializes the
+    records, writes them in groups (every `flush_ms` or once `flush_bytes`
+    are buffered) and fsyncs once per group. The file is rotated by renaming
+    (alerts.log -> alerts.log.1 -> ...) once it exceeds `max_bytes` or is
+    older than `rotate_s`, which promtail follows like logrotate's default.
+    Pre-forked workers share the file: each write group and the rotation
+    run under an flock on `<path>.lock`, so one worker renames the chain
+    while the others wait and then follow it to the new file.
+    When the queue is full the alert is dropped and counted, never blocking
+    the request.
+    """
+
+    def __init__(self, path, max_queue=4096, flush_ms=200.0, flush_bytes=65536,
+                 fsync=True, max_bytes=50 * 1024 * 1024, rotate_s=0.0, backups=5):
+        self.path = path
+        self.max_queue = int(max_queue)
+        self.flush_interval = max(0.0, float(flush_ms)) / 1000.0
+        self.flush_bytes = max(1, int(flush_bytes))
+        self.fsync = bool(fsync)
+        self.max_bytes = int(max_bytes)
+        self.rotate_s = float(rotate_s)
+        self.backups = max(0, int(backups))
+
+        self._lock = threading.Lock()
+        self._queue = None
+        self._worker = None
+        self._pid = None
+
+        self._file = None
+        self._lock_file = None
+        self._size = 0
+        self._opened_at = 0.0
+
+        self._enqueued = 0
+        self._dropped = 0
+        self._dropped_reported = 0
+        self._written = 0
+        self._flushes = 0
+        self._rotations = 0
+        self._errors = 0
+
+    # ------------------------------------------------------------------
+    def _ensure_worker(self):
+        # Threads do not survive fork(); restart the worker in a new process
+        if self._worker is not None and self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._worker is not None and self._pid == os.getpid():
+                return
+            self._queue = queue.Queue(maxsize=self.max_queue)
+            self._file = None
+            # flock() belongs to the open file, so each process opens its own
+            self._lock_file = None
+            self._pid = os.getpid()
+            self._worker = threading.Thread(target=self._run, name="alert-sink", daemon=True)
+            self._worker.start()
+            atexit.register(self.close)
+
+    def record(self, result):
+        """Queue one detection result for writing.
+
+        Returns:
+            True if queued, False if dropped because the queue is full
+        """
+        self._ensure_worker()
+        record = {
+            "ts": datetime.datetime.utcnow().isoformat() + "Z",
+            "pred": result.get("pred"),
+            "score": float(result.get("score", 0.0)),
+            "sev": result.get("sev"),
+            "anom": bool(result.get("anom")),
+            "meta": result.get("meta", {}),
+            "all_results": result.get("all_results"),
+        }
+        try:
+            self._queue.put_nowait(record)
+        except queue.Full:
+            with self._lock:
+                self._dropped += 1
+            return False
+        with self._lock:
+            self._enqueued += 1
+        return True
+
+    def close(self, timeout=2.0):
+        """Drain queued alerts to disk and stop the worker."""
+        if self._worker is None or self._pid != os.getpid() or not self._worker.is_alive():
+            return
+        try:
+            self._queue.put(_STOP, timeout=timeout)
+        except queue.Full:
+            return
+        self._worker.join(timeout)
+
+    # ------------------------------------------------------------------
+    def _run(self):
+        lines = []
+        pending = 0
+        deadline = None
+        while True:
+            timeout = None if deadline is None else max(0.0, deadline - time.monotonic())
+            try:
+                record = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                record = None
+
+            if record is _STOP:
+                self._write(lines)
+                self._close_file()
+                if self._lock_file is not None:
+                    self._lock_file.close()
+                    self._lock_file = None
+                return
+
+            if record is not None:
+                lines.append(json.dumps(record, default=str) + "\n")
+                pending += len(lines[-1])
+                if deadline is None:
+                    deadline = time.monotonic() + self.flush_interval
+
+            if lines and (pending >= self.flush_bytes or time.monotonic() >= deadline):
+                self._write(lines)
+                lines = []
+                pending = 0
+                deadline = None
+
+    def _write(self, lines):
+        if self._dropped != self._dropped_reported:
+            print("[AlertSink] queue full: dropped {} alerts".format(self._dropped - self._dropped_reported))
+            self._dropped_reported = self._dropped
+        if not lines:
+            return
+        data = "".join(lines).encode("utf-8")
+        try:
+            with self._file_lock():
+                if self._file is not None and self._replaced():
+                    self._close_file()
+                if self._file is None:
+                    self._open_file()
+                if self._should_rotate(len(data)):
+                    self._rotate()
+                self._file.write(data)
+                self._file.flush()
+            # The fd keeps the inode if a sibling rotates before the fsync
+            if self.fsync:
+                os.fsync(self._file.fileno())
+            self._size += len(data)
+            self._written += len(lines)
+            self._flushes += 1
+        except Exception as e:
+            self._errors += 1
+            self._close_file()
+            print("[AlertSink] write failed ({} alerts lost): {}".format(len(lines), e))
+
+    def _open_file(self):
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._file = open(self.path, "ab")
+        self._size = self._file.tell()
+        self._opened_at = time.time()
+
+    def _replaced(self):
+        # Pre-forked workers append to the same file: follow a sibling's
+        # rotation, and count its appends towards max_bytes
+        try:
+            st = os.stat(self.path)
+        except FileNotFoundError:
+            return True
+        fst = os.fstat(self._file.fileno())
+        self._size = fst.st_size
+        return (st.st_ino, st.st_dev) != (fst.st_ino, fst.st_dev)
+
+    def _close_file(self):
+        if self._file is not None:
+            try:
+                self._file.close()
+            except Exception:
+                pass
+            self._file = None
+
+    def _should_rotate(self, incoming):
+        if not self._size:
+            return False
+        if self.max_bytes > 0 and self._size + incoming > self.max_bytes:
+            return True
+        return self.rotate_s > 0 and time.time() - self._opened_at >= self.rotate_s
+
+    @contextlib.contextmanager
+    def _file_lock(self):
+        # Serializes appends and renames across the workers sharing the file
+        if fcntl is None:
+            yield
+            return
+        if self._lock_file is None:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            self._lock_file = open(self.path + ".lock", "a")
+        fcntl.flock(self._lock_file.fileno(), fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(self._lock_file.fileno(), fcntl.LOCK_UN)
+
+    def _rotate(self):
+        # Called with _file_lock held and the current file open
+        self._close_file()
+        if self.backups > 0:
+            for i in range(self.backups - 1, 0, -1):
+                src = "{}.{}".format(self.path, i)
+                if os.path.exists(src):
+                    os.replace(src, "{}.{}".format(self.path, i + 1))
+            os.replace(self.path, self.path + ".1")
+        else:
+            os.remove(self.path)
+        self._rotations += 1
+        self._open_file()
+
+    # ------------------------------------------------------------------
+    def queue_depth(self):
+        return self._queue.qsize() if self._queue is not None else 0
+
+    def stats(self):
+        """Write, drop and rotation counters."""
+        return {
+            "path": self.path,
+            "queue_depth": self.queue_depth(),
+            "max_queue": self.max_queue,
+            "enqueued": self._enqueued,
+            "written": self._written,
+            "dropped": self._dropped,
+            "flushes": self._flushes,
+            "rotations": self._rotations,
+            "write_errors": self._errors,
+        }
@@ -0,0 +1,534 @@
+"""Asyncio (ASGI) entry point with bounded admission control.
+
+Serves the same endpoints as app.server and shares its model, micro-batcher
+and alert sink. The threaded server accepts every connection, so under
+bursty Subscription traffic requests pile up and latency collapses. Here
+at most ASGI_MAX_INFLIGHT requests are processed at once and
+ASGI_MAX_QUEUE more may wait, each for up to ASGI_QUEUE_TIMEOUT_MS. Any
+further request is answered at once with ASGI_REJECT_STATUS (503 or 429)
+and a Retry-After header, so the FHIR server backs off instead of timing
+out.
+
+    /health, /metrics,     answered on the event loop, never queued
+    /admission/stats
+    /fhir/notify           admitted; decoded on the loop, then awaits the
+                           micro-batcher (or model.infer on the executor)
+                           without holding a thread while it waits
+    /fhir/batch, /Bundle,  admitted; the Flask handlers run on the inference
+    /fhir/stream           executor (ASGI_EXECUTOR_THREADS threads), with the
+                           request body streamed in from the loop
+    everything else        Flask handlers on the loop's default executor,
+                           not admission controlled (admin, stats, info)
+
+Usage:
+    python -m app.asgi --port 5000            # with uvicorn, if installed
+    uvicorn app.asgi:app --port 5000
+    hypercorn app.asgi:app --bind 0.0.0.0:5000
+"""
+
+import asyncio
+import collections
+import functools
+import json
+import math
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
+
+from app import config, metrics, server
+from app.batcher import BatchQueueFull
+from app.fhir_decode import decode_audit_event, decode_json, DecodeError
+from app.fhir_features import extract_features
+from app.load_control import CONTROLLER
+from app.metrics import STAGE_SECONDS
+
+ADMISSION_REJECTED = metrics.REGISTRY.counter(
+    "fhir_admission_rejected_total",
+    "Requests turned away by admission control (queue_full, queue_timeout)",
+    labelnames=("reason",))
+
+# Admission-controlled paths and their Flask endpoint names (metric labels)
+INFERENCE_ENDPOINTS = {
+    "/fhir/notify": "fhir_notify",
+    "/fhir/batch": "fhir_batch",
+    "/fhir/Bundle": "fhir_bundle",
+    "/fhir/stream": "fhir_stream",
+}
+
+# Retry-After bounds, in seconds
+RETRY_AFTER_MIN_S = 1
+RETRY_AFTER_MAX_S = 60
+
+
+class Overloaded(RuntimeError):
+    """Raised when a request cannot be admitted."""
+
+    def __init__(self, reason, retry_after):
+        super().__init__("Server overloaded ({}); retry after {}s".format(reason, retry_after))
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class Admission:
+    """Caps requests in flight; a bounded FIFO of waiters holds the excess.
+
+    Slots are handed from a finishing request straight to the oldest waiter.
+    Not thread-safe: acquire() and release() must run on the event loop.
+
+    Args:
+        max_inflight: requests processed at once
+        max_queue: requests allowed to wait for a slot
+        queue_timeout_ms: longest wait for a slot (0 = no limit)
+    """
+
+    def __init__(self, max_inflight=64, max_queue=128, queue_timeout_ms=1000.0):
+        self.max_inflight = max(1, int(max_inflight))
+        self.max_queue = max(0, int(max_queue))
+        self.queue_timeout = max(0.0, float(queue_timeout_ms)) / 1000.0
+
+        self.inflight = 0
+        self._waiters = collections.deque()
+        self._service_s = 0.05      # EWMA of admitted request duration
+        self._admitted = 0
+        self._queued = 0
+        self._rejected = {"queue_full": 0, "queue_timeout": 0}
+
+    def retry_after(self):
+        """Seconds until the current backlog should have drained."""
+        backlog = len(self._waiters) + self.inflight
+        seconds = math.ceil(self._service_s * backlog / self.max_inflight)
+        return int(min(RETRY_AFTER_MAX_S, max(RETRY_AFTER_MIN_S, seconds)))
+
+    def _reject(self, reason):
+        self._rejected[reason] += 1
+        ADMISSION_REJECTED.inc(1, (reason,))
+        raise Overloaded(reason, self.retry_after())
+
+    async def acquire(self):
+        """Wait for a slot; returns the admission time to pass to release().
+
+        Raises:
+            Overloaded: if the queue is full or the wait timed out
+        """
+        if self.inflight < self.max_inflight and not self._waiters:
+            self.inflight += 1
+            self._admitted += 1
+            return time.perf_counter()
+        if len(self._waiters) >= self.max_queue:
+            self._reject("queue_full")
+
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        self._queued += 1
+        try:
+            await asyncio.wait_for(waiter, self.queue_timeout or None)
+        except BaseException as e:
+            if waiter.done() and not waiter.cancelled():
+                # A slot was handed over as the wait ended; pass it on
+                self.release()
+            else:
+                waiter.cancel()
+                try:
+                    self._waiters.remove(waiter)
+                except ValueError:
+                    pass
+            if isinstance(e, asyncio.TimeoutError):
+                self._reject("queue_timeout")
+            raise
+        self._admitted += 1
+        return time.perf_counter()
+
+    def release(self, started=None):
+        """Free a slot, or hand it to the oldest live waiter."""
+        if started is not None:
+            self._service_s += 0.1 * ((time.perf_counter() - started) - self._service_s)
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                return
+        self.inflight -= 1
+
+    def queue_depth(self):
+        return len(self._waiters)
+
+    def stats(self):
+        """Limits, current occupancy and admission outcomes."""
+        return {
+            "max_inflight": self.max_inflight,
+            "max_queue": self.max_queue,
+            "queue_timeout_ms": self.queue_timeout * 1000.0,
+            "inflight": self.inflight,
+            "queue_depth": self.queue_depth(),
+            "admitted": self._admitted,
+            "queued": self._queued,
+            "rejected": dict(self._rejected),
+            "service_ewma_ms": self._service_s * 1000.0,
+            "retry_after_s": self.retry_after(),
+        }
+
+
+class _ReceiveStream:
+    """wsgi.input fed by ASGI receive(), read from an executor thread."""
+
+    def __init__(self, receive, loop):
+        self._receive = receive
+        self._loop = loop
+        self._buf = bytearray()
+        self._more = True
+
+    def _fill(self):
+        message = asyncio.run_coroutine_threadsafe(self._receive(), self._loop).result()
+        if message["type"] == "http.disconnect":
+            self._more = False
+            raise OSError("client disconnected")
+        self._buf += message.get("body", b"")
+        self._more = message.get("more_body", False)
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            while self._more:
+                self._fill()
+            size = len(self._buf)
+        else:
+            while not self._buf and self._more:
+                self._fill()
+        data = bytes(self._buf[:size])
+        del self._buf[:size]
+        return data
+
+    def readline(self, size=-1):
+        while b"\n" not in self._buf and self._more:
+            self._fill()
+        end = self._buf.find(b"\n") + 1 or len(self._buf)
+        return self.read(end if size is None or size < 0 else min(end, size))
+
+
+def _environ(scope, stream):
+    """WSGI environ for an ASGI http scope."""
+    host, port = scope.get("server") or ("localhost", None)
+    client = scope.get("client") or ("", 0)
+    environ = {
+        "REQUEST_METHOD": scope["method"],
+        "SCRIPT_NAME": scope.get("root_path", "").encode("utf-8").decode("latin-1"),
+        "PATH_INFO": scope["path"].encode("utf-8").decode("latin-1"),
+        "QUERY_STRING": scope.get("query_string", b"").decode("latin-1"),
+        "SERVER_NAME": host,
+        "SERVER_PORT": str(port or 80),
+        "SERVER_PROTOCOL": "HTTP/{}".format(scope.get("http_version", "1.1")),
+        "REMOTE_ADDR": client[0],
+        "REMOTE_PORT": str(client[1]),
+        "wsgi.version": (1, 0),
+        "wsgi.url_scheme": scope.get("scheme", "http"),
+        "wsgi.input": stream,
+        "wsgi.errors": sys.stderr,
+        "wsgi.multithread": True,
+        "wsgi.multiprocess": False,
+        "wsgi.run_once": False,
+        # The ASGI server delimits the body; Flask may read it without a length
+        "wsgi.input_terminated": True,
+    }
+    for name, value in scope.get("headers", ()):
+        name = name.decode("latin-1")
+        if name == "content-type":
+            key = "CONTENT_TYPE"
+        elif name == "content-length":
+            key = "CONTENT_LENGTH"
+        else:
+            key = "HTTP_" + name.upper().replace("-", "_")
+        value = value.decode("latin-1")
+        environ[key] = environ[key] + "," + value if key in environ else value
+    return environ
+
+
+def _header(scope, name):
+    for key, value in scope.get("headers", ()):
+        if key == name:
+            return value.decode("latin-1")
+    return ""
+
+
+async def _read_body(receive):
+    chunks = []
+    while True:
+        message = await receive()
+        if message["type"] == "http.disconnect":
+            raise OSError("client disconnected")
+        chunks.append(message.get("body", b""))
+        if not message.get("more_body"):
+            return b"".join(chunks)
+
+
+def _json(status, payload, headers=()):
+    return status, json.dumps(payload).encode(), "application/json", list(headers)
+
+
+class AsgiApp:
+    """ASGI application over app.server's model, batcher and Flask handlers.
+
+    Args:
+        admission: request admission control
+        executor_threads: inference executor size (0 = one per CPU)
+        reject_status: status of rejected requests (503 or 429)
+    """
+
+    def __init__(self, admission, executor_threads=0, reject_status=503):
+        self.admission = admission
+        self.executor_threads = int(executor_threads) or os.cpu_count() or 1
+        self.reject_status = int(reject_status)
+        self._executor = None
+        self._pid = None
+
+    def executor(self):
+        # Threads do not survive fork(); start a new pool in a new process
+        if self._executor is None or self._pid != os.getpid():
+            self._executor = ThreadPoolExecutor(
+                max_workers=self.executor_threads, thread_name_prefix="inference")
+            self._pid = os.getpid()
+        return self._executor
+
+    def close(self):
+        """Finish queued inference and flush the alert log."""
+        if self._executor is not None and self._pid == os.getpid():
+            self._executor.shutdown(wait=True)
+            self._executor = None
+        server.alert_sink.close()
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "lifespan":
+            await self._lifespan(receive, send)
+            return
+        if scope["type"] != "http":
+            return
+
+        path, method = scope["path"], scope["method"]
+        if method == "GET" and path == "/health":
+            await self._native("health_check", self._health, scope, receive, send)
+        elif method == "GET" and path == "/metrics":
+            await self._native("prometheus_metrics", self._metrics, scope, receive, send)
+        elif method == "GET" and path == "/admission/stats":
+            await self._native("admission_stats", self._admission_stats, scope, receive, send)
+        elif method == "POST" and path in INFERENCE_ENDPOINTS:
+            await self._admitted(INFERENCE_ENDPOINTS[path], scope, receive, send)
+        else:
+            await self._wsgi(scope, receive, send, None)
+
+    async def _lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                await asyncio.get_running_loop().run_in_executor(None, self.close)
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+
+    async def _admitted(self, endpoint, scope, receive, send):
+        try:
+            started = await self.admission.acquire()
+        except Overloaded as e:
+            metrics.REQUESTS.inc(1, (endpoint, str(self.reject_status)))
+            await self._send(send, *_json(self.reject_status, {
+                "error": str(e),
+                "retry_after_s": e.retry_after
+            }, headers=[(b"retry-after", str(e.retry_after).encode())]))
+            return
+        try:
+            if endpoint == "fhir_notify":
+                await self._native(endpoint, self._notify, scope, receive, send)
+            else:
+                await self._wsgi(scope, receive, send, self.executor())
+        finally:
+            self.admission.release(started)
+
+    # ------------------------------------------------------------------
+    async def _native(self, endpoint, handler, scope, receive, send):
+        """Run an async handler returning (status, body, content type, headers)."""
+        server.profiler.request_started()
+        t0 = time.perf_counter()
+        try:
+            status, body, content_type, headers = await handler(scope, receive)
+        finally:
+            server.profiler.request_finished()
+        metrics.REQUEST_SECONDS.observe(time.perf_counter() - t0, (endpoint,))
+        metrics.REQUESTS.inc(1, (endpoint, str(status)))
+        await self._send(send, status, body, content_type, headers)
+
+    @staticmethod
+    async def _send(send, status, body, content_type, headers):
+        await send({
+            "type": "http.response.start",
+            "status": status,
+            "headers": [(b"content-type", content_type.encode()),
+                        (b"content-length", str(len(body)).encode())] + headers,
+        })
+        await send({"type": "http.response.body", "body": body})
+
+    async def _health(self, scope, receive):
+        return _json(200, {
+            "status": "healthy" if server.MODEL_READY else "degraded",
+            "service": "FHIR Hybrid Detection System",
+            "model_ready": bool(server.MODEL_READY),
+            "version": "1.0.0"
+        })
+
+    async def _metrics(self, scope, receive):
+        return (200, metrics.REGISTRY.render().encode(),
+                "text/plain; version=0.0.4; charset=utf-8", [])
+
+    async def _admission_stats(self, scope, receive):
+        stats = self.admission.stats()
+        stats["executor_threads"] = self.executor_threads
+        stats["reject_status"] = self.reject_status
+        return _json(200, stats)
+
+    async def _notify(self, scope, receive):
+        """/fhir/notify: same input and output as the Flask handler."""
+        try:
+            value = _header(scope, server.DEADLINE_HEADER.lower().encode())
+            deadline_ms = server.request_deadline_ms({server.DEADLINE_HEADER: value} if value else {})
+        except ValueError:
+            return _json(400, {"error": "Invalid {} header".format(server.DEADLINE_HEADER)})
+
+        try:
+            body = await _read_body(receive)
+            t0 = time.perf_counter()
+            mimetype = _header(scope, b"content-type").split(";")[0].strip().lower()
+            if mimetype == "application/fhir+json":
+                event = decode_audit_event(body)
+                if not isinstance(event, dict) or event.get("resourceType") != "AuditEvent":
+                    return _json(400, {"error": "Expected a FHIR AuditEvent resource"})
+                t1 = time.perf_counter()
+                features, metadata = extract_features(event)
+                STAGE_SECONDS.observe(t1 - t0, ("decode",))
+                STAGE_SECONDS.observe(time.perf_counter() - t1, ("extract",))
+            else:
+                data = decode_json(body) if body else None
+                t1 = time.perf_counter()
+                STAGE_SECONDS.observe(t1 - t0, ("decode",))
+                if isinstance(data, dict) and "features" not in data and data.get("resourceType") == "AuditEvent":
+                    features, metadata = extract_features(data)
+                    STAGE_SECONDS.observe(time.perf_counter() - t1, ("extract",))
+                elif not isinstance(data, dict) or "features" not in data:
+                    return _json(400, {"error": "Missing 'features' in request body"})
+                else:
+                    features = data["features"]
+                    metadata = data.get("metadata", {})
+
+            model, batcher = server.model, server.batcher
+            if model is None:
+                return _json(500, {"error": "Model not loaded"})
+            if batcher is not None:
+                budget_ms = deadline_ms or batcher.deadline * 1000.0
+                try:
+                    future = batcher.submit(features, meta=metadata, deadline_ms=deadline_ms)
+                except BatchQueueFull as e:
+                    return _json(503, {"error": str(e)})
+                try:
+                    result = await asyncio.wait_for(asyncio.wrap_future(future), budget_ms / 1000.0)
+                except (asyncio.TimeoutError, FutureTimeout):
+                    return _json(504, {"error": "Inference deadline exceeded"})
+            else:
+                started = time.monotonic()
+                deadline = started + deadline_ms / 1000.0 if deadline_ms else None
+                result = await asyncio.get_running_loop().run_in_executor(
+                    self.executor(), functools.partial(model.infer, features, meta=metadata,
+                                                       deadline=deadline))
+                CONTROLLER.observe_latency(time.monotonic() - started)
+
+            server.log_alerts([result])
+
+            t0 = time.perf_counter()
+            response = _json(200, server.notify_payload(result))
+            STAGE_SECONDS.observe(time.perf_counter() - t0, ("serialize",))
+            return response
+
+        except DecodeError as e:
+            return _json(400, {"error": "Invalid JSON: {}".format(e)})
+        except Exception as e:
+            return _json(500, {"error": str(e)})
+
+    # ------------------------------------------------------------------
+    async def _wsgi(self, scope, receive, send, executor):
+        """Run the Flask app for this request on `executor` (None = loop default)."""
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(executor, self._call_wsgi, scope, receive, send, loop)
+
+    @staticmethod
+    def _call_wsgi(scope, receive, send, loop):
+        environ = _environ(scope, _ReceiveStream(receive, loop))
+        response = {}
+
+        def start_response(status, headers, exc_info=None):
+            response["status"] = int(status.split(" ", 1)[0])
+            response["headers"] = [(k.lower().encode("latin-1"), v.encode("latin-1"))
+                                   for k, v in headers]
+            return lambda data: emit_body(data, True)
+
+        def emit(message):
+            asyncio.run_coroutine_threadsafe(send(message), loop).result()
+
+        def emit_body(data, more):
+            if "sent" not in response:
+                response["sent"] = True
+                emit({"type": "http.response.start", "status": response["status"],
+                      "headers": response["headers"]})
+            emit({"type": "http.response.body", "body": data, "more_body": more})
+
+        result = server.app(environ, start_response)
+        try:
+            for chunk in result:
+                if chunk:
+                    emit_body(chunk, True)
+            emit_body(b"", False)
+        finally:
+            close = getattr(result, "close", None)
+            if close is not None:
+                close()
+
+
+app = AsgiApp(
+    Admission(
+        max_inflight=config.ASGI_MAX_INFLIGHT,
+        max_queue=config.ASGI_MAX_QUEUE,
+        queue_timeout_ms=config.ASGI_QUEUE_TIMEOUT_MS,
+    ),
+    executor_threads=config.ASGI_EXECUTOR_THREADS,
+    reject_status=config.ASGI_REJECT_STATUS,
+)
+
+metrics.REGISTRY.callback(
+    "fhir_admission_requests", "Requests holding or waiting for an admission slot",
+    lambda: {("inflight",): app.admission.inflight, ("queued",): app.admission.queue_depth()},
+    labelnames=("state",),
+)
+# Requests waiting for admission count towards degrading the pipeline
+CONTROLLER.add_queue("admission", app.admission.queue_depth)
+
+
+def main(argv=None):
+    import argparse
+
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=config.ASGI_PORT)
+    args = parser.parse_args(argv)
+
+    try:
+        import uvicorn
+    except ImportError:
+        print("[asgi] uvicorn is not installed (pip install uvicorn); "
+              "app.asgi:app can be served by any ASGI server")
+        return 2
+
+    print("[asgi] listening on {}:{}, {} in flight + {} queued, {} inference threads".format(
+        args.host, args.port, app.admission.max_inflight, app.admission.max_queue,
+        app.executor_threads))
+    uvicorn.run(app, host=args.host, port=args.port, lifespan="on",
+                access_log=False, log_level="warning")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
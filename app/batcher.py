@@ -0,0 +1,218 @@
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future, TimeoutError as FutureTimeout
+
+import numpy as np
+
+from app.load_control import CONTROLLER
+
+
+class BatchQueueFull(RuntimeError):
+    """Raised when the micro-batcher queue is at capacity."""
+
+
+class _Pending:
+    __slots__ = ("features", "meta", "expires", "deadline", "future", "submitted")
+
+    def __init__(self, features, meta, expires, deadline):
+        self.features = features
+        self.meta = meta
+        self.expires = expires      # dropped if still queued at this time
+        self.deadline = deadline    # client's inference deadline, or None
+        self.future = Future()
+        self.submitted = time.monotonic()
+
+
+class MicroBatcher:
+    """Dynamic micro-batching in front of `HybridDeployedModel.infer_batch`.
+
+    Concurrent single-sample requests are queued; a worker thread gathers
+    them for up to `window_ms` (or until `max_batch` are waiting), runs one
+    batched hybrid inference and resolves each caller's future with its
+    own result. Requests still queued after `deadline_ms` (or their own
+    deadline) are dropped. Only deadlines set by the client bound the
+    inference (see app.load_control); the queue budget does not.
+
+    A gathered batch is split by deadline so no request is degraded for a
+    stricter neighbour: requests without a deadline run as one group, and
+    requests with one are grouped while their deadlines lie within one
+    window of the group's earliest, which bounds the group. Deadline groups
+    run first, earliest first.
+
+    The mean request latency of each group (queue wait plus inference) is
+    the latency signal of the load controller.
+    """
+
+    def __init__(self, model, window_ms=2.0, max_batch=64, deadline_ms=1000.0, max_queue=1024):
+        self.model = model
+        self.window = max(0.0, float(window_ms)) / 1000.0
+        self.max_batch = max(1, int(max_batch))
+        self.deadline = float(deadline_ms) / 1000.0
+        self.max_queue = int(max_queue)
+
+        self._lock = threading.Lock()
+        self._queue = None
+        self._worker = None
+        self._pid = None
+
+        # Realized batch statistics (written by the worker thread only)
+        self._batches = 0
+        self._samples = 0
+        self._expired = 0
+        self._last_batch = 0
+        self._max_batch_seen = 0
+        self._size_hist = {}
+
+    # ------------------------------------------------------------------
+    def _ensure_worker(self):
+        # Threads do not survive fork(); restart the worker in a new process
+        if self._worker is not None and self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._worker is not None and self._pid == os.getpid():
+                return
+            self._queue = queue.Queue(maxsize=self.max_queue)
+            self._pid = os.getpid()
+            self._worker = threading.Thread(target=self._run, name="micro-batcher", daemon=True)
+            self._worker.start()
+
+    def submit(self, features, meta=None, deadline_ms=None):
+        """Queue one sample and return a Future resolving to its result dict.
+
+        Args:
+            deadline_ms: the client's deadline (X-Deadline-Ms); None = queue
+                budget only, no inference deadline
+
+        Raises:
+            BatchQueueFull: if the queue is at capacity
+        """
+        self._ensure_worker()
+        now = time.monotonic()
+        if deadline_ms is None:
+            item = _Pending(features, meta, now + self.deadline, None)
+        else:
+            deadline = now + float(deadline_ms) / 1000.0
+            item = _Pending(features, meta, deadline, deadline)
+        try:
+            self._queue.put_nowait(item)
+        except queue.Full:
+            raise BatchQueueFull("micro-batcher queue full ({} pending)".format(self.max_queue))
+        return item.future
+
+    def infer(self, features, meta=None, deadline_ms=None):
+        """Blocking single-sample inference through the batcher.
+
+        Raises:
+            BatchQueueFull: if the queue is at capacity
+            concurrent.futures.TimeoutError: if the deadline expires
+        """
+        budget = self.deadline if deadline_ms is None else float(deadline_ms) / 1000.0
+        future = self.submit(features, meta=meta, deadline_ms=deadline_ms)
+        try:
+            return future.result(timeout=budget)
+        except FutureTimeout:
+            future.cancel()
+            raise
+
+    # ------------------------------------------------------------------
+    def _collect(self):
+        batch = [self._queue.get()]
+        end = time.monotonic() + self.window
+        while len(batch) < self.max_batch:
+            remaining = end - time.monotonic()
+            try:
+                if remaining <= 0:
+                    batch.append(self._queue.get_nowait())
+                else:
+                    batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+
+            now = time.monotonic()
+            live = []
+            for item in batch:
+                if item.expires < now:
+                    self._expired += 1
+                    if item.future.set_running_or_notify_cancel():
+                        item.future.set_exception(FutureTimeout("deadline expired before dispatch"))
+                elif item.future.set_running_or_notify_cancel():
+                    live.append(item)
+            for group, deadline in self._split(live):
+                self._dispatch(group, deadline)
+
+    def _split(self, live):
+        """(items, deadline) groups: deadline-bound ones earliest first, then the rest."""
+        groups = []
+        bound = sorted((item for item in live if item.deadline is not None),
+                       key=lambda item: item.deadline)
+        start = 0
+        for i in range(1, len(bound) + 1):
+            if i == len(bound) or bound[i].deadline - bound[start].deadline > self.window:
+                groups.append((bound[start:i], bound[start].deadline))
+                start = i
+        unbound = [item for item in live if item.deadline is None]
+        if unbound:
+            groups.append((unbound, None))
+        return groups
+
+    def _dispatch(self, items, deadline):
+        self._record(len(items))
+        try:
+            results = self.model.infer_batch(
+                np.asarray([item.features for item in items], dtype=np.float32),
+                metas=[item.meta for item in items],
+                deadline=deadline,
+            )
+        except Exception:
+            # One malformed sample must not fail its neighbours: retry singly
+            results = []
+            for item in items:
+                try:
+                    results.append(self.model.infer(
+                        item.features, meta=item.meta, deadline=item.deadline))
+                except Exception as e:
+                    results.append(e)
+
+        done = time.monotonic()
+        CONTROLLER.observe_latency(sum(done - item.submitted for item in items) / len(items))
+        for item, result in zip(items, results):
+            if isinstance(result, Exception):
+                item.future.set_exception(result)
+            else:
+                item.future.set_result(result)
+
+    def _record(self, size):
+        self._batches += 1
+        self._samples += size
+        self._last_batch = size
+        self._max_batch_seen = max(self._max_batch_seen, size)
+        bucket = 1
+        while bucket < size:
+            bucket <<= 1
+        self._size_hist[bucket] = self._size_hist.get(bucket, 0) + 1
+
+    def queue_depth(self):
+        return self._queue.qsize() if self._queue is not None else 0
+
+    def stats(self):
+        """Queue depth and realized batch size statistics."""
+        return {
+            "window_ms": self.window * 1000.0,
+            "max_batch": self.max_batch,
+            "deadline_ms": self.deadline * 1000.0,
+            "queue_depth": self.queue_depth(),
+            "batches": self._batches,
+            "samples": self._samples,
+            "expired": self._expired,
+            "last_batch_size": self._last_batch,
+            "max_batch_size": self._max_batch_seen,
+            "mean_batch_size": (self._samples / self._batches) if self._batches else 0.0,
+            "batch_size_hist": {"<={}".format(k): v for k, v in sorted(self._size_hist.items())},
+        }
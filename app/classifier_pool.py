@@ -0,0 +1,113 @@
+"""Persistent thread pool that runs the RF and XGB stages side by side.
+
+Both classifiers do their heavy lifting in code that releases the GIL:
+sklearn's Cython tree traversal, xgboost's C++ predictor, and the large
+NumPy gathers of the compiled forests. Run back to back, their latencies
+add up. Run on two threads, the stage costs roughly the slower of the two.
+
+The calling thread runs the first function itself and the pool runs the
+rest, so a request costs one hand-off rather than two. The pool threads are
+started lazily and restarted after fork(), like the micro-batcher's worker.
+
+Each native predictor's own thread count (sklearn n_jobs, xgboost nthread)
+is set at load with set_library_threads() from the CPU budget (see
+app.thread_budget), so two predictors running at once do not oversubscribe
+the cores: with the pool on a 4-core Nano each gets 2.
+"""
+
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from app import config
+from app.thread_budget import visible_cpus
+
+
+def timed(fn):
+    """Run `fn()`; returns (result, seconds)."""
+    t0 = time.perf_counter()
+    result = fn()
+    return result, time.perf_counter() - t0
+
+
+class ClassifierPool:
+    """Runs independent classifier calls concurrently.
+
+    Args:
+        threads: pool threads (the caller's thread runs one call as well)
+    """
+
+    def __init__(self, threads=2):
+        self.threads = max(1, int(threads))
+        self._lock = threading.Lock()
+        self._executor = None
+        self._pid = None
+        self._calls = 0
+
+    def _ensure_executor(self):
+        # Threads do not survive fork(); start a new pool in a new process
+        if self._executor is not None and self._pid == os.getpid():
+            return self._executor
+        with self._lock:
+            if self._executor is None or self._pid != os.getpid():
+                self._executor = ThreadPoolExecutor(
+                    max_workers=self.threads, thread_name_prefix="classifier")
+                self._pid = os.getpid()
+        return self._executor
+
+    def run(self, *fns):
+        """Call every function, the first on this thread; returns [(result, seconds)].
+
+        Exceptions propagate after all calls have finished.
+        """
+        executor = self._ensure_executor()
+        futures = [executor.submit(timed, fn) for fn in fns[1:]]
+        self._calls += 1
+        try:
+            first = timed(fns[0])
+        finally:
+            rest = [f.result() for f in futures]
+        return [first] + rest
+
+    def close(self):
+        if self._executor is not None and self._pid == os.getpid():
+            self._executor.shutdown(wait=True)
+        self._executor = None
+
+    def stats(self):
+        return {"threads": self.threads, "calls": self._calls}
+
+
+def pool_enabled():
+    """CLASSIFIER_POOL: "1", "0", or "auto" (on with two or more usable CPUs)."""
+    if config.CLASSIFIER_POOL == "auto":
+        return visible_cpus() > 1
+    return config.CLASSIFIER_POOL == "1"
+
+
+def set_library_threads(rf_model, xgb_model, rf_jobs, xgb_jobs):
+    """Apply thread counts (see app.thread_budget) to the loaded estimators.
+
+    Returns:
+        dict name -> thread count applied (None when left unchanged)
+    """
+    applied = {"rf": None, "xgb": None}
+    if rf_model is not None and rf_jobs is not None and hasattr(rf_model, "n_jobs"):
+        rf_model.n_jobs = rf_jobs
+        applied["rf"] = rf_jobs
+    if xgb_model is not None and xgb_jobs is not None:
+        try:
+            if hasattr(xgb_model, "get_booster"):
+                xgb_model.set_params(n_jobs=xgb_jobs)
+                xgb_model.get_booster().set_param({"nthread": xgb_jobs})
+            else:
+                xgb_model.set_param({"nthread": xgb_jobs})
+            applied["xgb"] = xgb_jobs
+        except Exception as e:
+            print("[Hybrid Model] ⚠ Could not set XGB threads: {}".format(e))
+    return applied
+
+
+# Shared by every model instance (reloads included); None when disabled
+POOL = ClassifierPool(config.CLASSIFIER_POOL_THREADS) if pool_enabled() else None
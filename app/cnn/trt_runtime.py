@@ -14,28 +14,45 @@ Workflow:
 """
 
 import numpy as np
+import importlib.util
 import logging
+import threading
 from typing import Optional, Tuple
 import os
 
 logger = logging.getLogger(__name__)
 
-# TensorRT optional (may not be available on dev machine)
-try:
-    import tensorrt as trt
-    import pycuda.driver as cuda
-    import pycuda.autoinit
-    HAS_TENSORRT = True
-except ImportError:
-    HAS_TENSORRT = False
+# TensorRT and ONNX Runtime are optional and imported on first use, so that
+# importing this module neither creates a CUDA context nor loads onnxruntime.
+HAS_TENSORRT = (
+    importlib.util.find_spec("tensorrt") is not None
+    and importlib.util.find_spec("pycuda") is not None
+)
+if not HAS_TENSORRT:
     logger.debug("TensorRT not available. Will use ONNX Runtime fallback.")
 
 # ONNX Runtime for CPU/fallback
-try:
-    import onnxruntime as ort
-    HAS_ONNXRUNTIME = True
-except ImportError:
-    HAS_ONNXRUNTIME = False
+HAS_ONNXRUNTIME = importlib.util.find_spec("onnxruntime") is not None
+
+trt = None
+cuda = None
+ort = None
+
+
+def _import_tensorrt():
+    global trt, cuda
+    if trt is None:
+        import tensorrt as _trt
+        import pycuda.driver as _cuda
+        import pycuda.autoinit  # noqa: F401  (creates the CUDA context)
+        trt, cuda = _trt, _cuda
+
+
+def _import_onnxruntime():
+    global ort
+    if ort is None:
+        import onnxruntime as _ort
+        ort = _ort
 
 
 class TensorRTCNNRuntime:
@@ -70,6 +87,7 @@ class TensorRTCNNRuntime:
         if not os.path.exists(engine_path):
             raise FileNotFoundError(f"TensorRT engine not found: {engine_path}")
         
+        _import_tensorrt()
         logger.info(f"Loading TensorRT engine: {engine_path}")
         
         # Deserialize engine
@@ -183,14 +201,45 @@ class ONNXRuntimeCNNFallback:
     
     Used when TensorRT not available (e.g., development machine).
     Much slower than TensorRT but guarantees inference capability.
+    
+    The session is built with explicit SessionOptions (thread counts, graph
+    optimization level) and, when possible, the optimized graph is cached
+    next to the model so later starts skip optimization. Steady-state calls
+    go through IOBinding with per-thread preallocated input/output buffers
+    for a fixed set of batch-size buckets; batches are padded up to the
+    nearest bucket and larger batches are chunked.
     """
     
-    def __init__(self, onnx_path: str):
+    GRAPH_OPT_LEVELS = {
+        "disable": "ORT_DISABLE_ALL",
+        "basic": "ORT_ENABLE_BASIC",
+        "extended": "ORT_ENABLE_EXTENDED",
+        "all": "ORT_ENABLE_ALL",
+    }
+    
+    def __init__(
+        self,
+        onnx_path: str,
+        intra_op_threads: int = 0,
+        inter_op_threads: int = 0,
+        graph_optimization: str = "all",
+        optimized_model_path: Optional[str] = "",
+        batch_buckets: Tuple[int, ...] = (1, 8, 32, 128, 512),
+    ):
         """
         Load ONNX model via ONNX Runtime.
         
         Args:
             onnx_path: Path to .onnx file
+            intra_op_threads: Threads per operator (0 = ONNX Runtime default)
+            inter_op_threads: Threads across operators (0 = ONNX Runtime default)
+            graph_optimization: "disable", "basic", "extended" or "all"
+            optimized_model_path: Where to cache the optimized graph; "" derives
+                `<model>.opt.<level>.onnx`, None disables the cache. The
+                level ("basic" or "extended"; "all" is cached as "extended")
+                is always inserted before the extension
+            batch_buckets: Batch sizes with preallocated IOBinding buffers
+                (empty disables IOBinding)
             
         Raises:
             FileNotFoundError: If ONNX file not found
@@ -204,12 +253,104 @@ class ONNXRuntimeCNNFallback:
         if not os.path.exists(onnx_path):
             raise FileNotFoundError(f"ONNX model not found: {onnx_path}")
         
+        _import_onnxruntime()
         logger.info(f"Loading ONNX model (CPU fallback): {onnx_path}")
-        self.session = ort.InferenceSession(onnx_path)
         
-        input_name = self.session.get_inputs()[0].name
-        self.input_name = input_name
-        logger.info(f"  ONNX input: {input_name}")
+        options = ort.SessionOptions()
+        options.intra_op_num_threads = int(intra_op_threads)
+        options.inter_op_num_threads = int(inter_op_threads)
+        level = self.GRAPH_OPT_LEVELS.get(graph_optimization)
+        if level is None:
+            raise ValueError(f"Unknown graph optimization level: {graph_optimization}")
+        options.graph_optimization_level = getattr(ort.GraphOptimizationLevel, level)
+        
+        # Only portable levels are written to disk: "all" adds layout and
+        # hardware-specific rewrites that must not be reused on another host.
+        # The cache holds the graph at "extended" at most and the remaining
+        # "all" passes run on every load. The level is part of the filename,
+        # so changing ORT_GRAPH_OPT never loads a graph cached at another level.
+        cache_opt = "extended" if graph_optimization == "all" else graph_optimization
+        if optimized_model_path == "":
+            optimized_model_path = os.path.splitext(onnx_path)[0] + ".opt.onnx"
+        if optimized_model_path:
+            base, ext = os.path.splitext(optimized_model_path)
+            optimized_model_path = "{}.{}{}".format(base, cache_opt, ext or ".onnx")
+        model_path = onnx_path
+        if optimized_model_path and level != "ORT_DISABLE_ALL":
+            fresh = (os.path.exists(optimized_model_path)
+                     and os.path.getmtime(optimized_model_path) >= os.path.getmtime(onnx_path))
+            if not fresh and os.access(os.path.dirname(os.path.abspath(optimized_model_path)), os.W_OK):
+                logger.info(f"  Caching optimized graph ({cache_opt}) to: {optimized_model_path}")
+                if cache_opt == graph_optimization:
+                    options.optimized_model_filepath = optimized_model_path
+                else:
+                    # Write the portable graph with a throwaway session
+                    writer = ort.SessionOptions()
+                    writer.graph_optimization_level = getattr(
+                        ort.GraphOptimizationLevel, self.GRAPH_OPT_LEVELS[cache_opt])
+                    writer.optimized_model_filepath = optimized_model_path
+                    try:
+                        ort.InferenceSession(onnx_path, sess_options=writer,
+                                             providers=["CPUExecutionProvider"])
+                        fresh = os.path.exists(optimized_model_path)
+                    except Exception as e:
+                        logger.warning(f"  Could not cache optimized graph: {e}")
+            if fresh:
+                # Cached graph is optimized up to cache_opt; only "all" has passes left
+                model_path = optimized_model_path
+                if graph_optimization != "all":
+                    options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_DISABLE_ALL
+                logger.info(f"  Using cached optimized graph: {optimized_model_path}")
+        self.model_path = model_path
+        
+        self.session = ort.InferenceSession(
+            model_path, sess_options=options, providers=["CPUExecutionProvider"]
+        )
+        
+        input_meta = self.session.get_inputs()[0]
+        self.input_name = input_meta.name
+        self.output_name = self.session.get_outputs()[0].name
+        logger.info(f"  ONNX input: {self.input_name}")
+        
+        # Per-sample shapes; output shape is learned from one warm-up run
+        self.sample_shape = tuple(input_meta.shape[1:])
+        fixed_batch = input_meta.shape[0] if isinstance(input_meta.shape[0], int) else None
+        self.batch_buckets = ()
+        if all(isinstance(d, int) for d in self.sample_shape):
+            warm = self.session.run(None, {self.input_name: np.zeros((fixed_batch or 1,) + self.sample_shape, np.float32)})
+            self.output_sample_shape = tuple(warm[0].shape[1:])
+            buckets = (fixed_batch,) if fixed_batch else batch_buckets
+            self.batch_buckets = tuple(sorted(set(int(b) for b in buckets if int(b) > 0)))
+        self._local = threading.local()
+    
+    def _binding(self, bucket: int):
+        """Per-thread (IOBinding, input buffer, output buffer) for a bucket."""
+        slots = getattr(self._local, "slots", None)
+        if slots is None:
+            slots = self._local.slots = {}
+        slot = slots.get(bucket)
+        if slot is None:
+            inp = np.zeros((bucket,) + self.sample_shape, dtype=np.float32)
+            out = np.empty((bucket,) + self.output_sample_shape, dtype=np.float32)
+            binding = self.session.io_binding()
+            binding.bind_input(self.input_name, "cpu", 0, np.float32, inp.shape, inp.ctypes.data)
+            binding.bind_output(self.output_name, "cpu", 0, np.float32, out.shape, out.ctypes.data)
+            slot = slots[bucket] = (binding, inp, out)
+        return slot
+    
+    def _run_bucketed(self, input_data: np.ndarray) -> np.ndarray:
+        n = input_data.shape[0]
+        largest = self.batch_buckets[-1]
+        if n > largest:
+            return np.concatenate([
+                self._run_bucketed(input_data[start:start + largest])
+                for start in range(0, n, largest)
+            ])
+        bucket = next(b for b in self.batch_buckets if b >= n)
+        binding, inp, out = self._binding(bucket)
+        inp[:n] = input_data
+        self.session.run_with_iobinding(binding)
+        return out[:n].copy()
     
     def infer(self, input_data: np.ndarray) -> np.ndarray:
         """
@@ -224,6 +365,9 @@ class ONNXRuntimeCNNFallback:
         if input_data.dtype != np.float32:
             input_data = input_data.astype(np.float32)
         
+        if self.batch_buckets and input_data.shape[1:] == self.sample_shape:
+            return self._run_bucketed(input_data)
+        
         outputs = self.session.run(None, {self.input_name: input_data})
         return outputs[0]
     
@@ -8,15 +8,32 @@ LOG_FILE = os.getenv("LOG_FILE", "logs/alerts.log")
 # ---------------- CLASSES ----------------
 NORMAL_CLASS = os.getenv("NORMAL_CLASS", "Normal")
 
-# ---------------- SEVERITY ----------------
+# ---------------- AE THRESHOLDS / SEVERITY (see app.quantiles) ----------------
+# Reconstruction MSE: below LOW fast-exits as normal; MEDIUM / HIGH set severity
 try:
-    SEV_HIGH = float(os.getenv("SEV_HIGH", "0.95"))
-    SEV_MED = float(os.getenv("SEV_MED", "0.85"))
-    SEV_LOW = float(os.getenv("SEV_LOW", "0.50"))
+    AE_THRESHOLD_LOW = float(os.getenv("AE_THRESHOLD_LOW", "0.01"))
+    AE_THRESHOLD_MEDIUM = float(os.getenv("AE_THRESHOLD_MEDIUM", "0.05"))
+    AE_THRESHOLD_HIGH = float(os.getenv("AE_THRESHOLD_HIGH", "0.1"))
 except ValueError:
-    SEV_HIGH = 0.95
-    SEV_MED = 0.85
-    SEV_LOW = 0.50
+    AE_THRESHOLD_LOW = 0.01
+    AE_THRESHOLD_MEDIUM = 0.05
+    AE_THRESHOLD_HIGH = 0.1
+try:
+    # Move LOW to this quantile of live AE scores (the fast-exit ratio), within
+    # [AE_LOW_MIN, AE_LOW_MAX] and never above MEDIUM; 0 keeps LOW fixed
+    AE_TARGET_FAST_EXIT = float(os.getenv("AE_TARGET_FAST_EXIT", "0"))
+    AE_LOW_MIN = float(os.getenv("AE_LOW_MIN", "0.005"))
+    AE_LOW_MAX = float(os.getenv("AE_LOW_MAX", "0.05"))
+    # Scores per quantile window; LOW is re-evaluated when a window completes
+    AE_QUANTILE_WINDOW = int(os.getenv("AE_QUANTILE_WINDOW", "10000"))
+    # Scores sampled per inference call (bounds the sketch's cost per batch)
+    AE_QUANTILE_SAMPLE_ROWS = int(os.getenv("AE_QUANTILE_SAMPLE_ROWS", "64"))
+except ValueError:
+    AE_TARGET_FAST_EXIT = 0.0
+    AE_LOW_MIN = 0.005
+    AE_LOW_MAX = 0.05
+    AE_QUANTILE_WINDOW = 10000
+    AE_QUANTILE_SAMPLE_ROWS = 64
 
 # ---------------- PLATFORM DETECTION ----------------
 IS_JETSON = (
@@ -26,3 +43,205 @@ IS_JETSON = (
 
 USE_TENSORRT = IS_JETSON
 
+# ---------------- MODEL BUNDLE ----------------
+# Packed artifacts inside MODELS_DIR (python -m app.model_bundle convert models/),
+# preferred over the pickles when present and up to date; "" disables
+MODEL_BUNDLE = os.getenv("MODEL_BUNDLE", "model.bundle")
+# Verify every array checksum at load (reads the whole file once)
+BUNDLE_VERIFY = os.getenv("BUNDLE_VERIFY", "1") == "1"
+
+# ---------------- AUTOENCODER BACKEND ----------------
+# "auto" or one of: tensorrt, onnxruntime, torch, numpy (see app.ae_backends)
+AE_BACKEND = os.getenv("AE_BACKEND", "auto")
+# Set by app.prefork before the model loads: backends other than numpy are
+# created in each worker after fork instead of in the master
+AE_PER_WORKER = False
+
+# ONNX Runtime session tuning (onnxruntime backend)
+ORT_GRAPH_OPT = os.getenv("ORT_GRAPH_OPT", "all")
+# "" caches the optimized graph as <model>.opt.<level>.onnx; "none" disables the
+# cache. "all" is cached at "extended" (portable) and finished at each load
+ORT_OPTIMIZED_MODEL = os.getenv("ORT_OPTIMIZED_MODEL", "")
+try:
+    # 0 = from the CPU budget (see app.thread_budget)
+    ORT_INTRA_OP_THREADS = int(os.getenv("ORT_INTRA_OP_THREADS", "0"))
+    ORT_INTER_OP_THREADS = int(os.getenv("ORT_INTER_OP_THREADS", "0"))
+    ORT_BATCH_BUCKETS = tuple(
+        int(b) for b in os.getenv("ORT_BATCH_BUCKETS", "1,8,32,128,512").split(",") if b.strip()
+    )
+except ValueError:
+    ORT_INTRA_OP_THREADS = 0
+    ORT_INTER_OP_THREADS = 0
+    ORT_BATCH_BUCKETS = (1, 8, 32, 128, 512)
+
+
+# ---------------- MICRO-BATCHING (/fhir/notify) ----------------
+BATCH_ENABLED = os.getenv("BATCH_ENABLED", "1") == "1"
+try:
+    BATCH_WINDOW_MS = float(os.getenv("BATCH_WINDOW_MS", "2"))
+    BATCH_MAX_SIZE = int(os.getenv("BATCH_MAX_SIZE", "64"))
+    # Queue budget: notify requests still queued after this get 504; it is not
+    # an inference deadline (only X-Deadline-Ms is, see app.load_control)
+    BATCH_DEADLINE_MS = float(os.getenv("BATCH_DEADLINE_MS", "1000"))
+    BATCH_MAX_QUEUE = int(os.getenv("BATCH_MAX_QUEUE", "1024"))
+except ValueError:
+    BATCH_WINDOW_MS = 2.0
+    BATCH_MAX_SIZE = 64
+    BATCH_DEADLINE_MS = 1000.0
+    BATCH_MAX_QUEUE = 1024
+
+# ---------------- COMPILED FOREST (RF + XGB) ----------------
+USE_COMPILED_FOREST = os.getenv("USE_COMPILED_FOREST", "1") == "1"
+try:
+    # Above this batch size native predict_proba (multi-threaded C) wins
+    COMPILED_FOREST_MAX_BATCH = int(os.getenv("COMPILED_FOREST_MAX_BATCH", "128"))
+except ValueError:
+    COMPILED_FOREST_MAX_BATCH = 128
+
+# ---------------- CLASSIFIER STAGE (see app.classifier_pool) ----------------
+# Run RF and XGB side by side on a persistent thread pool: 1, 0 or auto (2+ CPUs)
+CLASSIFIER_POOL = os.getenv("CLASSIFIER_POOL", "auto")
+try:
+    CLASSIFIER_POOL_THREADS = int(os.getenv("CLASSIFIER_POOL_THREADS", "2"))
+    # Fewer classified rows than this run on the calling thread (hand-off cost)
+    CLASSIFIER_POOL_MIN_ROWS = int(os.getenv("CLASSIFIER_POOL_MIN_ROWS", "1"))
+    # Threads per native predictor; 0 = from the CPU budget (see below)
+    RF_N_JOBS = int(os.getenv("RF_N_JOBS", "0"))
+    XGB_N_JOBS = int(os.getenv("XGB_N_JOBS", "0"))
+except ValueError:
+    CLASSIFIER_POOL_THREADS = 2
+    CLASSIFIER_POOL_MIN_ROWS = 1
+    RF_N_JOBS = 0
+    XGB_N_JOBS = 0
+
+# Cascade: run CASCADE_FIRST ("rf" or "xgb") alone and add the other classifier
+# only where its top-1 minus top-2 probability is below CASCADE_MARGIN;
+# 0 disables. Calibrate with tools/calibrate_cascade.py
+CASCADE_FIRST = os.getenv("CASCADE_FIRST", "rf")
+try:
+    CASCADE_MARGIN = float(os.getenv("CASCADE_MARGIN", "0"))
+except ValueError:
+    CASCADE_MARGIN = 0.0
+
+# ---------------- CPU THREAD BUDGET (see app.thread_budget) ----------------
+# Split CPU_BUDGET across the serving workers and, within a worker, across
+# sklearn, xgboost, torch, ONNX Runtime and BLAS at model load. 0 disables:
+# only the explicit per-library settings apply
+THREAD_BUDGET = os.getenv("THREAD_BUDGET", "1") == "1"
+try:
+    # Total CPUs for the whole service; 0 = every CPU this process may run on
+    CPU_BUDGET = int(os.getenv("CPU_BUDGET", "0"))
+    # Explicit per-library counts (0 = from the budget); see also RF_N_JOBS,
+    # XGB_N_JOBS and ORT_*_OP_THREADS
+    TORCH_THREADS = int(os.getenv("TORCH_THREADS", "0"))
+    BLAS_THREADS = int(os.getenv("BLAS_THREADS", "0"))
+except ValueError:
+    CPU_BUDGET = 0
+    TORCH_THREADS = 0
+    BLAS_THREADS = 0
+# Set by app.prefork before the model loads: processes sharing CPU_BUDGET
+SERVING_WORKERS = 1
+
+# ---------------- FEATURE EXTRACTION ----------------
+try:
+    # Bounded LRU memo for hashed categorical values (users, IPs, codes)
+    FEATURE_HASH_CACHE_SIZE = int(os.getenv("FEATURE_HASH_CACHE_SIZE", "65536"))
+except ValueError:
+    FEATURE_HASH_CACHE_SIZE = 65536
+
+# ---------------- STREAMING (/fhir/stream) ----------------
+try:
+    STREAM_BATCH_SIZE = int(os.getenv("STREAM_BATCH_SIZE", "256"))
+    STREAM_READ_BYTES = int(os.getenv("STREAM_READ_BYTES", "65536"))
+except ValueError:
+    STREAM_BATCH_SIZE = 256
+    STREAM_READ_BYTES = 65536
+
+# ---------------- BULK REQUESTS (/fhir/batch) ----------------
+try:
+    # Larger "samples" lists are rejected with 413; 0 = no limit
+    FHIR_BATCH_MAX_SAMPLES = int(os.getenv("FHIR_BATCH_MAX_SAMPLES", "4096"))
+except ValueError:
+    FHIR_BATCH_MAX_SAMPLES = 4096
+
+# ---------------- ALERT LOG ----------------
+ALERT_FSYNC = os.getenv("ALERT_FSYNC", "1") == "1"
+try:
+    ALERT_QUEUE_SIZE = int(os.getenv("ALERT_QUEUE_SIZE", "4096"))
+    ALERT_FLUSH_MS = float(os.getenv("ALERT_FLUSH_MS", "200"))
+    ALERT_FLUSH_BYTES = int(os.getenv("ALERT_FLUSH_BYTES", "65536"))
+    # Rotate by renaming to LOG_FILE.1 .. LOG_FILE.<ALERT_BACKUPS>; 0 disables
+    ALERT_MAX_BYTES = int(os.getenv("ALERT_MAX_BYTES", str(50 * 1024 * 1024)))
+    ALERT_ROTATE_S = float(os.getenv("ALERT_ROTATE_S", "86400"))
+    ALERT_BACKUPS = int(os.getenv("ALERT_BACKUPS", "5"))
+except ValueError:
+    ALERT_QUEUE_SIZE = 4096
+    ALERT_FLUSH_MS = 200.0
+    ALERT_FLUSH_BYTES = 65536
+    ALERT_MAX_BYTES = 50 * 1024 * 1024
+    ALERT_ROTATE_S = 86400.0
+    ALERT_BACKUPS = 5
+
+# ---------------- ADMIN ----------------
+# Required in the X-Admin-Token header of /admin/* requests; when empty,
+# admin endpoints only answer requests from localhost
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN", "")
+try:
+    PROFILE_MAX_SECONDS = float(os.getenv("PROFILE_MAX_SECONDS", "60"))
+except ValueError:
+    PROFILE_MAX_SECONDS = 60.0
+
+# ---------------- RESULT CACHE ----------------
+try:
+    # Identical post-mask feature rows reuse the previous result; 0 (default)
+    # disables, e.g. 4096 for nodes with retrying or chatty clients
+    RESULT_CACHE_SIZE = int(os.getenv("RESULT_CACHE_SIZE", "0"))
+    RESULT_CACHE_TTL_S = float(os.getenv("RESULT_CACHE_TTL_S", "300"))
+except ValueError:
+    RESULT_CACHE_SIZE = 0
+    RESULT_CACHE_TTL_S = 300.0
+
+# ---------------- PRE-FORK SERVING (python -m app.prefork) ----------------
+try:
+    # 0 = one worker per CPU this process may run on (affinity mask)
+    PREFORK_WORKERS = int(os.getenv("PREFORK_WORKERS", "0"))
+    PREFORK_PORT = int(os.getenv("PREFORK_PORT", "5000"))
+except ValueError:
+    PREFORK_WORKERS = 0
+    PREFORK_PORT = 5000
+
+# ---------------- ASYNC SERVING (python -m app.asgi) ----------------
+try:
+    # Threads running inference for admitted requests; 0 = one per CPU
+    ASGI_EXECUTOR_THREADS = int(os.getenv("ASGI_EXECUTOR_THREADS", "0"))
+    # Requests processed at once; beyond this they wait in the admission queue
+    ASGI_MAX_INFLIGHT = int(os.getenv("ASGI_MAX_INFLIGHT", "64"))
+    # Waiting requests; when full, new ones are rejected with Retry-After
+    ASGI_MAX_QUEUE = int(os.getenv("ASGI_MAX_QUEUE", "128"))
+    ASGI_QUEUE_TIMEOUT_MS = float(os.getenv("ASGI_QUEUE_TIMEOUT_MS", "1000"))
+    # 503 (server overloaded) or 429 (client should slow down)
+    ASGI_REJECT_STATUS = int(os.getenv("ASGI_REJECT_STATUS", "503"))
+    ASGI_PORT = int(os.getenv("ASGI_PORT", "5000"))
+except ValueError:
+    ASGI_EXECUTOR_THREADS = 0
+    ASGI_MAX_INFLIGHT = 64
+    ASGI_MAX_QUEUE = 128
+    ASGI_QUEUE_TIMEOUT_MS = 1000.0
+    ASGI_REJECT_STATUS = 503
+    ASGI_PORT = 5000
+
+# ---------------- LOAD CONTROL (see app.load_control) ----------------
+# "auto", or pin the pipeline to one of: full, ae_rf, ae_only
+LOAD_MODE = os.getenv("LOAD_MODE", "auto")
+try:
+    # Queued requests / EWMA inference latency that step full -> ae_rf (2x: -> ae_only)
+    LOAD_QUEUE_HIGH = int(os.getenv("LOAD_QUEUE_HIGH", "256"))
+    LOAD_LATENCY_HIGH_MS = float(os.getenv("LOAD_LATENCY_HIGH_MS", "250"))
+    # Step back up below this fraction of the marks, after LOAD_HOLD_S in a mode
+    LOAD_RECOVER_RATIO = float(os.getenv("LOAD_RECOVER_RATIO", "0.5"))
+    LOAD_HOLD_S = float(os.getenv("LOAD_HOLD_S", "2"))
+except ValueError:
+    LOAD_QUEUE_HIGH = 256
+    LOAD_LATENCY_HIGH_MS = 250.0
+    LOAD_RECOVER_RATIO = 0.5
+    LOAD_HOLD_S = 2.0
@@ -5,12 +5,12 @@ class EdgeDetector:
     """Detector orchestrates the hybrid pipeline using AE-first logic.
 
     If AE error < low threshold -> fast-exit as Normal. Otherwise runs RF+XGB.
+    Without explicit thresholds the model's current ones apply (configured or
+    adapted, see app.quantiles).
     """
 
     def __init__(self, model, thresholds=None):
         self.model = model
-        if thresholds is None:
-            thresholds = {"low": 0.01, "medium": 0.05, "high": 0.1}
         self.thresholds = thresholds
 
     def analyze(self, X, meta=None):
@@ -22,6 +22,7 @@ class EdgeDetector:
             "sev": result.get("sev"),
             "anom": result.get("anom"),
             "meta": result.get("meta"),
+            "mode": result.get("mode"),
             "all_results": result.get("all_results")
         }
 
@@ -1,140 +1,594 @@
+import copy
+import functools
+import hashlib
+import logging
 import os
+import threading
+import time
 import numpy as np
 import joblib
 import pickle
-from app.trt.ae_runtime import AERuntime
+from app import config
+from app.ae_backends import create_ae_runtime, resolve_backend
+from app.ae_numpy import NumpyAERuntime
+from app.forest import compile_forest, check_parity, probe_matrix
+from app import preprocess as fused
+from app import classifier_pool
+from app import fhir_features
+from app import thread_budget
+from app.metrics import STAGE_SECONDS, EVENTS, MODE_EVENTS, CASCADE_ROWS, PREDICTIONS, SEVERITIES, BATCH_SIZE
+from app.load_control import CONTROLLER
+from app.quantiles import AE_SCORES
+from app.result_cache import ResultCache
+from app.model_bundle import ModelBundle, BundleError
+
+logger = logging.getLogger(__name__)
+
+# Max |Δp| tolerated between a compiled forest and its predict_proba
+FOREST_PARITY_TOL = 1e-5
+
+# Max |Δ|/(1+|x|) tolerated between the fused preprocess and scaler.transform + mask
+PREPROCESS_PARITY_TOL = 1e-4
+
+# Per-thread preprocess output buffer is reused up to this many rows
+PREPROCESS_BUFFER_ROWS = 4096
+
+# Prediction of rows above the AE low threshold when no classifier ran (ae_only)
+UNCLASSIFIED_PRED = "Anomaly"
+
+
+class ModelLoadError(RuntimeError):
+    """Raised when a model artifact is missing or cannot be loaded."""
+
+
+def top_margin(probs):
+    """Top-1 minus top-2 class probability of each row (1.0 with one class)."""
+    probs = np.asarray(probs)
+    if probs.shape[1] < 2:
+        return np.ones(probs.shape[0])
+    top2 = np.partition(probs, -2, axis=1)[:, -2:]
+    return top2[:, 1] - top2[:, 0]
+
+
+def artifact_version(models_dir, *extra):
+    """Short digest of the artifact names, sizes and mtimes in `models_dir`."""
+    h = hashlib.blake2b(digest_size=8)
+    for name in sorted(os.listdir(models_dir)):
+        path = os.path.join(models_dir, name)
+        if os.path.isfile(path):
+            st = os.stat(path)
+            h.update("{}:{}:{};".format(name, st.st_size, st.st_mtime_ns).encode())
+    for value in extra:
+        h.update(str(value).encode())
+    return h.hexdigest()
 
 
 class HybridDeployedModel:
     """Hybrid inference model for Jetson Nano.
 
-    - AutoEncoder (TensorRT) runs first for anomaly scoring
+    - AutoEncoder runs first for anomaly scoring, on a pluggable backend
+      (TensorRT, ONNX Runtime, torch or NumPy; see app.ae_backends)
     - If AE exceeds low threshold, RF+XGB ensemble on CPU classifies
     """
 
     def __init__(self, models_dir="models"):
         print("[Hybrid Model] Loading artifacts...")
         self.models_dir = models_dir
+        self._local = threading.local()
 
-        # Load scaler if present
-        scaler_path = os.path.join(models_dir, "scaler.pkl")
-        if os.path.exists(scaler_path):
-            self.scaler = joblib.load(scaler_path)
+        # One CPU budget split across workers and native libraries
+        self.thread_budget = thread_budget.apply()
+        if self.thread_budget["enabled"]:
+            print("[Hybrid Model] ✓ Thread budget: {budget} CPUs / {workers} workers = "
+                  "{per_worker} (RF {rf}, XGB {xgb}, AE {ort_intra}, BLAS {blas})".format(**self.thread_budget))
+
+        # Packed single-file bundle when present and current, else the pickles
+        self.bundle = self._open_bundle(models_dir)
+        if self.bundle is not None:
+            self._load_bundle(self.bundle)
+        else:
+            self._load_artifacts(models_dir)
+
+        # AutoEncoder backend (configured or auto-detected, imported lazily)
+        self.ae_backend, self.ae, self.version = None, None, None
+        if config.AE_PER_WORKER and not self._ae_fork_safe():
+            print("[Hybrid Model] AE backend: created in each worker")
         else:
-            self.scaler = None
+            self.init_ae()
+
+        # RF and XGB run side by side on a shared thread pool when enabled
+        self.classifier_pool = classifier_pool.POOL
+        if self.classifier_pool is not None:
+            print("[Hybrid Model] ✓ Classifier pool: RF and XGB in parallel ({} threads)".format(
+                self.classifier_pool.threads))
+
+        # Cascade: the second classifier only runs where the first is unsure
+        self.cascade, self.cascade_margin = None, config.CASCADE_MARGIN
+        if self.cascade_margin > 0:
+            first = config.CASCADE_FIRST if config.CASCADE_FIRST in ("rf", "xgb") else "rf"
+            self.cascade = (first, "xgb" if first == "rf" else "rf")
+            print("[Hybrid Model] ✓ Cascade: {} first, {} below margin {}".format(
+                self.cascade[0], self.cascade[1], self.cascade_margin))
+
+        # Results of repeated feature rows (retries, chatty clients)
+        self.result_cache = None
+        if config.RESULT_CACHE_SIZE > 0:
+            self.result_cache = ResultCache(config.RESULT_CACHE_SIZE, config.RESULT_CACHE_TTL_S)
+            print("[Hybrid Model] ✓ Result cache: {} entries, ttl {}s".format(
+                config.RESULT_CACHE_SIZE, config.RESULT_CACHE_TTL_S))
+
+        # Feature vectors are padded / truncated to this model's input width
+        if self.n_features is not None:
+            fhir_features.set_feature_count(self.n_features)
+
+        print("[Hybrid Model] ✓ Loaded features: {}".format(self.feature_mask.shape))
+        print("[Hybrid Model] ✓ Classes: {}".format(list(self.classes_)))
+
+    @property
+    def n_features(self):
+        """Raw feature vector width the model takes (None if unknown)."""
+        if self.preprocess_plan is not None:
+            return int(self.preprocess_plan.n_raw)
+        if self.scaler is not None and hasattr(self.scaler, "n_features_in_"):
+            return int(self.scaler.n_features_in_)
+        if self.feature_mask.dtype == np.bool_:
+            return int(self.feature_mask.shape[0])
+        return None
 
-        # Feature mask (boolean or integer index list)
-        self.feature_mask = np.load(os.path.join(models_dir, "feature_mask.npy"))
+    def _load_artifacts(self, models_dir):
+        """Unpickle the models/ layout and compile it."""
+        try:
+            # Load scaler if present
+            scaler_path = os.path.join(models_dir, "scaler.pkl")
+            if os.path.exists(scaler_path):
+                self.scaler = joblib.load(scaler_path)
+            else:
+                self.scaler = None
+
+            # Feature mask (boolean or integer index list)
+            self.feature_mask = np.load(os.path.join(models_dir, "feature_mask.npy"))
+
+            # Label encoder
+            with open(os.path.join(models_dir, "label_encoder.pkl"), "rb") as f:
+                self.label_encoder = pickle.load(f)
+
+            # RF + XGB (sklearn joblib)
+            self.rf_model = joblib.load(os.path.join(models_dir, "rf_model.pkl"))
+            self.xgb_model = joblib.load(os.path.join(models_dir, "xgb_model.pkl"))
+        except Exception as e:
+            raise ModelLoadError("Failed to load model artifacts from {}: {}".format(models_dir, e))
+
+        self.classes_ = np.asarray(self.label_encoder.classes_)
+        self.n_estimators = {"rf": getattr(self.rf_model, "n_estimators", None),
+                             "xgb": getattr(self.xgb_model, "n_estimators", None)}
 
-        # Label encoder
-        with open(os.path.join(models_dir, "label_encoder.pkl"), "rb") as f:
-            self.label_encoder = pickle.load(f)
+        # Native predictor threads, so RF and XGB side by side fit the cores
+        self.library_threads = classifier_pool.set_library_threads(
+            self.rf_model, self.xgb_model, self.thread_budget["rf"], self.thread_budget["xgb"])
+        if any(v is not None for v in self.library_threads.values()):
+            print("[Hybrid Model] ✓ Predictor threads: RF {rf}, XGB {xgb}".format(**self.library_threads))
 
-        # RF + XGB (sklearn joblib)
-        self.rf_model = joblib.load(os.path.join(models_dir, "rf_model.pkl"))
-        self.xgb_model = joblib.load(os.path.join(models_dir, "xgb_model.pkl"))
+        # Scaler + mask folded into one float32 gather/affine step (parity-checked)
+        self.preprocess_plan = self._compile_preprocess()
+
+        # Flat-array compiled forests for small batches (parity-checked)
+        self.rf_compiled = self._compile_forest("RF", self.rf_model)
+        self.xgb_compiled = self._compile_forest("XGB", self.xgb_model)
+
+    def _open_bundle(self, models_dir):
+        """Open MODEL_BUNDLE in `models_dir`, or None to load the pickles."""
+        if not config.MODEL_BUNDLE:
+            return None
+        path = os.path.join(models_dir, config.MODEL_BUNDLE)
+        if not os.path.exists(path):
+            return None
+        try:
+            bundle = ModelBundle(path, verify=config.BUNDLE_VERIFY)
+        except (BundleError, OSError, ValueError) as e:
+            print("[Hybrid Model] Bundle not used ({}); loading artifacts".format(e))
+            return None
+        stale = bundle.stale_sources(models_dir)
+        if stale:
+            print("[Hybrid Model] Bundle does not match {}; loading artifacts "
+                  "(re-run: python -m app.model_bundle convert {})".format(", ".join(stale), models_dir))
+            return None
+        return bundle
+
+    def _load_bundle(self, bundle):
+        """Take every array from the mmap'd bundle (no unpickling)."""
+        try:
+            self.preprocess_plan = bundle.preprocess_plan()
+            self.rf_compiled = bundle.forest("rf")
+            self.xgb_compiled = bundle.forest("xgb")
+        except (KeyError, ValueError) as e:
+            raise ModelLoadError("Invalid model bundle {}: {}".format(bundle.path, e))
+        self.scaler = None
+        self.label_encoder = None
+        self.rf_model = None
+        self.xgb_model = None
+        self.library_threads = {"rf": None, "xgb": None}
+        self.feature_mask = self.preprocess_plan.index
+        self.classes_ = np.asarray(bundle.classes)
+        self.n_estimators = dict(bundle.manifest.get("estimators", {}))
+        print("[Hybrid Model] ✓ Bundle: {} (RF {} trees, XGB {} trees)".format(
+            bundle.path, self.rf_compiled.n_trees, self.xgb_compiled.n_trees))
 
-        # AutoEncoder TensorRT engine
-        ae_engine = os.path.join(models_dir, "ae.engine")
+    def _ae_fork_safe(self):
+        # Only the NumPy backend is plain arrays; the others own thread pools
+        # or a CUDA context that must not be created before fork()
+        if config.AE_BACKEND == "numpy":
+            return True
+        if config.AE_BACKEND == "auto" and not config.USE_TENSORRT:
+            if self.bundle is not None and self.bundle.ae_layers():
+                return True
         try:
-            self.ae = AERuntime(ae_engine)
+            backend = resolve_backend(self.models_dir, config.AE_BACKEND, config.USE_TENSORRT)
+        except ValueError:
+            return False
+        return backend == "numpy"
+
+    def init_ae(self):
+        """Create (or re-create, e.g. in a forked worker) the AE runtime.
+
+        Raises:
+            ModelLoadError: if no AE backend can be initialized
+        """
+        try:
+            self.ae_backend, self.ae = self._create_ae(self.models_dir)
         except Exception as e:
-            raise RuntimeError("Failed to initialize AE runtime: {}".format(e))
+            raise ModelLoadError("Failed to initialize AE runtime: {}".format(e))
+        self.version = artifact_version(self.models_dir, self.ae_backend)
+        print("[Hybrid Model] ✓ AE backend: {}".format(self.ae_backend))
 
-        print("[Hybrid Model] ✓ Loaded features: {}".format(self.feature_mask.shape))
-        print("[Hybrid Model] ✓ Classes: {}".format(list(self.label_encoder.classes_)))
+    def _create_ae(self, models_dir):
+        # The bundled (folded) AE stands in for the NumPy backend's files;
+        # on Jetson, auto-detection still prefers a TensorRT engine
+        layers = self.bundle.ae_layers() if self.bundle is not None else None
+        if layers and (config.AE_BACKEND == "numpy"
+                       or (config.AE_BACKEND == "auto" and not config.USE_TENSORRT)):
+            return "numpy", NumpyAERuntime.from_layers(layers, self.bundle.path)
+        return create_ae_runtime(models_dir, backend=config.AE_BACKEND,
+                                 use_tensorrt=config.USE_TENSORRT)
+
+    def _compile_preprocess(self):
+        """Compile the fused preprocess plan, or None to keep scaler.transform."""
+        try:
+            plan = fused.compile_preprocess(self.scaler, self.feature_mask)
+            diff = fused.check_parity(self.scaler, self.feature_mask, plan,
+                                      fused.probe_matrix(self.scaler, plan.n_raw))
+        except Exception as e:
+            print("[Hybrid Model] Preprocess not fused ({}); using scaler.transform".format(e))
+            return None
+        if diff > PREPROCESS_PARITY_TOL:
+            print("[Hybrid Model] Fused preprocess failed parity (max rel |d|={:.3e}); "
+                  "using scaler.transform".format(diff))
+            return None
+        print("[Hybrid Model] ✓ Preprocess fused: {} -> {} features".format(
+            plan.n_raw, plan.n_selected))
+        return plan
+
+    def _preprocess_buffer(self, n):
+        # Reused float32 output for this thread; callers must not keep it
+        if self.preprocess_plan is None or n > PREPROCESS_BUFFER_ROWS:
+            return None
+        buf = getattr(self._local, "preprocess_buf", None)
+        if buf is None or buf.shape[0] < n:
+            rows = min(1 << (n - 1).bit_length(), PREPROCESS_BUFFER_ROWS)
+            buf = np.empty((rows, self.preprocess_plan.n_selected), dtype=np.float32)
+            self._local.preprocess_buf = buf
+        return buf[:n]
+
+    def _compile_forest(self, name, estimator):
+        """Compile an ensemble to a CompiledForest, or None to keep predict_proba."""
+        if not config.USE_COMPILED_FOREST:
+            return None
+        try:
+            compiled = compile_forest(estimator)
+            diff = check_parity(estimator, compiled, probe_matrix(compiled.n_features))
+        except Exception as e:
+            print("[Hybrid Model] {} not compiled ({}); using predict_proba".format(name, e))
+            return None
+        if diff > FOREST_PARITY_TOL:
+            print("[Hybrid Model] {} compiled forest failed parity (max |dp|={:.3e}); "
+                  "using predict_proba".format(name, diff))
+            return None
+        print("[Hybrid Model] ✓ {} compiled: {} trees, {} nodes".format(
+            name, compiled.n_trees, compiled.n_nodes))
+        return compiled
+
+    def _predict_proba(self, estimator, compiled, X):
+        # Compiled forest skips sklearn/xgboost dispatch overhead on small
+        # batches; large batches go to the native multi-threaded predictors.
+        # Bundled models have no native estimator; the compiled one serves all sizes.
+        if compiled is not None and (estimator is None or X.shape[0] <= config.COMPILED_FOREST_MAX_BATCH):
+            return compiled.predict_proba(X)
+        return np.asarray(estimator.predict_proba(X), dtype=np.float64)
 
-    def preprocess(self, X):
+    def _classify(self, X, with_xgb=True):
+        """RF (and XGB) probabilities, each with its seconds.
+
+        With a classifier pool both predictors run at once; the stage then
+        takes about as long as the slower one instead of the sum.
+
+        Returns:
+            [(rf_probs, seconds)] or [(rf_probs, seconds), (xgb_probs, seconds)]
+        """
+        rf = functools.partial(self._predict_proba, self.rf_model, self.rf_compiled, X)
+        if not with_xgb:
+            return [classifier_pool.timed(rf)]
+        xgb = functools.partial(self._predict_proba, self.xgb_model, self.xgb_compiled, X)
+        if self.classifier_pool is not None and X.shape[0] >= config.CLASSIFIER_POOL_MIN_ROWS:
+            return self.classifier_pool.run(xgb, rf)[::-1]
+        return [classifier_pool.timed(rf), classifier_pool.timed(xgb)]
+
+    def _cascade(self, X):
+        """First classifier on every row, the second only where the first's
+        top-class margin is below `cascade_margin`; those rows get the 50/50
+        ensemble, the rest the first classifier's probabilities.
+
+        Returns:
+            (ensemble, {name: probs}, {name: (seconds, rows)}, escalated) where
+            `escalated` marks the rows the second classifier scored
+        """
+        first, second = self.cascade
+        models = {"rf": (self.rf_model, self.rf_compiled), "xgb": (self.xgb_model, self.xgb_compiled)}
+        p1, s1 = classifier_pool.timed(functools.partial(self._predict_proba, *models[first], X))
+        escalated = top_margin(p1) < self.cascade_margin
+        rows = np.flatnonzero(escalated)
+        ensemble = p1.copy()
+        p2, s2 = None, 0.0
+        if rows.size:
+            sub, s2 = classifier_pool.timed(
+                functools.partial(self._predict_proba, *models[second], X[rows]))
+            p2 = np.zeros_like(p1)
+            p2[rows] = sub
+            ensemble[rows] = (p1[rows] + sub) * 0.5
+        CASCADE_ROWS.inc(X.shape[0] - rows.size, ("decided",))
+        if rows.size:
+            CASCADE_ROWS.inc(rows.size, ("escalated",))
+        return (ensemble, {first: p1, second: p2},
+                {first: (s1, X.shape[0]), second: (s2, rows.size)}, escalated)
+
+    def preprocess(self, X, out=None):
         """Scale and select features.
 
         Args:
             X: np.ndarray shape (n_samples, n_raw_features)
+            out: optional float32 buffer of shape (n_samples, n_selected_features),
+                used when the fused plan is active
 
         Returns:
             np.ndarray shape (n_samples, n_selected_features)
         """
-        X = np.array(X, dtype=np.float32)
-        if self.scaler is not None:
-            X_scaled = self.scaler.transform(X)
-        else:
-            X_scaled = X
-
-        # Apply feature mask (boolean mask or index array)
-        X_selected = X_scaled[:, self.feature_mask]
-        return X_selected
+        if self.preprocess_plan is not None:
+            return self.preprocess_plan.transform(X, out=out)
+        return fused.reference_preprocess(self.scaler, self.feature_mask, X)
 
-    def infer(self, features, meta=None, thresholds=None):
+    def infer(self, features, meta=None, thresholds=None, mode=None, deadline=None):
         """Run the hybrid inference pipeline for a single sample.
 
         Args:
             features: list or np.ndarray of raw features (n_raw_features)
             meta: optional metadata dict
-            thresholds: dict with keys 'low','medium','high'
+            thresholds: dict with keys 'low','medium','high'; None = the
+                configured (or adapted) thresholds, see app.quantiles
+            mode: pipeline mode (see app.load_control); None = load controller
+            deadline: optional time.monotonic() deadline
 
         Returns:
             dict matching the required response format
         """
+        X = np.array(features).reshape(1, -1)
+        return self.infer_batch(X, metas=[meta], thresholds=thresholds,
+                                mode=mode, deadline=deadline)[0]
+
+    def infer_batch(self, features, metas=None, thresholds=None, mode=None, deadline=None):
+        """Run the hybrid inference pipeline over a batch of samples.
+
+        The whole matrix is preprocessed once and scored by the AE in a
+        single call. Only rows at or above the low threshold are sent to
+        RF+XGB, as one sub-matrix; results are scattered back in input order.
+        Under load the classifiers are reduced to RF or skipped (`mode`), and
+        so is any classifier stage that would not finish by `deadline`; each
+        result's "mode" says which pipeline produced it.
+
+        Args:
+            features: array-like of shape (n_samples, n_raw_features)
+            metas: optional list of metadata dicts, one per sample
+            thresholds: dict with keys 'low','medium','high'; None = the
+                configured (or adapted) thresholds, see app.quantiles
+            mode: "full", "ae_rf" or "ae_only"; None = load controller's choice
+            deadline: optional time.monotonic() deadline for the whole batch
+
+        Returns:
+            list of response dicts (same format as `infer`), in input order
+        """
         if thresholds is None:
-            thresholds = {"low": 0.01, "medium": 0.05, "high": 0.1}
+            thresholds = AE_SCORES.thresholds()
 
-        X = np.array(features).reshape(1, -1)
-        X_sel = self.preprocess(X)
+        X = np.asarray(features, dtype=np.float32)
+        if X.ndim == 1:
+            X = X.reshape(1, -1)
+        n = X.shape[0]
+        if n == 0:
+            return []
+        if metas is None:
+            metas = [None] * n
+        if mode is None:
+            mode = CONTROLLER.mode()
 
-        # AutoEncoder score (reconstruction error)
-        ae_score = float(self.ae.score(X_sel))
-        print("[AE] score={:.6f} (selected_features={})".format(ae_score, X_sel.shape[1]))
+        t0 = time.perf_counter()
+        X_sel = self.preprocess(X, out=self._preprocess_buffer(n))
+        STAGE_SECONDS.observe(time.perf_counter() - t0, ("preprocess",))
+        BATCH_SIZE.observe(n)
 
-        # Determine severity based on AE score
-        if ae_score >= thresholds["high"]:
-            sev = "HIGH"
-        elif ae_score >= thresholds["medium"]:
-            sev = "MEDIUM"
-        else:
-            sev = "LOW"
-
-        all_results = {"autoencoder": {"ae_score": ae_score, "thresholds": thresholds}}
-
-        # Fast-exit if AE indicates normal behaviour
-        if ae_score < thresholds["low"]:
-            print("[AE] below low threshold ({:.6f}) → fast-exit normal".format(thresholds["low"]))
-            pred = "Normal"
-            anom = False
-            combined_score = ae_score
-            all_results["rf_xgb"] = {
-                "skipped": True
-            }
-        else:
-            # Run RF and XGB on CPU
-            rf_probs = self.rf_model.predict_proba(X_sel)[0].astype(float).tolist()
-            xgb_probs = self.xgb_model.predict_proba(X_sel)[0].astype(float).tolist()
-            # 50-50 ensemble
-            ensemble = [(r + x) * 0.5 for r, x in zip(rf_probs, xgb_probs)]
-            max_prob = max(ensemble)
-            pred_idx = int(np.argmax(np.array(ensemble)))
-            pred = str(self.label_encoder.inverse_transform([pred_idx])[0])
-            print("[RF+XGB] pred={} max_prob={:.4f}".format(pred, max_prob))
-
-            # Combine AE score and classifier confidence into unified anomaly score
-            # (AE dominates; classifier adds weight based on 1 - confidence)
-            combined_score = min(1.0, ae_score + (1.0 - max_prob) * 0.5)
-            anom = (pred != "Normal") or (sev != "LOW")
-
-            all_results["rf_xgb"] = {
+        cache = self.result_cache
+        if cache is None:
+            return self._score(X_sel, metas, thresholds, mode, deadline)
+
+        # Serve repeated rows from the cache; only the misses are scored.
+        # Degraded results are not cached: a later full verdict replaces them.
+        X_sel = np.ascontiguousarray(X_sel)
+        keys = cache.row_keys(cache.key_prefix(self.version, thresholds), X_sel)
+        hits = cache.get_many(keys)
+        if not hits:
+            results = self._score(X_sel, metas, thresholds, mode, deadline)
+            cache.put_many((k, r) for k, r in zip(keys, results) if r["mode"] == "full")
+            return results
+
+        EVENTS.inc(len(hits), ("cached",))
+        for pred, count in zip(*np.unique([r["pred"] for r in hits.values()], return_counts=True)):
+            PREDICTIONS.inc(int(count), (str(pred),))
+        for sev, count in zip(*np.unique([r["sev"] for r in hits.values()], return_counts=True)):
+            SEVERITIES.inc(int(count), (str(sev),))
+
+        miss_rows = [i for i in range(n) if i not in hits]
+        scored = {}
+        if miss_rows:
+            fresh = self._score(X_sel[miss_rows], [metas[i] for i in miss_rows], thresholds,
+                                mode, deadline)
+            cache.put_many((keys[i], r) for i, r in zip(miss_rows, fresh) if r["mode"] == "full")
+            scored = dict(zip(miss_rows, fresh))
+
+        results = []
+        for i in range(n):
+            if i in scored:
+                results.append(scored[i])
+                continue
+            hit = hits[i]
+            results.append({
+                "pred": hit["pred"],
+                "score": hit["score"],
+                "sev": hit["sev"],
+                "anom": hit["anom"],
+                "meta": metas[i] or {},
+                "mode": hit["mode"],
+                # Each response gets its own copy; the cached entry stays intact
+                "all_results": copy.deepcopy(hit["all_results"])
+            })
+        return results
+
+    def _score(self, X_sel, metas, thresholds, mode="full", deadline=None):
+        """AE gate and RF+XGB ensemble (or the `mode` subset) over preprocessed rows."""
+        n = X_sel.shape[0]
+
+        # AutoEncoder scores (per-sample reconstruction error), one call
+        t1 = time.perf_counter()
+        ae_scores = np.asarray(self.ae.score_batch(X_sel), dtype=np.float64).reshape(-1)
+        STAGE_SECONDS.observe(time.perf_counter() - t1, ("ae",))
+        AE_SCORES.observe(ae_scores)
+
+        # Severity based on AE score
+        sevs = np.where(ae_scores >= thresholds["high"], "HIGH",
+                        np.where(ae_scores >= thresholds["medium"], "MEDIUM", "LOW"))
+
+        # Rows that miss the fast-exit go to RF+XGB as one masked sub-matrix
+        gated = ae_scores >= thresholds["low"]
+        clf_rows = np.flatnonzero(gated)
+        # Per-batch counts are in /metrics (fhir_events_total); debug log only
+        logger.debug("batch=%d fast_exit=%d classified=%d", n, n - clf_rows.size, clf_rows.size)
+
+        n_fast = n - clf_rows.size
+        if n_fast:
+            EVENTS.inc(n_fast, ("fast_exit",))
+            PREDICTIONS.inc(n_fast, ("Normal",))
+        for sev, count in zip(*np.unique(sevs, return_counts=True)):
+            SEVERITIES.inc(int(count), (str(sev),))
+
+        # Drop the classifier stages that would not finish by the deadline
+        mode = CONTROLLER.fit_deadline(mode, clf_rows.size, deadline,
+                                       parallel=self.classifier_pool is not None)
+        MODE_EVENTS.inc(n, (mode,))
+
+        clf_results = {}
+        if clf_rows.size and mode != "ae_only":
+            X_sub = X_sel[clf_rows]
+            ran = {"rf": None, "xgb": None}     # rows each classifier scored; None = all
+            t0 = time.perf_counter()
+            if mode == "full" and self.cascade is not None:
+                ensemble, probs, timings, escalated = self._cascade(X_sub)
+                ran[self.cascade[1]] = escalated
+            else:
+                stages = self._classify(X_sub, with_xgb=(mode == "full"))
+                probs = {name: p for name, (p, _) in zip(("rf", "xgb"), stages)}
+                timings = {name: (t, clf_rows.size) for name, (_, t) in zip(("rf", "xgb"), stages)}
+                if mode == "full":
+                    # 50-50 ensemble
+                    ensemble = (probs["rf"] + probs["xgb"]) * 0.5
+                else:
+                    ensemble = probs["rf"]
+            STAGE_SECONDS.observe(time.perf_counter() - t0, ("classify",))
+            for name, (seconds, rows) in timings.items():
+                if rows:
+                    STAGE_SECONDS.observe(seconds, (name,))
+                    CONTROLLER.observe_stage(name, seconds, rows)
+            rf_probs, xgb_probs = probs.get("rf"), probs.get("xgb")
+            pred_idx = np.argmax(ensemble, axis=1)
+            max_probs = ensemble.max(axis=1)
+            preds = self.classes_[pred_idx]
+            EVENTS.inc(clf_rows.size, ("classified",))
+            for pred, count in zip(*np.unique(preds, return_counts=True)):
+                PREDICTIONS.inc(int(count), (str(pred),))
+            for j, row in enumerate(clf_rows):
+                clf_results[int(row)] = (
+                    str(preds[j]), float(max_probs[j]), ensemble[j].tolist(),
+                    rf_probs[j].tolist() if ran["rf"] is None or ran["rf"][j] else None,
+                    xgb_probs[j].tolist() if xgb_probs is not None and (
+                        ran["xgb"] is None or ran["xgb"][j]) else None,
+                )
+        elif clf_rows.size:
+            EVENTS.inc(clf_rows.size, ("unclassified",))
+            PREDICTIONS.inc(clf_rows.size, (UNCLASSIFIED_PRED,))
+
+        results = []
+        for i in range(n):
+            ae_score = float(ae_scores[i])
+            sev = str(sevs[i])
+            all_results = {"autoencoder": {"ae_score": ae_score, "thresholds": thresholds}}
+
+            if not gated[i]:
+                # Fast-exit: AE indicates normal behaviour
+                pred = "Normal"
+                anom = False
+                combined_score = ae_score
+                all_results["rf_xgb"] = {
+                    "skipped": True
+                }
+            elif i not in clf_results:
+                # ae_only: above the low threshold but not classified; without
+                # a class, only the AE severity flags the row as an anomaly
+                pred = UNCLASSIFIED_PRED
+                anom = sev != "LOW"
+                combined_score = min(1.0, ae_score)
+                all_results["rf_xgb"] = {
+                    "skipped": True,
+                    "reason": mode
+                }
+            else:
+                pred, max_prob, ensemble, rf_probs, xgb_probs = clf_results[i]
+
+                # Combine AE score and classifier confidence into unified anomaly score
+                # (AE dominates; classifier adds weight based on 1 - confidence)
+                combined_score = min(1.0, ae_score + (1.0 - max_prob) * 0.5)
+                anom = (pred != "Normal") or (sev != "LOW")
+
+                all_results["rf_xgb"] = {
+                    "pred": pred,
+                    "ensemble_probs": ensemble,
+                    "rf_probs": rf_probs,
+                    "xgb_probs": xgb_probs,
+                    "max_prob": max_prob
+                }
+
+            # Final response format
+            results.append({
                 "pred": pred,
-                "ensemble_probs": ensemble,
-                "rf_probs": rf_probs,
-                "xgb_probs": xgb_probs,
-                "max_prob": float(max_prob)
-            }
-
-        # Final response format
-        response = {
-            "pred": pred,
-            "score": float(combined_score),
-            "sev": sev,
-            "anom": bool(anom),
-            "meta": meta or {},
-            "all_results": all_results
-        }
-
-        return response
+                "score": float(combined_score),
+                "sev": sev,
+                "anom": bool(anom),
+                "meta": metas[i] or {},
+                "mode": mode,
+                "all_results": all_results
+            })
+
+        return results
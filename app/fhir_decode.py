@@ -0,0 +1,191 @@
+"""Fast decoding of raw FHIR AuditEvent payloads.
+
+With `msgspec` installed, AuditEvents are decoded against a typed schema
+that names only the fields `app.fhir_features` reads (FEATURE_SPEC and
+FAILURE_FIELDS); every other member of the resource is skipped by the
+parser without allocating Python objects. Without msgspec, or when a
+resource does not fit the schema, the stdlib `json` module is used.
+
+Bundles are parsed incrementally with `ijson` when available, so only one
+entry is materialized at a time regardless of the bundle size.
+"""
+
+import json
+
+try:
+    import msgspec
+    HAS_MSGSPEC = True
+except ImportError:
+    HAS_MSGSPEC = False
+
+try:
+    import ijson
+    from ijson.common import ObjectBuilder
+    HAS_IJSON = True
+except ImportError:
+    HAS_IJSON = False
+
+# The whole-body fallback for bundles is reported once per process
+_bundle_fallback_warned = False
+
+
+class DecodeError(ValueError):
+    """Raised when a payload is not valid JSON."""
+
+
+if HAS_MSGSPEC:
+    from typing import Any, List, TypedDict
+
+    # Keep in sync with FEATURE_SPEC / FAILURE_FIELDS in app/fhir_features.py
+    class _AgentNetwork(TypedDict, total=False):
+        address: Any
+
+    class _Agent(TypedDict, total=False):
+        userId: Any
+        network: _AgentNetwork
+
+    class _Event(TypedDict, total=False):
+        type: Any
+        subtype: Any
+        outcome: Any
+        outcomeDesc: Any
+
+    class AuditEventFields(TypedDict, total=False):
+        resourceType: Any
+        action: Any
+        outcome: Any
+        outcomeDesc: Any
+        type: Any
+        subtype: Any
+        event: _Event
+        agent: List[_Agent]
+
+    _event_decoder = msgspec.json.Decoder(AuditEventFields)
+    _any_decoder = msgspec.json.Decoder()
+
+
+def decode_json(raw):
+    """Decode arbitrary JSON bytes/str into Python objects."""
+    try:
+        if HAS_MSGSPEC:
+            return _any_decoder.decode(raw)
+        return json.loads(raw)
+    except (ValueError, TypeError) as e:
+        raise DecodeError(str(e))
+    except Exception as e:
+        if HAS_MSGSPEC and isinstance(e, msgspec.DecodeError):
+            raise DecodeError(str(e))
+        raise
+
+
+def decode_audit_event(raw):
+    """Decode an AuditEvent, materializing only the fields used for features.
+
+    Args:
+        raw: JSON document as bytes or str
+
+    Returns:
+        dict holding the subset of the resource read by `extract_features`
+
+    Raises:
+        DecodeError: if `raw` is not valid JSON
+    """
+    if HAS_MSGSPEC:
+        try:
+            return _event_decoder.decode(raw)
+        except msgspec.ValidationError:
+            # Valid JSON with an unexpected shape (e.g. "agent": null):
+            # decode generically so extraction applies its defaults
+            pass
+        except msgspec.DecodeError as e:
+            raise DecodeError(str(e))
+    return decode_json(raw)
+
+
+class _ChunkReader:
+    """Byte reader for ijson; answers its read(0) type probe without touching
+    the stream (werkzeug's LimitedStream treats a 0-byte read as a disconnect).
+    """
+
+    def __init__(self, stream):
+        self._stream = stream
+
+    def read(self, size=-1):
+        if size == 0:
+            return b""
+        return self._stream.read(size)
+
+
+def _ijson_events(stream):
+    stream = _ChunkReader(stream)
+    try:
+        return ijson.parse(stream, use_float=True)
+    except TypeError:  # ijson < 3.1
+        return ijson.parse(stream)
+
+
+def iter_bundle_entries(stream, header=None):
+    """Yield each `entry` object of a FHIR Bundle read from a binary stream.
+
+    Args:
+        stream: file-like object positioned at the start of the Bundle JSON
+        header: optional dict receiving the top-level `resourceType` and
+            `type` once they have been read
+
+    Raises:
+        DecodeError: if the stream is not valid JSON
+    """
+    if header is None:
+        header = {}
+
+    if not HAS_IJSON:
+        global _bundle_fallback_warned
+        if not _bundle_fallback_warned:
+            _bundle_fallback_warned = True
+            print("[FHIR Decode] ⚠ ijson not installed; bundles are read into memory whole "
+                  "(pip install ijson)")
+        bundle = decode_json(stream.read())
+        if not isinstance(bundle, dict):
+            return
+        for key in ("resourceType", "type"):
+            if key in bundle:
+                header[key] = bundle[key]
+        for entry in bundle.get("entry") or []:
+            yield entry
+        return
+
+    builder = None
+    try:
+        for prefix, event, value in _ijson_events(stream):
+            if builder is not None:
+                builder.event(event, value)
+                if prefix == "entry.item" and event == "end_map":
+                    yield builder.value
+                    builder = None
+            elif prefix == "entry.item" and event == "start_map":
+                builder = ObjectBuilder()
+                builder.event(event, value)
+            elif prefix in ("resourceType", "type") and event == "string":
+                header[prefix] = value
+    except ijson.JSONError as e:
+        raise DecodeError(str(e))
+
+
+def iter_ndjson(stream, chunk_size=65536):
+    """Yield the non-blank lines of an NDJSON stream as bytes.
+
+    The stream is read in `chunk_size` pieces, so memory stays bounded by
+    the chunk plus the longest line.
+    """
+    tail = b""
+    while True:
+        chunk = stream.read(chunk_size)
+        if not chunk:
+            break
+        lines = (tail + chunk).split(b"\n")
+        tail = lines.pop()
+        for line in lines:
+            if line.strip():
+                yield line
+    if tail.strip():
+        yield tail
@@ -1,68 +1,189 @@
 import numpy as np
 import hashlib
-import joblib
-import os
+from functools import lru_cache
 
-# Load scaler once to know expected feature length
-_SCALER_PATH = os.path.join(os.path.dirname(__file__), "..", "models", "scaler.pkl")
+from app import config
 
-try:
-    _scaler = joblib.load(_SCALER_PATH)
-    EXPECTED_FEATURES = int(_scaler.n_features_in_)
-except Exception:
-    # fallback (safe default)
-    EXPECTED_FEATURES = 25
+# Feature vector length: the input width of the model this process loaded
+# (set by HybridDeployedModel through set_feature_count)
+EXPECTED_FEATURES = 25
+
+
+# -------- Declarative feature spec --------
+# (meta key or None, path into the AuditEvent, default, kind), in vector order.
+# Integer path steps index into lists; a missing hop yields the default.
+FEATURE_SPEC = (
+    ("resourceType", ("resourceType",), "Unknown", "hash"),
+    ("action", ("action",), "None", "hash"),
+    (None, ("event", "type", "code"), "0", "hash"),
+    ("outcome", ("outcome",), "0", "outcome"),
+    ("user", ("agent", 0, "userId"), "unknown", "hash"),
+    ("ip", ("agent", 0, "network", "address"), "0.0.0.0", "hash"),
+    (None, ("agent",), (), "count"),
+    (None, None, None, "failure"),
+)
+
+# Fields that can carry a failure outcome; only these are scanned for "fail"
+FAILURE_FIELDS = (
+    ("outcome",),
+    ("outcomeDesc",),
+    ("event", "outcome"),
+    ("event", "outcomeDesc"),
+    ("event", "type"),
+    ("event", "subtype"),
+    ("type",),
+    ("subtype",),
+)
+
+
+@lru_cache(maxsize=config.FEATURE_HASH_CACHE_SIZE)
+def _hash_str(s, mod):
+    return int.from_bytes(hashlib.sha1(s.encode()).digest(), "big") % mod
 
 
 def hash_string(s, mod=10000):
-    return int(hashlib.sha1(str(s).encode()).hexdigest(), 16) % mod
+    # Users, IPs and codes repeat heavily, so digests are memoized (bounded LRU)
+    return _hash_str(str(s), mod)
+
+
+def _accessor(path, default):
+    """Compile a key path into a getter that returns `default` on any missing hop."""
+    if len(path) == 1:
+        key = path[0]
+
+        def get(r):
+            return r.get(key, default)
+        return get
+
+    if len(path) == 2 and not any(type(key) is int for key in path):
+        outer, inner = path
+
+        def get(r):
+            v = r.get(outer)
+            return v.get(inner, default) if isinstance(v, dict) else default
+        return get
+
+    def get(r):
+        v = r
+        for key in path:
+            if type(key) is int:
+                if not isinstance(v, list) or len(v) <= key:
+                    return default
+            elif not isinstance(v, dict) or key not in v:
+                return default
+            v = v[key]
+        return v
+    return get
+
+
+def _contains_fail(value):
+    if isinstance(value, str):
+        return "fail" in value.lower()
+    if isinstance(value, dict):
+        value = value.values()
+    elif not isinstance(value, list):
+        return False
+    for v in value:
+        if _contains_fail(v):
+            return True
+    return False
+
+
+def _failure_check(fields):
+    getters = tuple(_accessor(path, None) for path in fields)
+
+    def get(r):
+        for g in getters:
+            v = g(r)
+            if v is not None and _contains_fail(v):
+                return True
+        return False
+    return get
+
+
+def _outcome_value(out):
+    return float(out) if out.replace(".", "", 1).isdigit() else 0.0
+
+
+def _compile_spec(spec):
+    """Turn FEATURE_SPEC into (meta_key, getter, encoder) triples."""
+    compiled = []
+    for meta_key, path, default, kind in spec:
+        if kind == "hash":
+            compiled.append((meta_key, _accessor(path, default), hash_string))
+        elif kind == "outcome":
+            get = _accessor(path, default)
+            compiled.append((meta_key, lambda r, get=get: str(get(r)), _outcome_value))
+        elif kind == "count":
+            get = _accessor(path, default)
+            compiled.append((meta_key, get, lambda v: float(len(v)) if isinstance(v, (list, dict)) else 0.0))
+        elif kind == "failure":
+            compiled.append((meta_key, _failure_check(FAILURE_FIELDS), float))
+        else:
+            raise ValueError("unknown feature kind: {}".format(kind))
+    return tuple(compiled)
+
+
+_COMPILED_SPEC = _compile_spec(FEATURE_SPEC)
+_N_VALUES = min(len(FEATURE_SPEC), EXPECTED_FEATURES)
+
+
+def set_feature_count(n):
+    """Pad / truncate feature vectors to `n` values (the model's input width)."""
+    global EXPECTED_FEATURES, _N_VALUES
+    EXPECTED_FEATURES = int(n)
+    _N_VALUES = min(len(FEATURE_SPEC), EXPECTED_FEATURES)
+
+
+def _extract_row(r):
+    values = []
+    meta = {}
+    for meta_key, get, encode in _COMPILED_SPEC:
+        raw = get(r)
+        values.append(encode(raw))
+        if meta_key is not None:
+            meta[meta_key] = raw
+    meta["feature_len"] = EXPECTED_FEATURES
+    return values, meta
 
 
 def extract_features(fhir: dict):
     """
     Convert FHIR AuditEvent JSON → fixed-length numeric vector
     """
-    r = fhir or {}
-
-    res = r.get("resourceType", "Unknown")
-    act = r.get("action", "None")
-    out = str(r.get("outcome", "0"))
-
-    evt = r.get("event", {})
-    tcode = evt.get("type", {}).get("code", "0")
-
-    ag = (r.get("agent") or [{}])[0]
-    user = ag.get("userId", "unknown")
-    ip = ag.get("network", {}).get("address", "0.0.0.0")
-
-    # -------- Core semantic features --------
-    features = [
-        hash_string(res),
-        hash_string(act),
-        hash_string(tcode),
-        float(out) if out.replace(".", "", 1).isdigit() else 0.0,
-        hash_string(user),
-        hash_string(ip),
-        float(len(r.get("agent", []))),
-        float("fail" in str(r).lower()),
-    ]
-
-    feats = np.array(features, dtype=np.float32)
-
-    # -------- PAD / TRUNCATE (CRITICAL FIX) --------
-    if feats.shape[0] < EXPECTED_FEATURES:
-        feats = np.pad(feats, (0, EXPECTED_FEATURES - feats.shape[0]))
-    else:
-        feats = feats[:EXPECTED_FEATURES]
-
-    meta = {
-        "resourceType": res,
-        "action": act,
-        "outcome": out,
-        "user": user,
-        "ip": ip,
-        "feature_len": int(feats.shape[0]),
-    }
+    r = fhir if isinstance(fhir, dict) else {}
+    values, meta = _extract_row(r)
 
+    # -------- PAD / TRUNCATE to the scaler's input width --------
+    feats = np.zeros(EXPECTED_FEATURES, dtype=np.float32)
+    feats[:_N_VALUES] = values[:_N_VALUES]
     return feats, meta
 
+
+def extract_batch(events, out=None):
+    """
+    Convert many AuditEvents straight into one float32 matrix.
+
+    Args:
+        events: iterable of AuditEvent dicts
+        out: optional preallocated float32 array (>= n_events, EXPECTED_FEATURES)
+
+    Returns:
+        (np.ndarray (n_events, EXPECTED_FEATURES), list of meta dicts)
+    """
+    rows = []
+    metas = []
+    for fhir in events:
+        values, meta = _extract_row(fhir if isinstance(fhir, dict) else {})
+        rows.append(values[:_N_VALUES])
+        metas.append(meta)
+
+    n = len(rows)
+    if out is None:
+        X = np.zeros((n, EXPECTED_FEATURES), dtype=np.float32)
+    else:
+        X = out[:n]
+        X[:, _N_VALUES:] = 0.0
+    if n:
+        X[:, :_N_VALUES] = rows
+    return X, metas
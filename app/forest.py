@@ -0,0 +1,319 @@
+"""Array-backed compiled tree ensembles for the RF+XGB stage.
+
+`predict_proba` on a handful of rows spends most of its time in sklearn /
+xgboost input validation and dispatch rather than walking trees. At model
+load both ensembles are compiled into the same flat NumPy representation:
+
+    feature    int32   (n_nodes,)   split feature (0 for leaves)
+    threshold  float32 (n_nodes,)   go left iff x < threshold
+    children   int32   (2*n_nodes,) [left, right] pairs; leaves point to self
+    default_left bool  (n_nodes,)   direction for NaN inputs
+    value      float32 (n_nodes, k) leaf payload (class distribution or margin)
+    roots      int32   (n_trees,)   root node of each tree
+
+and evaluated level by level over a whole batch with vectorized gathers.
+sklearn's `x <= t` (float64 threshold) is rewritten as an exact float32
+`x < t'` so both ensembles share one comparison.
+"""
+
+import json
+
+import numpy as np
+
+
+class CompiledForest:
+    """Tree ensemble compiled into flat arrays.
+
+    `kind` selects the output transform:
+        "mean"      - average of per-tree class distributions (RandomForest)
+        "softprob"  - softmax over summed per-class margins (XGBoost multiclass)
+        "logistic"  - sigmoid of the summed margin (XGBoost binary)
+    """
+
+    def __init__(self, kind, feature, threshold, children, default_left, value,
+                 roots, depth, n_features, n_classes, tree_class=None, base_margin=None):
+        self.kind = kind
+        self.feature = np.ascontiguousarray(feature, dtype=np.int32)
+        self.threshold = np.ascontiguousarray(threshold, dtype=np.float32)
+        self.children = np.ascontiguousarray(children, dtype=np.int32)
+        self.default_left = np.ascontiguousarray(default_left, dtype=bool)
+        self.value = np.ascontiguousarray(value, dtype=np.float32)
+        self.roots = np.ascontiguousarray(roots, dtype=np.int32)
+        self.depth = int(depth)
+        self.n_features = int(n_features)
+        self.n_classes = int(n_classes)
+        self.n_trees = int(self.roots.size)
+        self._feature = self.feature.astype(np.intp)
+        self._children = self.children.astype(np.intp)
+        self._roots = self.roots.astype(np.intp)
+
+        # XGBoost: per-tree output group as a one-hot (n_trees, n_groups) matrix
+        self.tree_class = None
+        self._group_matrix = None
+        if tree_class is not None:
+            self.tree_class = np.ascontiguousarray(tree_class, dtype=np.int32)
+            n_groups = 1 if kind == "logistic" else self.n_classes
+            self._group_matrix = np.zeros((self.n_trees, n_groups), dtype=np.float32)
+            self._group_matrix[np.arange(self.n_trees), self.tree_class] = 1.0
+        self.base_margin = None if base_margin is None else np.asarray(base_margin, dtype=np.float32)
+
+    @property
+    def n_nodes(self):
+        return int(self.feature.size)
+
+    # ------------------------------------------------------------------
+    # Evaluation
+    # ------------------------------------------------------------------
+    def apply(self, X):
+        """Return the leaf node reached in every tree, shape (n_samples, n_trees)."""
+        X = np.ascontiguousarray(X, dtype=np.float32)
+        if X.ndim != 2 or X.shape[1] != self.n_features:
+            raise ValueError("X has {} features, but compiled forest expects {}".format(
+                X.shape[-1] if X.ndim else 0, self.n_features))
+        n = X.shape[0]
+        flat = X.ravel()
+        row_base = (np.arange(n, dtype=np.intp) * self.n_features)[:, None]
+        has_nan = bool(np.isnan(flat).any())
+
+        # Index arrays as intp so np.take never converts; temporaries reused
+        # across levels. Every index is in range, so mode="clip" skips checks.
+        idx = np.broadcast_to(self._roots, (n, self.n_trees)).copy()
+        feat = np.empty_like(idx)
+        x = np.empty(idx.shape, dtype=np.float32)
+        t = np.empty(idx.shape, dtype=np.float32)
+        go_right = np.empty(idx.shape, dtype=bool)
+        for _ in range(self.depth):
+            np.take(self._feature, idx, out=feat, mode="clip")
+            feat += row_base
+            np.take(flat, feat, out=x, mode="clip")
+            np.take(self.threshold, idx, out=t, mode="clip")
+            if has_nan:
+                go_right[...] = ~((x < t) | (np.isnan(x) & self.default_left[idx]))
+            else:
+                np.greater_equal(x, t, out=go_right)
+            idx *= 2
+            idx += go_right
+            np.take(self._children, idx, out=idx, mode="clip")
+        return idx
+
+    def predict_proba(self, X):
+        """Class probabilities, shape (n_samples, n_classes), float64."""
+        leaves = self.apply(X)
+        if self.kind == "mean":
+            return np.take(self.value, leaves, axis=0).sum(axis=1, dtype=np.float64) / self.n_trees
+
+        margin = self.value[leaves, 0] @ self._group_matrix
+        if self.base_margin is not None:
+            margin = margin + self.base_margin
+        margin = margin.astype(np.float64)
+        if self.kind == "logistic":
+            p = 1.0 / (1.0 + np.exp(-margin[:, 0]))
+            return np.column_stack([1.0 - p, p])
+        margin -= margin.max(axis=1, keepdims=True)
+        np.exp(margin, out=margin)
+        margin /= margin.sum(axis=1, keepdims=True)
+        return margin
+
+    # ------------------------------------------------------------------
+    # Compilation
+    # ------------------------------------------------------------------
+    @classmethod
+    def from_sklearn(cls, forest):
+        """Compile a fitted sklearn RandomForest/ExtraTrees classifier."""
+        estimators = getattr(forest, "estimators_", None)
+        if not estimators:
+            raise TypeError("not a fitted sklearn forest: {}".format(type(forest).__name__))
+        if getattr(forest, "n_outputs_", 1) != 1:
+            raise TypeError("multi-output forests are not supported")
+
+        n_classes = int(forest.n_classes_)
+        parts = _NodeBuffer()
+        depth = 0
+        for est in estimators:
+            tree = est.tree_
+            left = tree.children_left
+            is_leaf = left == -1
+            # x <= t (float64)  <=>  x < t' with t' the next float32 above
+            # the largest float32 not exceeding t
+            t32 = tree.threshold.astype(np.float32)
+            over = t32.astype(np.float64) > tree.threshold
+            t32[over] = np.nextafter(t32[over], np.float32(-np.inf))
+            t32 = np.nextafter(t32, np.float32(np.inf))
+
+            value = tree.value[:, 0, :].astype(np.float64)
+            totals = value.sum(axis=1, keepdims=True)
+            totals[totals == 0] = 1.0
+            value = value / totals
+            value[~is_leaf] = 0.0
+
+            missing_left = getattr(tree, "missing_go_to_left", None)
+            if missing_left is None:
+                missing_left = np.zeros(tree.node_count, dtype=bool)
+            parts.add(tree.feature, t32, left, tree.children_right, missing_left, value)
+            depth = max(depth, int(tree.max_depth))
+
+        return cls("mean", *parts.finish(), depth=depth,
+                   n_features=forest.n_features_in_, n_classes=n_classes)
+
+    @classmethod
+    def from_xgboost(cls, model):
+        """Compile an XGBClassifier (or Booster) using its JSON model dump."""
+        booster = model.get_booster() if hasattr(model, "get_booster") else model
+        doc = json.loads(bytes(booster.save_raw(raw_format="json")))
+        learner = doc["learner"]
+        objective = learner["objective"]["name"]
+        gbm = learner["gradient_booster"]
+        if gbm.get("name") != "gbtree":
+            raise TypeError("unsupported xgboost booster: {}".format(gbm.get("name")))
+
+        params = learner["learner_model_param"]
+        n_features = int(params["num_feature"])
+        if objective in ("multi:softprob", "multi:softmax"):
+            kind = "softprob"
+            n_classes = int(params["num_class"])
+        elif objective == "binary:logistic":
+            kind = "logistic"
+            n_classes = 2
+        else:
+            raise TypeError("unsupported xgboost objective: {}".format(objective))
+
+        # Scalar ("5E-1") in older releases, per-class vector ("[...]") in newer ones
+        raw = params["base_score"]
+        base = np.asarray(json.loads(raw if raw.startswith("[") else "[{}]".format(raw)),
+                          dtype=np.float64)
+        if kind == "logistic":
+            # Stored as a probability; the model adds it in margin space
+            base = np.log(base / (1.0 - base))
+
+        model_doc = gbm["model"]
+        parts = _NodeBuffer()
+        depth = 0
+        for tree in model_doc["trees"]:
+            if any(tree.get("split_type", [])):
+                raise TypeError("categorical splits are not supported")
+            left = np.asarray(tree["left_children"], dtype=np.int64)
+            right = np.asarray(tree["right_children"], dtype=np.int64)
+            cond = np.asarray(tree["split_conditions"], dtype=np.float32)
+            is_leaf = left == -1
+            value = np.where(is_leaf, cond, 0.0).astype(np.float32).reshape(-1, 1)
+            parts.add(np.asarray(tree["split_indices"]), cond, left, right,
+                      np.asarray(tree["default_left"], dtype=bool), value)
+            depth = max(depth, _tree_depth(left, right))
+
+        return cls(kind, *parts.finish(), depth=depth, n_features=n_features,
+                   n_classes=n_classes, tree_class=model_doc["tree_info"], base_margin=base)
+
+
+class _NodeBuffer:
+    """Concatenates per-tree node arrays into one flat, self-looping layout."""
+
+    def __init__(self):
+        self.features, self.thresholds, self.children = [], [], []
+        self.default_left, self.values, self.roots = [], [], []
+        self.offset = 0
+
+    def add(self, feature, threshold, left, right, default_left, value):
+        left = np.asarray(left, dtype=np.int64)
+        right = np.asarray(right, dtype=np.int64)
+        n = left.size
+        ids = np.arange(n, dtype=np.int64)
+        is_leaf = left == -1
+        left = np.where(is_leaf, ids, left) + self.offset
+        right = np.where(is_leaf, ids, right) + self.offset
+
+        feature = np.where(is_leaf, 0, np.asarray(feature, dtype=np.int64))
+        threshold = np.where(is_leaf, np.float32(np.inf), threshold).astype(np.float32)
+
+        self.features.append(feature)
+        self.thresholds.append(threshold)
+        self.children.append(np.column_stack([left, right]).ravel())
+        self.default_left.append(np.asarray(default_left, dtype=bool))
+        self.values.append(value)
+        self.roots.append(self.offset)
+        self.offset += n
+
+    def finish(self):
+        return (np.concatenate(self.features), np.concatenate(self.thresholds),
+                np.concatenate(self.children), np.concatenate(self.default_left),
+                np.concatenate(self.values), np.asarray(self.roots))
+
+
+def _tree_depth(left, right):
+    depth = np.zeros(left.size, dtype=np.int64)
+    for node in range(left.size):
+        if left[node] != -1:
+            depth[left[node]] = depth[node] + 1
+            depth[right[node]] = depth[node] + 1
+    return int(depth.max()) if depth.size else 0
+
+
+def compile_forest(estimator):
+    """Compile a fitted RF or XGB classifier.
+
+    Raises:
+        TypeError: if the estimator type is not supported
+    """
+    if hasattr(estimator, "get_booster") or type(estimator).__name__ == "Booster":
+        return CompiledForest.from_xgboost(estimator)
+    if hasattr(estimator, "estimators_"):
+        return CompiledForest.from_sklearn(estimator)
+    raise TypeError("cannot compile estimator of type {}".format(type(estimator).__name__))
+
+
+def check_parity(estimator, compiled, X):
+    """Max absolute difference between `predict_proba` and the compiled forest."""
+    X = np.ascontiguousarray(X, dtype=np.float32)
+    expected = np.asarray(estimator.predict_proba(X), dtype=np.float64)
+    actual = compiled.predict_proba(X)
+    if expected.shape != actual.shape:
+        return float("inf")
+    return float(np.max(np.abs(expected - actual))) if expected.size else 0.0
+
+
+def probe_matrix(n_features, n_samples=512, seed=0):
+    """Synthetic scaled-feature rows spanning typical split ranges."""
+    rng = np.random.default_rng(seed)
+    return (rng.standard_normal((n_samples, n_features)) * 3.0).astype(np.float32)
+
+
+if __name__ == "__main__":
+    """Parity check and benchmark: compiled forest vs predict_proba."""
+    import argparse
+    import os
+    import time
+    import warnings
+
+    import joblib
+
+    warnings.filterwarnings("ignore")
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--models-dir", default=os.getenv("MODELS_DIR", "models"))
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    for name in ("rf_model.pkl", "xgb_model.pkl"):
+        path = os.path.join(args.models_dir, name)
+        if not os.path.exists(path):
+            print("[skip] {} not found".format(path))
+            continue
+        est = joblib.load(path)
+        t0 = time.perf_counter()
+        compiled = compile_forest(est)
+        compile_ms = (time.perf_counter() - t0) * 1000.0
+        X_probe = probe_matrix(compiled.n_features, n_samples=4096)
+        diff = check_parity(est, compiled, X_probe)
+        print("\n{}: {} trees, {} nodes, depth {} (compiled in {:.1f} ms)".format(
+            name, compiled.n_trees, compiled.n_nodes, compiled.depth, compile_ms))
+        print("  parity: max |Δp| = {:.3e} -> {}".format(diff, "OK" if diff <= 1e-5 else "MISMATCH"))
+        print("  {:>6} {:>14} {:>14} {:>9}".format("batch", "predict_proba", "compiled", "speedup"))
+        for bs in (1, 4, 16, 64, 256, 1024, 4096):
+            Xb = X_probe[:bs]
+            timings = []
+            for fn in (est.predict_proba, compiled.predict_proba):
+                fn(Xb)
+                t0 = time.perf_counter()
+                for _ in range(args.repeat):
+                    fn(Xb)
+                timings.append((time.perf_counter() - t0) / args.repeat * 1000.0)
+            print("  {:>6} {:>11.3f} ms {:>11.3f} ms {:>8.1f}x".format(
+                bs, timings[0], timings[1], timings[0] / timings[1]))
@@ -0,0 +1,195 @@
+"""Overload-aware degradation of the hybrid pipeline.
+
+Under a burst it is better to return a cheaper verdict on time than a full
+verdict late. The controller picks one of three pipeline modes, in
+decreasing cost:
+
+    full      AE gate, then the RF + XGB ensemble
+    ae_rf     AE gate, then RF alone
+    ae_only   AE score and severity only; rows at or above the low
+              threshold are reported as "Anomaly", unclassified
+
+It watches two signals: the depth of the request queues registered with
+add_queue() (micro-batcher, ASGI admission) and an EWMA of single-event
+request latency, fed by /fhir/notify: queue wait plus inference through the
+micro-batcher, inference alone without it. Bulk endpoints (/fhir/batch,
+/fhir/Bundle, /fhir/stream) do not feed it, so one large body does not
+degrade other callers. It steps one mode down when either signal crosses its high mark
+for the current mode, which is LOAD_QUEUE_HIGH / LOAD_LATENCY_HIGH_MS
+times 1 for full and 2 for ae_rf. It steps back up only when both signals
+are below LOAD_RECOVER_RATIO of the previous mode's marks and the current
+mode has been held for LOAD_HOLD_S. The gap between those marks is the
+hysteresis that stops it flapping.
+
+Deadlines are applied per call, independently of the mode: classifier
+stages whose estimated cost (EWMA of seconds per row, per stage) does not
+fit in the time left are skipped.
+"""
+
+import threading
+import time
+
+from app import config
+from app.metrics import REGISTRY
+
+MODES = ("full", "ae_rf", "ae_only")
+
+# Weight of the newest observation in the latency and stage-cost EWMAs
+EWMA_ALPHA = 0.2
+
+
+class LoadController:
+    """Chooses the pipeline mode from queue depth and inference latency.
+
+    Args:
+        mode: "auto", or one of MODES to pin the pipeline to that mode
+        queue_high: queued requests that move full -> ae_rf (2x: -> ae_only)
+        latency_high_ms: EWMA request latency that does the same
+        recover_ratio: fraction of the previous mode's marks to step back up
+        hold_s: minimum time in a mode before stepping back up
+    """
+
+    def __init__(self, mode="auto", queue_high=256, latency_high_ms=250.0,
+                 recover_ratio=0.5, hold_s=2.0):
+        if mode != "auto" and mode not in MODES:
+            raise ValueError("unknown load mode {!r}; expected auto or one of {}".format(
+                mode, ", ".join(MODES)))
+        self.forced = None if mode == "auto" else mode
+        self.queue_high = max(1, int(queue_high))
+        self.latency_high = max(1e-6, float(latency_high_ms) / 1000.0)
+        self.recover_ratio = min(1.0, max(0.0, float(recover_ratio)))
+        self.hold = max(0.0, float(hold_s))
+
+        self._lock = threading.Lock()
+        self._queues = {}
+        self._level = 0
+        self._since = time.monotonic()
+        self._latency = 0.0
+        self._stage_cost = {}       # stage -> EWMA seconds per row
+        self._transitions = 0
+        self._deadline_downgrades = 0
+
+    def add_queue(self, name, fn):
+        """Register a queue whose depth (`fn()`) counts as pending work."""
+        self._queues[name] = fn
+
+    def queue_depth(self):
+        depth = 0
+        for fn in list(self._queues.values()):
+            try:
+                depth += int(fn())
+            except Exception:
+                pass
+        return depth
+
+    # ------------------------------------------------------------------
+    def observe_latency(self, seconds):
+        """Feed the latency of one single-event request (see the module docstring)."""
+        self._latency += EWMA_ALPHA * (seconds - self._latency)
+
+    def observe_stage(self, stage, seconds, rows):
+        """Feed the duration of one classifier stage over `rows` rows."""
+        if rows <= 0:
+            return
+        per_row = seconds / rows
+        cost = self._stage_cost.get(stage)
+        self._stage_cost[stage] = per_row if cost is None else cost + EWMA_ALPHA * (per_row - cost)
+
+    def estimate(self, stage, rows):
+        """Expected seconds for `stage` over `rows` rows (0 until observed)."""
+        return self._stage_cost.get(stage, 0.0) * rows
+
+    def current(self):
+        """Current mode, without re-evaluating the signals."""
+        return self.forced or MODES[self._level]
+
+    def mode(self):
+        """Current mode; re-evaluates the signals on every call."""
+        if self.forced is not None:
+            return self.forced
+
+        depth = self.queue_depth()
+        latency = self._latency
+        now = time.monotonic()
+        with self._lock:
+            level = self._level
+            if level < len(MODES) - 1 and (
+                    depth >= self.queue_high * (level + 1)
+                    or latency >= self.latency_high * (level + 1)):
+                level += 1
+            elif level > 0 and now - self._since >= self.hold and (
+                    depth < self.queue_high * level * self.recover_ratio
+                    and latency < self.latency_high * level * self.recover_ratio):
+                level -= 1
+            if level != self._level:
+                print("[Load Control] {} -> {} (queue {}, latency {:.1f} ms)".format(
+                    MODES[self._level], MODES[level], depth, latency * 1000.0))
+                self._level = level
+                self._since = now
+                self._transitions += 1
+            return MODES[level]
+
+    def fit_deadline(self, mode, rows, deadline, parallel=False):
+        """Downgrade `mode` until its classifier stages fit before `deadline`.
+
+        Args:
+            mode: requested mode
+            rows: rows that will reach the classifiers
+            deadline: time.monotonic() deadline, or None
+            parallel: RF and XGB run side by side (see app.classifier_pool)
+
+        Returns:
+            the mode to run
+        """
+        if deadline is None or mode == "ae_only" or rows == 0:
+            return mode
+        remaining = deadline - time.monotonic()
+        rf = self.estimate("rf", rows)
+        xgb = self.estimate("xgb", rows)
+        if remaining < rf:
+            fitted = "ae_only"
+        elif mode == "full" and remaining < (max(rf, xgb) if parallel else rf + xgb):
+            fitted = "ae_rf"
+        else:
+            return mode
+        self._deadline_downgrades += 1
+        return fitted
+
+    def stats(self):
+        """Mode, signals, thresholds and transition counts."""
+        return {
+            "mode": self.current(),
+            "forced": self.forced is not None,
+            "queue_depth": self.queue_depth(),
+            "latency_ewma_ms": self._latency * 1000.0,
+            "queue_high": self.queue_high,
+            "latency_high_ms": self.latency_high * 1000.0,
+            "recover_ratio": self.recover_ratio,
+            "hold_s": self.hold,
+            "stage_cost_us_per_row": {k: v * 1e6 for k, v in sorted(self._stage_cost.items())},
+            "transitions": self._transitions,
+            "deadline_downgrades": self._deadline_downgrades,
+        }
+
+
+def _controller_from_config():
+    mode = config.LOAD_MODE
+    if mode != "auto" and mode not in MODES:
+        print("[Load Control] unknown LOAD_MODE {!r}; using auto".format(mode))
+        mode = "auto"
+    return LoadController(
+        mode=mode,
+        queue_high=config.LOAD_QUEUE_HIGH,
+        latency_high_ms=config.LOAD_LATENCY_HIGH_MS,
+        recover_ratio=config.LOAD_RECOVER_RATIO,
+        hold_s=config.LOAD_HOLD_S,
+    )
+
+
+CONTROLLER = _controller_from_config()
+
+REGISTRY.callback(
+    "fhir_pipeline_mode", "Current pipeline mode (1 for the active one)",
+    lambda: {(m,): 1 if CONTROLLER.current() == m else 0 for m in MODES},
+    labelnames=("mode",),
+)
@@ -0,0 +1,219 @@
+"""Prometheus metrics for the detection hot path.
+
+Updates are striped: every thread is assigned one of `N_STRIPES` stripes on
+first use and only ever takes that stripe's lock, so concurrent request
+threads almost never contend. A scrape merges the stripes and renders the
+Prometheus text exposition format; no prometheus_client dependency.
+
+    from app.metrics import STAGE_SECONDS
+    STAGE_SECONDS.observe(elapsed, ("ae",))
+"""
+
+import bisect
+import itertools
+import threading
+from collections import OrderedDict
+
+N_STRIPES = 16
+
+# Seconds; stage latencies range from a few µs (fast-exit) to ~100 ms (large batches)
+LATENCY_BUCKETS = (0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005,
+                   0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+BATCH_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128, 256, 512, 1024, 4096)
+
+
+class _Stripe:
+    __slots__ = ("lock", "values")
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.values = {}
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names, values, extra=None):
+    pairs = ['{}="{}"'.format(n, _escape(v)) for n, v in zip(names, values)]
+    if extra is not None:
+        pairs.append('{}="{}"'.format(*extra))
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _num(value):
+    value = float(value)
+    if value != value:
+        return "NaN"
+    if value in (float("inf"), float("-inf")):
+        return "+Inf" if value > 0 else "-Inf"
+    if value.is_integer() and abs(value) < 1e15:
+        return str(int(value))
+    return repr(value)
+
+
+class Registry:
+    """Holds metric definitions and the striped value store."""
+
+    def __init__(self, n_stripes=N_STRIPES):
+        self._stripes = tuple(_Stripe() for _ in range(n_stripes))
+        self._assign = itertools.count()
+        self._local = threading.local()
+        self._metrics = OrderedDict()
+
+    def _stripe(self):
+        try:
+            return self._local.stripe
+        except AttributeError:
+            stripe = self._stripes[next(self._assign) % len(self._stripes)]
+            self._local.stripe = stripe
+            return stripe
+
+    def _merged(self, name):
+        """Sum of every stripe's values for metric `name`, keyed by label values."""
+        merged = {}
+        for stripe in self._stripes:
+            with stripe.lock:
+                items = [(k[1], v) for k, v in stripe.values.items() if k[0] == name]
+            for labels, v in items:
+                if isinstance(v, list):
+                    acc = merged.get(labels)
+                    merged[labels] = list(v) if acc is None else [a + b for a, b in zip(acc, v)]
+                else:
+                    merged[labels] = merged.get(labels, 0.0) + v
+        return merged
+
+    def register(self, metric):
+        """Add (or replace) a metric; returns it."""
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name, help, labelnames=()):
+        return self.register(Counter(self, name, help, labelnames))
+
+    def histogram(self, name, help, labelnames=(), buckets=LATENCY_BUCKETS):
+        return self.register(Histogram(self, name, help, labelnames, buckets))
+
+    def callback(self, name, help, fn, kind="gauge", labelnames=()):
+        """Metric read from `fn()` at scrape time (a number, or {label values: number})."""
+        return self.register(CallbackMetric(self, name, help, fn, kind, labelnames))
+
+    def render(self):
+        """Prometheus text exposition (format 0.0.4)."""
+        lines = []
+        for metric in list(self._metrics.values()):
+            lines.append("# HELP {} {}".format(metric.name, metric.help))
+            lines.append("# TYPE {} {}".format(metric.name, metric.kind))
+            lines.extend(metric.samples())
+        return "\n".join(lines) + "\n"
+
+
+class Counter:
+    kind = "counter"
+
+    def __init__(self, registry, name, help, labelnames=()):
+        self._registry = registry
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+
+    def inc(self, amount=1.0, labels=()):
+        stripe = self._registry._stripe()
+        key = (self.name, labels)
+        with stripe.lock:
+            stripe.values[key] = stripe.values.get(key, 0.0) + amount
+
+    def samples(self):
+        for labels, value in sorted(self._registry._merged(self.name).items()):
+            yield "{}{} {}".format(self.name, _labels(self.labelnames, labels), _num(value))
+
+
+class Histogram:
+    kind = "histogram"
+
+    def __init__(self, registry, name, help, labelnames=(), buckets=LATENCY_BUCKETS):
+        self._registry = registry
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, labels=()):
+        # Per-bucket (non-cumulative) counts, then +Inf, then the sum
+        i = bisect.bisect_left(self.buckets, value)
+        stripe = self._registry._stripe()
+        key = (self.name, labels)
+        with stripe.lock:
+            counts = stripe.values.get(key)
+            if counts is None:
+                counts = stripe.values[key] = [0] * (len(self.buckets) + 1) + [0.0]
+            counts[i] += 1
+            counts[-1] += value
+
+    def samples(self):
+        for labels, counts in sorted(self._registry._merged(self.name).items()):
+            cumulative = 0
+            for bound, c in zip(self.buckets + ("+Inf",), counts):
+                cumulative += c
+                le = bound if bound == "+Inf" else "{:g}".format(bound)
+                yield "{}_bucket{} {}".format(
+                    self.name, _labels(self.labelnames, labels, ("le", le)), _num(cumulative))
+            yield "{}_sum{} {}".format(self.name, _labels(self.labelnames, labels), _num(counts[-1]))
+            yield "{}_count{} {}".format(self.name, _labels(self.labelnames, labels), _num(cumulative))
+
+
+class CallbackMetric:
+    def __init__(self, registry, name, help, fn, kind="gauge", labelnames=()):
+        self.name = name
+        self.help = help
+        self.fn = fn
+        self.kind = kind
+        self.labelnames = tuple(labelnames)
+
+    def samples(self):
+        try:
+            value = self.fn()
+        except Exception:
+            return
+        if not isinstance(value, dict):
+            value = {(): value}
+        for labels, v in sorted(value.items()):
+            if v is not None:
+                yield "{}{} {}".format(self.name, _labels(self.labelnames, labels), _num(float(v)))
+
+
+REGISTRY = Registry()
+
+STAGE_SECONDS = REGISTRY.histogram(
+    "fhir_stage_duration_seconds",
+    "Time per call spent in each pipeline stage (a request or a batch)",
+    labelnames=("stage",),
+)
+REQUEST_SECONDS = REGISTRY.histogram(
+    "fhir_request_duration_seconds",
+    "HTTP handler latency until the response headers",
+    labelnames=("endpoint",),
+)
+REQUESTS = REGISTRY.counter(
+    "fhir_requests_total", "HTTP requests by endpoint and status code",
+    labelnames=("endpoint", "code"),
+)
+EVENTS = REGISTRY.counter(
+    "fhir_events_total",
+    "Scored events by path (fast_exit: AE below the low threshold, classified: RF+XGB, "
+    "unclassified: above the threshold in ae_only mode, cached: result cache hit)",
+    labelnames=("path",),
+)
+MODE_EVENTS = REGISTRY.counter(
+    "fhir_mode_events_total", "Scored events by pipeline mode (full, ae_rf, ae_only)",
+    labelnames=("mode",))
+CASCADE_ROWS = REGISTRY.counter(
+    "fhir_cascade_rows_total",
+    "Classified rows by cascade outcome (decided: first classifier only, escalated: both)",
+    labelnames=("result",))
+PREDICTIONS = REGISTRY.counter(
+    "fhir_predictions_total", "Scored events by predicted class", labelnames=("pred",))
+SEVERITIES = REGISTRY.counter(
+    "fhir_severity_total", "Scored events by AE severity", labelnames=("sev",))
+BATCH_SIZE = REGISTRY.histogram(
+    "fhir_inference_batch_size", "Samples per hybrid inference call", buckets=BATCH_BUCKETS)
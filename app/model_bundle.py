@@ -0,0 +1,348 @@
+"""Single-file, memory-mapped model bundle.
+
+Loading the `models/` layout unpickles five artifacts (and imports sklearn
+and xgboost to do it). A bundle holds everything inference needs as raw
+arrays instead, so opening one is an mmap plus a JSON header:
+
+    offset 0    b"FHIRBNDL"               magic
+    8           uint32 format version
+    12          uint32 reserved
+    16          uint64 manifest length
+    24          16-byte BLAKE2b of the manifest
+    64          manifest (UTF-8 JSON), padded to 64 bytes
+    ...         data section: arrays, each 64-byte aligned
+
+The manifest records every array's offset (from the start of the data
+section), dtype, shape and BLAKE2b digest, plus the class labels, forest
+metadata, AE layer flags and the size/mtime of the source artifacts it was
+converted from. Arrays are read-only views of the mapping, so forked
+workers share the pages.
+
+Contents:
+    preprocess.*    fused scaler + mask plan (app.preprocess)
+    rf.*, xgb.*     compiled forests (app.forest)
+    ae.<i>.*        BatchNorm-folded AE layers (app.ae_numpy)
+
+Convert with:
+    python -m app.model_bundle convert models/
+"""
+
+import hashlib
+import json
+import mmap
+import os
+import struct
+import time
+
+import numpy as np
+
+BUNDLE_MAGIC = b"FHIRBNDL"
+FORMAT_VERSION = 1
+ALIGN = 64
+
+# magic, version, reserved, manifest length, manifest digest
+_HEADER = struct.Struct("<8sIIQ16s")
+
+# Artifacts a bundle is converted from (staleness check)
+SOURCE_ARTIFACTS = ("scaler.pkl", "feature_mask.npy", "label_encoder.pkl",
+                    "rf_model.pkl", "xgb_model.pkl", "ae.npz", "ae.pth", "ae.onnx")
+
+_FOREST_ARRAYS = ("feature", "threshold", "children", "default_left", "value", "roots")
+
+
+class BundleError(ValueError):
+    """Raised for a missing, truncated, corrupt or incompatible bundle."""
+
+
+def _digest(data):
+    return hashlib.blake2b(data, digest_size=16).hexdigest()
+
+
+def _pad(n):
+    return (-n) % ALIGN
+
+
+# ======================== READING ========================
+
+def _read_header(f, path):
+    raw = f.read(_HEADER.size)
+    if len(raw) < _HEADER.size:
+        raise BundleError("{}: truncated header".format(path))
+    magic, version, _, length, digest = _HEADER.unpack(raw)
+    if magic != BUNDLE_MAGIC:
+        raise BundleError("{}: not a model bundle".format(path))
+    if version != FORMAT_VERSION:
+        raise BundleError("{}: format version {} (expected {})".format(path, version, FORMAT_VERSION))
+    f.seek(ALIGN)
+    manifest = f.read(length)
+    if len(manifest) != length or hashlib.blake2b(manifest, digest_size=16).digest() != digest:
+        raise BundleError("{}: manifest checksum mismatch".format(path))
+    return json.loads(manifest.decode("utf-8")), _data_start(length)
+
+
+def _data_start(manifest_length):
+    return ALIGN + manifest_length + _pad(ALIGN + manifest_length)
+
+
+def read_manifest(path):
+    """Read only the header and manifest (no arrays are mapped)."""
+    with open(path, "rb") as f:
+        return _read_header(f, path)[0]
+
+
+class ModelBundle:
+    """An opened bundle; arrays are read-only views of one shared mmap.
+
+    Args:
+        path: bundle file
+        verify: check every array's BLAKE2b digest (reads all pages once)
+
+    Raises:
+        BundleError: if the file is not a valid bundle
+    """
+
+    def __init__(self, path, verify=True):
+        self.path = path
+        with open(path, "rb") as f:
+            self.manifest, start = _read_header(f, path)
+            size = os.fstat(f.fileno()).st_size
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        self.arrays = {}
+        for name, spec in self.manifest["arrays"].items():
+            dtype = np.dtype(spec["dtype"])
+            count = int(np.prod(spec["shape"], dtype=np.int64))
+            offset = start + spec["offset"]
+            if offset + count * dtype.itemsize > size:
+                raise BundleError("{}: array {} runs past end of file".format(path, name))
+            arr = np.frombuffer(self._mmap, dtype=dtype, count=count, offset=offset)
+            if verify and _digest(arr) != spec["blake2b"]:
+                raise BundleError("{}: checksum mismatch in {}".format(path, name))
+            self.arrays[name] = arr.reshape(spec["shape"])
+
+    @property
+    def classes(self):
+        return list(self.manifest["classes"])
+
+    @property
+    def n_raw(self):
+        return int(self.manifest["n_raw"])
+
+    def preprocess_plan(self):
+        from app.preprocess import PreprocessPlan
+        a = self.arrays
+        return PreprocessPlan(a["preprocess.index"], a["preprocess.shift"],
+                              a["preprocess.inv_scale"], self.n_raw)
+
+    def forest(self, name):
+        """CompiledForest stored under `name` ("rf" / "xgb")."""
+        from app.forest import CompiledForest
+        meta = self.manifest["forests"][name]
+        a = self.arrays
+        return CompiledForest(
+            meta["kind"],
+            *(a["{}.{}".format(name, field)] for field in _FOREST_ARRAYS),
+            depth=meta["depth"], n_features=meta["n_features"], n_classes=meta["n_classes"],
+            tree_class=a.get(name + ".tree_class"),
+            base_margin=a.get(name + ".base_margin"),
+        )
+
+    def ae_layers(self):
+        """Folded AE layers [(W^T, b, relu)], or None when no AE was bundled."""
+        relus = self.manifest.get("ae_relu")
+        if relus is None:
+            return None
+        return [(self.arrays["ae.{}.wt".format(i)], self.arrays["ae.{}.b".format(i)], bool(relu))
+                for i, relu in enumerate(relus)]
+
+    def stale_sources(self, models_dir):
+        """Source artifacts in `models_dir` changed, added or removed since conversion."""
+        sources = self.manifest.get("sources", {})
+        changed = []
+        for name in SOURCE_ARTIFACTS:
+            path = os.path.join(models_dir, name)
+            if not os.path.exists(path):
+                if name in sources:
+                    changed.append(name + " (removed)")
+            elif name not in sources:
+                changed.append(name + " (added)")
+            else:
+                size, mtime_ns = sources[name]
+                st = os.stat(path)
+                if st.st_size != size or st.st_mtime_ns != mtime_ns:
+                    changed.append(name)
+        return changed
+
+
+# ======================== WRITING ========================
+
+def write_bundle(path, arrays, manifest):
+    """Write `arrays` ({name: ndarray}) and `manifest` to `path` atomically."""
+    specs = {}
+    offset = 0
+    blobs = []
+    for name, arr in arrays.items():
+        arr = np.ascontiguousarray(arr)
+        data = arr.tobytes()
+        specs[name] = {"offset": offset, "dtype": arr.dtype.str, "shape": list(arr.shape),
+                       "blake2b": _digest(data)}
+        blobs.append(data)
+        offset += len(data) + _pad(len(data))
+
+    manifest = dict(manifest, arrays=specs)
+    body = json.dumps(manifest, sort_keys=True).encode("utf-8")
+
+    tmp = path + ".tmp"
+    with open(tmp, "wb") as f:
+        f.write(_HEADER.pack(BUNDLE_MAGIC, FORMAT_VERSION, 0, len(body),
+                             hashlib.blake2b(body, digest_size=16).digest()))
+        f.write(b"\0" * (ALIGN - _HEADER.size))
+        f.write(body)
+        f.write(b"\0" * (_data_start(len(body)) - ALIGN - len(body)))
+        for data in blobs:
+            f.write(data)
+            f.write(b"\0" * _pad(len(data)))
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+    return path
+
+
+def _forest_arrays(name, compiled):
+    arrays = {"{}.{}".format(name, field): getattr(compiled, field) for field in _FOREST_ARRAYS}
+    if compiled.tree_class is not None:
+        arrays[name + ".tree_class"] = compiled.tree_class
+    if compiled.base_margin is not None:
+        arrays[name + ".base_margin"] = compiled.base_margin
+    meta = {"kind": compiled.kind, "depth": compiled.depth, "n_features": compiled.n_features,
+            "n_classes": compiled.n_classes, "n_trees": compiled.n_trees}
+    return arrays, meta
+
+
+def build_bundle(models_dir, out_path=None, log=print):
+    """Convert the `models/` artifact layout into one bundle file.
+
+    Forests and the preprocess plan are parity-checked against the original
+    estimators before anything is written.
+
+    Returns:
+        path of the written bundle
+
+    Raises:
+        BundleError: if an artifact cannot be converted faithfully
+    """
+    import pickle
+
+    import joblib
+
+    from app import preprocess
+    from app.forest import check_parity, compile_forest, probe_matrix
+
+    out_path = out_path or os.path.join(models_dir, "model.bundle")
+    scaler_path = os.path.join(models_dir, "scaler.pkl")
+    scaler = joblib.load(scaler_path) if os.path.exists(scaler_path) else None
+    feature_mask = np.load(os.path.join(models_dir, "feature_mask.npy"))
+    with open(os.path.join(models_dir, "label_encoder.pkl"), "rb") as f:
+        label_encoder = pickle.load(f)
+
+    arrays = {}
+    plan = preprocess.compile_preprocess(scaler, feature_mask)
+    diff = preprocess.check_parity(scaler, feature_mask, plan,
+                                   preprocess.probe_matrix(scaler, plan.n_raw))
+    if diff > 1e-4:
+        raise BundleError("preprocess plan failed parity (max rel |d|={:.3e})".format(diff))
+    arrays.update({"preprocess.index": plan.index.astype(np.int64),
+                   "preprocess.shift": plan.shift, "preprocess.inv_scale": plan.inv_scale})
+    log("  preprocess: {} -> {} features".format(plan.n_raw, plan.n_selected))
+
+    forests = {}
+    estimators = {}
+    for name, filename in (("rf", "rf_model.pkl"), ("xgb", "xgb_model.pkl")):
+        estimator = joblib.load(os.path.join(models_dir, filename))
+        try:
+            compiled = compile_forest(estimator)
+        except TypeError as e:
+            raise BundleError("{}: {}".format(filename, e))
+        diff = check_parity(estimator, compiled, probe_matrix(compiled.n_features))
+        if diff > 1e-5:
+            raise BundleError("{} compiled forest failed parity (max |dp|={:.3e})".format(name, diff))
+        forest_arrays, forests[name] = _forest_arrays(name, compiled)
+        arrays.update(forest_arrays)
+        estimators[name] = getattr(estimator, "n_estimators", None)
+        log("  {}: {} trees, {} nodes".format(name, compiled.n_trees, compiled.n_nodes))
+
+    manifest = {
+        "created": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        "n_raw": plan.n_raw,
+        "n_selected": plan.n_selected,
+        "classes": [str(c) for c in label_encoder.classes_],
+        "forests": forests,
+        "estimators": estimators,
+    }
+
+    # Same preference order as the NumPy AE backend
+    ae_path = next((os.path.join(models_dir, name) for name in ("ae.npz", "ae.pth", "ae.onnx")
+                    if os.path.exists(os.path.join(models_dir, name))), None)
+    if ae_path is not None:
+        from app.ae_numpy import NumpyAERuntime
+        try:
+            layers = NumpyAERuntime(ae_path).layers
+        except Exception as e:
+            log("  ae: not bundled ({})".format(e))
+        else:
+            for i, (WT, b, _) in enumerate(layers):
+                arrays["ae.{}.wt".format(i)] = WT
+                arrays["ae.{}.b".format(i)] = b
+            manifest["ae_relu"] = [bool(relu) for _, _, relu in layers]
+            manifest["ae_source"] = os.path.basename(ae_path)
+            log("  ae: {} layers from {}".format(len(layers), os.path.basename(ae_path)))
+
+    sources = {}
+    for name in SOURCE_ARTIFACTS:
+        path = os.path.join(models_dir, name)
+        if os.path.exists(path):
+            st = os.stat(path)
+            sources[name] = [st.st_size, st.st_mtime_ns]
+    manifest["sources"] = sources
+    return write_bundle(out_path, arrays, manifest)
+
+
+if __name__ == "__main__":
+    """Convert a models/ directory, or inspect / verify a bundle."""
+    import argparse
+    import sys
+    import warnings
+
+    warnings.filterwarnings("ignore")
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    sub = parser.add_subparsers(dest="command", required=True)
+    p_convert = sub.add_parser("convert", help="write <models_dir>/model.bundle")
+    p_convert.add_argument("models_dir")
+    p_convert.add_argument("-o", "--out", help="bundle path (default: <models_dir>/model.bundle)")
+    p_info = sub.add_parser("info", help="print the manifest and verify checksums")
+    p_info.add_argument("bundle")
+    args = parser.parse_args()
+
+    if args.command == "convert":
+        print("Converting {} ...".format(args.models_dir))
+        try:
+            path = build_bundle(args.models_dir, args.out)
+        except (BundleError, OSError) as e:
+            print("❌ {}".format(e))
+            sys.exit(1)
+        args.bundle = path
+
+    t0 = time.perf_counter()
+    try:
+        bundle = ModelBundle(args.bundle, verify=True)
+    except (BundleError, OSError) as e:
+        print("❌ {}".format(e))
+        sys.exit(1)
+    elapsed = (time.perf_counter() - t0) * 1000.0
+    nbytes = sum(a.nbytes for a in bundle.arrays.values())
+    print("✅ {}: {} arrays, {:.1f} KB, opened and verified in {:.1f} ms".format(
+        args.bundle, len(bundle.arrays), nbytes / 1024.0, elapsed))
+    print("   classes: {}".format(", ".join(bundle.classes)))
+    print("   forests: {}".format(", ".join("{} ({} trees)".format(k, v["n_trees"])
+                                            for k, v in bundle.manifest["forests"].items())))
+    print("   ae: {}".format(bundle.manifest.get("ae_source", "not bundled")))
@@ -0,0 +1,219 @@
+"""Pre-fork multi-worker server.
+
+The master imports app.server once (artifacts, compiled forests, NumPy AE
+weights), then moves every object allocated so far into the GC's permanent
+generation with gc.freeze(), so collections in the workers never write to,
+and thereby copy, those pages. It binds the listening socket and forks the
+workers. Each worker accepts on the shared socket with its own threaded
+WSGI server, so CPU-bound inference runs under one GIL per worker instead of
+one for the whole service.
+
+Per-worker state:
+    - AE backends that own thread pools or a CUDA context (onnxruntime,
+      torch, TensorRT) are created in each worker after fork; NumPy AE
+      weights are shared with the master.
+    - Native thread pools (sklearn, xgboost, torch, ONNX Runtime, BLAS)
+      are sized from CPU_BUDGET divided by the worker count (see
+      app.thread_budget), so N workers do not each claim every core.
+    - Background threads (micro-batcher, alert writer) start lazily in each
+      worker. Workers append to the same alert log and follow each other's
+      rotations.
+    - /metrics, /batcher/stats, /alerts/stats and the result cache describe
+      the worker that answered the request.
+
+Usage:
+    python -m app.prefork --workers 4 --port 5000
+    python -m app.prefork --single --port 5000     # one process, like app.server
+"""
+
+import argparse
+import gc
+import os
+import signal
+import socket
+import sys
+import threading
+import time
+
+# A worker that dies sooner than this after starting is respawned with a delay
+RESPAWN_BACKOFF_S = 1.0
+
+
+def _bind(host, port, backlog):
+    family = socket.AF_INET6 if ":" in host else socket.AF_INET
+    sock = socket.socket(family, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(backlog)
+    sock.set_inheritable(True)
+    return sock
+
+
+def _serve(sock, host, port):
+    """Serve app.server on an already bound socket until SIGTERM."""
+    from werkzeug.serving import make_server
+    from app import server
+
+    httpd = make_server(host, port, server.app, threaded=True, fd=sock.fileno())
+
+    def stop(signum, frame):
+        # shutdown() waits for serve_forever(), so it must run on another thread
+        threading.Thread(target=httpd.shutdown, daemon=True).start()
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    httpd.serve_forever()
+    server.alert_sink.close()
+
+
+def _worker_main(sock, host, port, index):
+    """Entry point of a forked worker; never returns."""
+    code = 0
+    try:
+        from app import config, server
+        config.AE_PER_WORKER = False   # reloads in this worker create their AE directly
+        if server.model is not None and server.model.ae is None:
+            server.model.init_ae()
+        print("[prefork] worker {} (pid {}) serving, AE backend: {}".format(
+            index, os.getpid(), server.model.ae_backend if server.model is not None else None))
+        sys.stdout.flush()
+        _serve(sock, host, port)
+    except BaseException as e:
+        print("[prefork] worker {} (pid {}) failed: {}".format(index, os.getpid(), e))
+        code = 1
+    finally:
+        sys.stdout.flush()
+        sys.stderr.flush()
+        # Never unwind into the master's stack frames
+        os._exit(code)
+
+
+class Master:
+    """Forks and supervises `workers` processes sharing one listening socket."""
+
+    def __init__(self, host, port, workers, backlog=1024):
+        self.host = host
+        self.port = port
+        self.workers = max(1, int(workers))
+        self.backlog = backlog
+        self.children = {}          # pid -> (worker index, start time)
+        self._stopping = False
+
+    def _spawn(self, sock, index):
+        pid = os.fork()
+        if pid == 0:
+            signal.signal(signal.SIGTERM, signal.SIG_DFL)
+            signal.signal(signal.SIGINT, signal.SIG_DFL)
+            gc.enable()
+            _worker_main(sock, self.host, self.port, index)
+        self.children[pid] = (index, time.monotonic())
+
+    def _stop(self, signum, frame):
+        self._stopping = True
+
+    def run(self):
+        from app import config
+        config.AE_PER_WORKER = True
+        config.SERVING_WORKERS = self.workers
+        from app import server
+
+        if not server.MODEL_READY:
+            print("[prefork] model not loaded; workers will serve /health as degraded")
+
+        # Everything imported and loaded so far is shared copy-on-write;
+        # keep the collector from touching it (and so from copying it)
+        gc.disable()
+        gc.collect()
+        gc.freeze()
+
+        sock = _bind(self.host, self.port, self.backlog)
+        print("[prefork] master pid {} listening on {}:{}, {} workers ({} objects frozen)".format(
+            os.getpid(), self.host, self.port, self.workers, gc.get_freeze_count()))
+        sys.stdout.flush()
+
+        signal.signal(signal.SIGTERM, self._stop)
+        signal.signal(signal.SIGINT, self._stop)
+        for index in range(self.workers):
+            self._spawn(sock, index)
+
+        while not self._stopping:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                pid, status = 0, 0
+            if pid == 0:
+                time.sleep(0.2)
+                continue
+            index, started = self.children.pop(pid, (None, 0.0))
+            if index is None or self._stopping:
+                continue
+            print("[prefork] worker {} (pid {}) exited with status {}; respawning".format(
+                index, pid, status))
+            sys.stdout.flush()
+            if time.monotonic() - started < RESPAWN_BACKOFF_S:
+                time.sleep(RESPAWN_BACKOFF_S)
+            self._spawn(sock, index)
+
+        self.shutdown()
+        sock.close()
+
+    def shutdown(self, timeout=10.0):
+        """SIGTERM every worker, then SIGKILL those still running after `timeout`."""
+        for pid in list(self.children):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                self.children.pop(pid, None)
+        deadline = time.monotonic() + timeout
+        while self.children and time.monotonic() < deadline:
+            try:
+                pid, _ = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                break
+            if pid:
+                self.children.pop(pid, None)
+            else:
+                time.sleep(0.05)
+        for pid in list(self.children):
+            try:
+                os.kill(pid, signal.SIGKILL)
+                os.waitpid(pid, 0)
+            except (ProcessLookupError, ChildProcessError):
+                pass
+        self.children.clear()
+        print("[prefork] stopped")
+
+
+def main(argv=None):
+    from app import config
+    from app.thread_budget import visible_cpus
+
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=config.PREFORK_PORT)
+    parser.add_argument("--workers", type=int, default=config.PREFORK_WORKERS,
+                        help="worker processes (default: PREFORK_WORKERS, 0 = one per usable CPU)")
+    parser.add_argument("--backlog", type=int, default=1024)
+    parser.add_argument("--single", action="store_true",
+                        help="serve from this process without forking (same as app.server)")
+    args = parser.parse_args(argv)
+
+    if not hasattr(os, "fork") and not args.single:
+        print("[prefork] fork() is not available on this platform; use --single")
+        return 2
+
+    if args.single:
+        sock = _bind(args.host, args.port, args.backlog)
+        print("[prefork] single process pid {} listening on {}:{}".format(
+            os.getpid(), args.host, args.port))
+        sys.stdout.flush()
+        _serve(sock, args.host, args.port)
+        return 0
+
+    workers = args.workers if args.workers > 0 else visible_cpus()
+    Master(args.host, args.port, workers, backlog=args.backlog).run()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
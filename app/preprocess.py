@@ -0,0 +1,169 @@
+"""Fused scaler + feature-mask preprocessing.
+
+The reference path runs `StandardScaler.transform` over every raw column and
+then drops most of them with `feature_mask`. At model load the scaler is
+restricted to the selected columns and folded into one float32 plan:
+
+    index      intp    (k,)   raw column of each selected feature
+    shift      float32 (k,)   scaler mean (0 when with_mean=False)
+    inv_scale  float32 (k,)   1 / scaler scale (1 when with_std=False)
+
+so a batch is one gather into a (reusable) float32 buffer followed by an
+in-place subtract and multiply. Subtracting before scaling keeps the large
+raw columns (e.g. timestamps) accurate in float32, where a folded
+`x * a + b` would cancel two large terms.
+"""
+
+import numpy as np
+
+
+class PreprocessPlan:
+    """Selected-column affine transform compiled from a scaler and a mask."""
+
+    def __init__(self, index, shift, inv_scale, n_raw):
+        self.index = np.ascontiguousarray(index, dtype=np.intp)
+        self.shift = np.ascontiguousarray(shift, dtype=np.float32)
+        self.inv_scale = np.ascontiguousarray(inv_scale, dtype=np.float32)
+        self.n_raw = int(n_raw)
+        self.n_selected = int(self.index.size)
+
+    def transform(self, X, out=None):
+        """Scale and select features.
+
+        Args:
+            X: float32 array of shape (n_samples, n_raw)
+            out: optional float32 array of shape (n_samples, n_selected)
+
+        Returns:
+            `out` (or a new array) holding the selected, scaled features
+        """
+        X = np.asarray(X, dtype=np.float32)
+        if X.ndim != 2 or X.shape[1] != self.n_raw:
+            raise ValueError("X has {} features, but the model expects {}".format(
+                X.shape[-1] if X.ndim else 0, self.n_raw))
+        if out is None:
+            out = np.empty((X.shape[0], self.n_selected), dtype=np.float32)
+        np.take(X, self.index, axis=1, out=out)
+        out -= self.shift
+        out *= self.inv_scale
+        return out
+
+
+def _mask_index(feature_mask, n_raw):
+    mask = np.asarray(feature_mask)
+    if mask.dtype == bool:
+        if mask.size != n_raw:
+            raise ValueError("boolean feature mask has {} entries for {} features".format(
+                mask.size, n_raw))
+        return np.flatnonzero(mask)
+    index = mask.astype(np.intp)
+    if index.size and (index.min() < -n_raw or index.max() >= n_raw):
+        raise ValueError("feature mask index out of range for {} features".format(n_raw))
+    return np.where(index < 0, index + n_raw, index)
+
+
+def compile_preprocess(scaler, feature_mask, n_raw=None):
+    """Fold `scaler` (StandardScaler or None) and `feature_mask` into a plan.
+
+    Raises:
+        ValueError: for scalers that are not a per-column standardization
+    """
+    if n_raw is None:
+        n_raw = getattr(scaler, "n_features_in_", None)
+    if n_raw is None:
+        mask = np.asarray(feature_mask)
+        n_raw = mask.size if mask.dtype == bool else int(mask.max()) + 1
+    index = _mask_index(feature_mask, n_raw)
+
+    shift = np.zeros(index.size, dtype=np.float64)
+    scale = np.ones(index.size, dtype=np.float64)
+    if scaler is not None:
+        if not hasattr(scaler, "mean_") or not hasattr(scaler, "scale_"):
+            raise ValueError("{} is not supported".format(type(scaler).__name__))
+        if getattr(scaler, "with_mean", True) and scaler.mean_ is not None:
+            shift = np.asarray(scaler.mean_, dtype=np.float64)[index]
+        if getattr(scaler, "with_std", True) and scaler.scale_ is not None:
+            scale = np.asarray(scaler.scale_, dtype=np.float64)[index]
+    return PreprocessPlan(index, shift, 1.0 / scale, n_raw)
+
+
+def reference_preprocess(scaler, feature_mask, X):
+    """The unfused path: float32 cast, full scaler.transform, then the mask."""
+    X = np.array(X, dtype=np.float32)
+    if scaler is not None:
+        X = scaler.transform(X)
+    return X[:, feature_mask]
+
+
+def check_parity(scaler, feature_mask, plan, X):
+    """Max |Δ| / (1 + |x|) between the reference path and the plan."""
+    expected = np.asarray(reference_preprocess(scaler, feature_mask, X), dtype=np.float64)
+    actual = plan.transform(X)
+    if expected.shape != actual.shape:
+        return float("inf")
+    if not expected.size:
+        return 0.0
+    return float(np.max(np.abs(expected - actual) / (1.0 + np.abs(expected))))
+
+
+def probe_matrix(scaler, n_raw, n_samples=512, seed=0):
+    """Rows drawn around the scaler's fitted mean/scale, plus zeros and the mean."""
+    rng = np.random.default_rng(seed)
+    mean = np.zeros(n_raw)
+    scale = np.ones(n_raw)
+    if scaler is not None and getattr(scaler, "mean_", None) is not None:
+        mean = np.asarray(scaler.mean_, dtype=np.float64)
+    if scaler is not None and getattr(scaler, "scale_", None) is not None:
+        scale = np.asarray(scaler.scale_, dtype=np.float64)
+    X = rng.normal(size=(n_samples, n_raw)) * scale * 3.0 + mean
+    X[0] = 0.0
+    X[1] = mean
+    return X.astype(np.float32)
+
+
+if __name__ == "__main__":
+    """Parity check and benchmark: fused plan vs scaler.transform + mask."""
+    import argparse
+    import os
+    import time
+    import warnings
+
+    import joblib
+
+    warnings.filterwarnings("ignore")
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--models-dir", default=os.getenv("MODELS_DIR", "models"))
+    parser.add_argument("--repeat", type=int, default=200)
+    args = parser.parse_args()
+
+    scaler_path = os.path.join(args.models_dir, "scaler.pkl")
+    scaler = joblib.load(scaler_path) if os.path.exists(scaler_path) else None
+    feature_mask = np.load(os.path.join(args.models_dir, "feature_mask.npy"))
+    plan = compile_preprocess(scaler, feature_mask)
+    X_probe = probe_matrix(scaler, plan.n_raw, n_samples=4096)
+
+    diff = check_parity(scaler, feature_mask, plan, X_probe)
+    print("{} -> {} features, parity: max rel |Δ| = {:.3e} -> {}".format(
+        plan.n_raw, plan.n_selected, diff, "OK" if diff <= 1e-4 else "MISMATCH"))
+
+    # Masks of both kinds and no scaler at all must agree too
+    bool_mask = np.zeros(plan.n_raw, dtype=bool)
+    bool_mask[plan.index] = True
+    for name, sc, mask in (("bool mask", scaler, bool_mask), ("no scaler", None, feature_mask)):
+        d = check_parity(sc, mask, compile_preprocess(sc, mask, plan.n_raw), X_probe)
+        print("  {:<10} max rel |Δ| = {:.3e} -> {}".format(name, d, "OK" if d <= 1e-4 else "MISMATCH"))
+
+    print("  {:>6} {:>12} {:>12} {:>9}".format("batch", "reference", "fused", "speedup"))
+    for bs in (1, 8, 64, 512, 4096):
+        Xb = X_probe[:bs]
+        out = np.empty((bs, plan.n_selected), dtype=np.float32)
+        timings = []
+        for fn in (lambda: reference_preprocess(scaler, feature_mask, Xb),
+                   lambda: plan.transform(Xb, out=out)):
+            fn()
+            t0 = time.perf_counter()
+            for _ in range(args.repeat):
+                fn()
+            timings.append((time.perf_counter() - t0) / args.repeat * 1e6)
+        print("  {:>6} {:>9.1f} us {:>9.1f} us {:>8.1f}x".format(
+            bs, timings[0], timings[1], timings[0] / timings[1]))
@@ -0,0 +1,156 @@
+"""On-demand sampling profiler for the running server.
+
+`SamplingProfiler.profile()` runs in the calling (admin request) thread: it
+wakes every `interval_ms`, reads `sys._current_frames()` and counts the
+stacks of threads that are serving a request or doing model work (the
+micro-batcher, the ASGI inference executor, the classifier pool). Results
+are collapsed stacks, one `frame;frame;... count` line per distinct stack,
+ready for flamegraph.pl / speedscope.
+
+When no profile is running the request hooks cost one attribute check.
+"""
+
+import sys
+import threading
+import time
+from collections import Counter
+
+# Name prefixes of background threads whose time is attributed alongside
+# request threads (executor threads are named <prefix>_<n>)
+WORKER_THREADS = ("micro-batcher", "inference", "classifier")
+
+# Leaf frames meaning "blocked waiting for work" on a worker thread
+_IDLE_FILES = ("threading.py", "queue.py", "futures/thread.py")
+
+
+class ProfilerBusy(RuntimeError):
+    """Raised when a profile is already running."""
+
+
+def _frame_label(frame):
+    code = frame.f_code
+    module = frame.f_globals.get("__name__", "?")
+    return "{}:{}".format(module, getattr(code, "co_qualname", code.co_name))
+
+
+def _stack(frame):
+    labels = []
+    while frame is not None:
+        labels.append(_frame_label(frame))
+        frame = frame.f_back
+    labels.reverse()
+    return labels
+
+
+class SamplingProfiler:
+    """Samples request and worker thread stacks while a profile is running."""
+
+    def __init__(self, worker_threads=WORKER_THREADS, max_seconds=60.0):
+        self.worker_threads = tuple(worker_threads)
+        self.max_seconds = float(max_seconds)
+        self.active = False
+
+        self._lock = threading.Lock()
+        self._request_threads = set()
+        self._requests = 0
+        self._max_requests = 0
+        self._done = threading.Event()
+
+    # ---------------------------------------------------------------- hooks
+    def request_started(self):
+        if self.active:
+            self._request_threads.add(threading.get_ident())
+
+    def request_finished(self):
+        if self.active:
+            self._request_threads.discard(threading.get_ident())
+            self._requests += 1
+            if self._max_requests and self._requests >= self._max_requests:
+                self._done.set()
+
+    # ------------------------------------------------------------- sampling
+    def profile(self, seconds=10.0, requests=0, interval_ms=5.0):
+        """Sample live threads until `seconds` elapse or `requests` complete.
+
+        Args:
+            seconds: wall-clock limit (capped at max_seconds)
+            requests: stop after this many requests finished (0 = no limit)
+            interval_ms: sampling period
+
+        Returns:
+            dict with 'stacks' (Counter of ';'-joined stacks), 'samples',
+            'idle_samples', 'requests', 'duration_s' and 'interval_ms'
+
+        Raises:
+            ProfilerBusy: if another profile is running
+        """
+        if not self._lock.acquire(blocking=False):
+            raise ProfilerBusy("a profile is already running")
+        try:
+            seconds = min(max(0.0, float(seconds)), self.max_seconds)
+            interval = max(0.5, float(interval_ms)) / 1000.0
+            own = threading.get_ident()
+
+            stacks = Counter()
+            samples = idle = 0
+            self._request_threads = set()
+            self._requests = 0
+            self._max_requests = max(0, int(requests))
+            self._done.clear()
+            self.active = True
+
+            start = time.monotonic()
+            end = start + seconds
+            while not self._done.wait(interval) and time.monotonic() < end:
+                workers = {t.ident: t.name for t in threading.enumerate()
+                           if t.name.startswith(self.worker_threads)}
+                requests_now = set(self._request_threads)
+                for ident, frame in sys._current_frames().items():
+                    if ident == own:
+                        continue
+                    if ident in requests_now:
+                        root = "request"
+                    elif ident in workers:
+                        if frame.f_code.co_filename.endswith(_IDLE_FILES):
+                            idle += 1
+                            continue
+                        root = workers[ident]
+                    else:
+                        continue
+                    stacks[";".join([root] + _stack(frame))] += 1
+                    samples += 1
+
+            return {
+                "stacks": stacks,
+                "samples": samples,
+                "idle_samples": idle,
+                "requests": self._requests,
+                "duration_s": time.monotonic() - start,
+                "interval_ms": interval * 1000.0,
+            }
+        finally:
+            self.active = False
+            self._request_threads = set()
+            self._lock.release()
+
+
+def collapsed(stacks):
+    """Render a stacks Counter as collapsed-stack text (flamegraph.pl input)."""
+    return "".join("{} {}\n".format(stack, count) for stack, count in stacks.most_common())
+
+
+def top_functions(stacks, limit=25):
+    """Self and inclusive sample counts per frame label, sorted by inclusive."""
+    self_counts = Counter()
+    total_counts = Counter()
+    for stack, count in stacks.items():
+        frames = stack.split(";")[1:]
+        if not frames:
+            continue
+        self_counts[frames[-1]] += count
+        for label in set(frames):
+            total_counts[label] += count
+    return [
+        {"frame": label, "inclusive": total, "self": self_counts[label]}
+        for label, total in total_counts.most_common(limit)
+    ]
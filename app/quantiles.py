@@ -0,0 +1,172 @@
+"""Windowed quantiles of live AE scores and the adaptive fast-exit threshold.
+
+The low AE threshold decides the fast-exit ratio, i.e. how many rows RF and
+XGB never see, and so most of the classifier CPU. The right value depends
+on the traffic a node actually gets, so the scores the model produces are
+tracked here.
+
+At most AE_QUANTILE_SAMPLE_ROWS evenly spaced scores of each inference call
+are copied into a preallocated float64 buffer of AE_QUANTILE_WINDOW slots:
+one slice assignment per call, no Python loop over scores. When the buffer
+fills, the window's quantiles are computed in one np.quantile call and
+published, and the buffer starts over (tumbling windows), so the quantiles
+follow drifting traffic. Memory is fixed at 8 bytes per window slot.
+
+With AE_TARGET_FAST_EXIT > 0 the low threshold is moved, at the end of each
+window, to that quantile of the window's scores, clamped to
+[AE_LOW_MIN, AE_LOW_MAX] and never above the medium threshold. Medium and
+high (severity) stay as configured.
+"""
+
+import threading
+
+import numpy as np
+
+from app import config
+from app.metrics import REGISTRY
+
+# Quantiles always published; the target fast-exit ratio is added to them
+PUBLISHED = (0.5, 0.9, 0.95, 0.99)
+
+
+class ScoreQuantiles:
+    """Windowed quantiles of AE scores and the thresholds derived from them.
+
+    Args:
+        thresholds: configured {"low", "medium", "high"}
+        target_fast_exit: quantile the low threshold follows; 0 keeps it fixed
+        low_bounds: (min, max) for the adapted low threshold
+        window: scores per window
+        sample_rows: scores kept per observe() call at most
+    """
+
+    def __init__(self, thresholds, target_fast_exit=0.0, low_bounds=(0.005, 0.05),
+                 window=10000, sample_rows=64):
+        self.configured = dict(thresholds)
+        self.target = float(target_fast_exit) if 0.0 < target_fast_exit < 1.0 else None
+        self.low_min = float(low_bounds[0])
+        self.low_max = min(float(low_bounds[1]), self.configured["medium"])
+        self.window = max(1, int(window))
+        self.sample_rows = max(1, min(int(sample_rows), self.window))
+        self.probs = tuple(sorted(set(PUBLISHED + ((self.target,) if self.target else ()))))
+
+        self._lock = threading.Lock()
+        self._buf = np.empty(self.window, dtype=np.float64)
+        self._fill = 0
+        self._published = None
+        self._windows = 0
+        self._observed = 0
+        self._adjustments = 0
+        # Replaced, never mutated: results and cache keys hold on to it
+        self._thresholds = dict(self.configured)
+
+    def observe(self, scores):
+        """Keep (a sample of) the AE scores of one inference call."""
+        scores = np.asarray(scores, dtype=np.float64).reshape(-1)
+        n = scores.size
+        if n > self.sample_rows:
+            scores = scores[::-(-n // self.sample_rows)]
+            n = scores.size
+        with self._lock:
+            room = self.window - self._fill
+            self._buf[self._fill:self._fill + min(n, room)] = scores[:room]
+            self._fill += min(n, room)
+            if self._fill == self.window:
+                self._roll()
+                rest = scores[room:]
+                self._buf[:rest.size] = rest
+                self._fill = rest.size
+            self._observed += n
+
+    def _roll(self):
+        values = np.quantile(self._buf, self.probs)
+        self._published = {p: float(v) for p, v in zip(self.probs, values)}
+        self._windows += 1
+        if self.target is None:
+            return
+        low = min(self.low_max, max(self.low_min, self._published[self.target]))
+        if low != self._thresholds["low"]:
+            print("[AE Thresholds] low {:.6g} -> {:.6g} (q{:g} of the last {} scores)".format(
+                self._thresholds["low"], low, self.target, self.window))
+            self._thresholds = dict(self._thresholds, low=low)
+            self._adjustments += 1
+
+    def reset(self):
+        """Forget the observed scores and return to the configured thresholds.
+
+        Called when the model is reloaded: scores of the previous model say
+        nothing about the new one's reconstruction error.
+        """
+        with self._lock:
+            self._fill = 0
+            self._published = None
+            self._windows = 0
+            self._observed = 0
+            self._adjustments = 0
+            self._thresholds = dict(self.configured)
+
+    def thresholds(self):
+        """Current {"low", "medium", "high"} (the same dict until it changes)."""
+        return self._thresholds
+
+    def quantiles(self):
+        """{p: score} over the last complete window, else the running one."""
+        if self._published is not None:
+            return dict(self._published)
+        with self._lock:
+            if self._fill == 0:
+                return {p: None for p in self.probs}
+            values = np.quantile(self._buf[:self._fill], self.probs)
+        return {p: float(v) for p, v in zip(self.probs, values)}
+
+    def stats(self):
+        return {
+            "thresholds": self._thresholds,
+            "configured": self.configured,
+            "adaptive": self.target is not None,
+            "target_fast_exit": self.target,
+            "low_bounds": [self.low_min, self.low_max],
+            "quantiles": {"{:g}".format(p): v for p, v in sorted(self.quantiles().items())},
+            "window": self.window,
+            "windows": self._windows,
+            "observed": self._observed,
+            "adjustments": self._adjustments,
+        }
+
+
+AE_SCORES = ScoreQuantiles(
+    {"low": config.AE_THRESHOLD_LOW, "medium": config.AE_THRESHOLD_MEDIUM,
+     "high": config.AE_THRESHOLD_HIGH},
+    target_fast_exit=config.AE_TARGET_FAST_EXIT,
+    low_bounds=(config.AE_LOW_MIN, config.AE_LOW_MAX),
+    window=config.AE_QUANTILE_WINDOW,
+    sample_rows=config.AE_QUANTILE_SAMPLE_ROWS,
+)
+
+REGISTRY.callback(
+    "fhir_ae_score_quantile", "AE reconstruction error quantiles (last complete window)",
+    lambda: {("{:g}".format(p),): v for p, v in AE_SCORES.quantiles().items() if v is not None},
+    labelnames=("quantile",),
+)
+REGISTRY.callback(
+    "fhir_ae_threshold", "AE thresholds in use",
+    lambda: {(level,): v for level, v in AE_SCORES.thresholds().items()},
+    labelnames=("level",),
+)
+
+
+if __name__ == "__main__":
+    import time
+
+    rng = np.random.default_rng(0)
+    data = rng.lognormal(mean=-5.0, sigma=1.0, size=(4000, 64))
+    sketch = ScoreQuantiles({"low": 0.01, "medium": 0.05, "high": 0.1},
+                            target_fast_exit=0.9, low_bounds=(0.0, 1.0), window=10000)
+    t0 = time.perf_counter()
+    for batch in data:
+        sketch.observe(batch)
+    per_call = (time.perf_counter() - t0) / len(data)
+    exact = np.quantile(data[-(10000 // 64):].reshape(-1), 0.9)
+    print("observe(64): {:.1f} us/call, {} windows".format(per_call * 1e6, sketch.stats()["windows"]))
+    print("q0.9: window {:.6g}  exact (same span) {:.6g}  low now {:.6g}".format(
+        sketch.quantiles()[0.9], exact, sketch.thresholds()["low"]))
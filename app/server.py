@@ -1,18 +1,38 @@
-from flask import Flask, request, jsonify
-from app.edge_model import HybridDeployedModel
+from flask import Flask, Response, g, request, jsonify, stream_with_context
+from app.edge_model import HybridDeployedModel, ModelLoadError
+from app.batcher import MicroBatcher, BatchQueueFull
+from app.alert_sink import AlertSink
+from app import metrics
+from app.metrics import STAGE_SECONDS
+from app.profiler import SamplingProfiler, ProfilerBusy, collapsed, top_functions
+from app.fhir_decode import decode_audit_event, iter_bundle_entries, iter_ndjson, DecodeError
+from app import fhir_features
+from app.fhir_features import extract_features, extract_batch
+from app.load_control import CONTROLLER
+from app.quantiles import AE_SCORES
+from app import config
+from concurrent.futures import TimeoutError as FutureTimeout
 import numpy as np
-import os
 import datetime
+import hmac
+import json
+import time
 
 app = Flask(__name__)
 
+# Bundle entries are featurized in chunks so parsed resources can be released
+BUNDLE_CHUNK_SIZE = 512
+
+# Optional per-request time budget (ms) for /fhir/notify and /fhir/batch
+DEADLINE_HEADER = "X-Deadline-Ms"
+
 # Initialize model
 print("=" * 60)
 print("🚀 INITIALIZING HYBRID DETECTION SYSTEM")
 print("=" * 60)
 
 try:
-    model = HybridDeployedModel()
+    model = HybridDeployedModel(config.MODELS_DIR)
     MODEL_READY = True
     print("✅ Model loaded successfully!\n")
 except Exception as e:
@@ -21,6 +41,111 @@ except Exception as e:
     print("❌ Failed to load model: {}".format(e))
     # Keep server running but /health will report not ready
 
+# Micro-batcher gathers concurrent /fhir/notify requests into one inference
+batcher = None
+if MODEL_READY and config.BATCH_ENABLED:
+    batcher = MicroBatcher(
+        model,
+        window_ms=config.BATCH_WINDOW_MS,
+        max_batch=config.BATCH_MAX_SIZE,
+        deadline_ms=config.BATCH_DEADLINE_MS,
+        max_queue=config.BATCH_MAX_QUEUE,
+    )
+
+# Anomalies are written to LOG_FILE (JSONL, tailed by promtail) off the request path
+alert_sink = AlertSink(
+    config.LOG_FILE,
+    max_queue=config.ALERT_QUEUE_SIZE,
+    flush_ms=config.ALERT_FLUSH_MS,
+    flush_bytes=config.ALERT_FLUSH_BYTES,
+    fsync=config.ALERT_FSYNC,
+    max_bytes=config.ALERT_MAX_BYTES,
+    rotate_s=config.ALERT_ROTATE_S,
+    backups=config.ALERT_BACKUPS,
+)
+
+
+def log_alerts(results):
+    """Queue the anomalous results for the alert log."""
+    for result in results:
+        if result.get("anom"):
+            alert_sink.record(result)
+
+
+def request_deadline_ms(headers):
+    """Time budget from the DEADLINE_HEADER, or None when absent.
+
+    Raises:
+        ValueError: if the header is not a positive number
+    """
+    value = headers.get(DEADLINE_HEADER)
+    if value is None:
+        return None
+    budget = float(value)
+    if not budget > 0:
+        raise ValueError(value)
+    return budget
+
+
+def notify_payload(result):
+    """Response body of /fhir/notify for one inference result."""
+    return {
+        "pred": result.get("pred"),
+        "score": float(result.get("score")),
+        "sev": result.get("sev"),
+        "anom": bool(result.get("anom")),
+        "meta": result.get("meta"),
+        "mode": result.get("mode"),
+        "all_results": result.get("all_results")
+    }
+
+# Scrape-time gauges for the background queues
+metrics.REGISTRY.callback(
+    "fhir_queue_depth", "Items waiting in background queues",
+    lambda: {("batcher",): batcher.queue_depth() if batcher is not None else 0,
+             ("alerts",): alert_sink.queue_depth()},
+    labelnames=("queue",),
+)
+# Queued micro-batcher requests count towards degrading the pipeline
+CONTROLLER.add_queue("batcher", lambda: batcher.queue_depth() if batcher is not None else 0)
+metrics.REGISTRY.callback(
+    "fhir_alerts_dropped_total", "Alerts dropped because the alert queue was full",
+    lambda: alert_sink.stats()["dropped"], kind="counter",
+)
+metrics.REGISTRY.callback(
+    "fhir_result_cache_entries", "Results held in the inference result cache",
+    lambda: len(model.result_cache) if model is not None and model.result_cache is not None else 0,
+)
+
+
+# Sampling profiler, idle unless /admin/profile is running
+profiler = SamplingProfiler(max_seconds=config.PROFILE_MAX_SECONDS)
+
+
+def admin_authorized():
+    """X-Admin-Token must match ADMIN_TOKEN; without a token only localhost is allowed."""
+    if config.ADMIN_TOKEN:
+        token = request.headers.get("X-Admin-Token", "")
+        return hmac.compare_digest(token.encode(), config.ADMIN_TOKEN.encode())
+    return request.remote_addr in ("127.0.0.1", "::1")
+
+
+@app.before_request
+def _start_timer():
+    g.request_start = time.perf_counter()
+    profiler.request_started()
+
+
+@app.after_request
+def _record_request(response):
+    profiler.request_finished()
+    endpoint = request.endpoint or "unknown"
+    start = g.get("request_start")
+    if start is not None:
+        metrics.REQUEST_SECONDS.observe(time.perf_counter() - start, (endpoint,))
+    metrics.REQUESTS.inc(1, (endpoint, str(response.status_code)))
+    return response
+
 # ======================== API ENDPOINTS ========================
 
 @app.route("/health", methods=["GET"])
@@ -41,7 +166,13 @@ def fhir_notify():
     """
     Main detection endpoint
     
-    Expected JSON format:
+    Accepts a raw FHIR AuditEvent (Content-Type: application/fhir+json, as
+    posted by the FHIR Subscription rest-hook) or precomputed features.
+    An optional X-Deadline-Ms header sets the time budget; classifier stages
+    that cannot finish within it are skipped, and "mode" in the response
+    says which pipeline produced the verdict (see app.load_control).
+    
+    Expected JSON format for precomputed features:
     {
         "features": [f1, f2, ..., f_n],
         "metadata": {
@@ -52,47 +183,69 @@ def fhir_notify():
     }
     """
     try:
-        # Parse request
-        data = request.get_json()
-        
-        if not data or "features" not in data:
-            return jsonify({
-                "error": "Missing 'features' in request body"
-            }), 400
-        
-        # Extract features
-        features = data["features"]
-        metadata = data.get("metadata", {})
+        deadline_ms = request_deadline_ms(request.headers)
+    except ValueError:
+        return jsonify({"error": "Invalid {} header".format(DEADLINE_HEADER)}), 400
 
-        # Run hybrid inference
-        result = model.infer(features, meta=metadata)
+    try:
+        t0 = time.perf_counter()
+        if request.mimetype == "application/fhir+json":
+            # Raw AuditEvent: typed decode of only the fields features use
+            event = decode_audit_event(request.get_data(cache=False))
+            if not isinstance(event, dict) or event.get("resourceType") != "AuditEvent":
+                return jsonify({
+                    "error": "Expected a FHIR AuditEvent resource"
+                }), 400
+            t1 = time.perf_counter()
+            features, metadata = extract_features(event)
+            STAGE_SECONDS.observe(t1 - t0, ("decode",))
+            STAGE_SECONDS.observe(time.perf_counter() - t1, ("extract",))
+        else:
+            # Parse request
+            data = request.get_json()
+            t1 = time.perf_counter()
+            STAGE_SECONDS.observe(t1 - t0, ("decode",))
+            
+            if data and "features" not in data and data.get("resourceType") == "AuditEvent":
+                features, metadata = extract_features(data)
+                STAGE_SECONDS.observe(time.perf_counter() - t1, ("extract",))
+            elif not data or "features" not in data:
+                return jsonify({
+                    "error": "Missing 'features' in request body"
+                }), 400
+            else:
+                # Extract features
+                features = data["features"]
+                metadata = data.get("metadata", {})
 
-        # Persist alerts when anomalous
-        if result.get("anom"):
+        # Run hybrid inference (micro-batched with concurrent requests)
+        if batcher is not None:
             try:
-                os.makedirs("logs", exist_ok=True)
-                with open(os.path.join("logs", "alerts.log"), "a") as f:
-                    f.write("{time} - ALERT - pred={pred} score={score:.6f} meta={meta}\n".format(
-                        time=datetime.datetime.utcnow().isoformat(),
-                        pred=result.get("pred"),
-                        score=float(result.get("score", 0.0)),
-                        meta=str(result.get("meta", {}))
-                    ))
-            except Exception:
-                pass
+                result = batcher.infer(features, meta=metadata, deadline_ms=deadline_ms)
+            except BatchQueueFull as e:
+                return jsonify({"error": str(e)}), 503
+            except FutureTimeout:
+                return jsonify({"error": "Inference deadline exceeded"}), 504
+        else:
+            started = time.monotonic()
+            deadline = started + deadline_ms / 1000.0 if deadline_ms else None
+            result = model.infer(features, meta=metadata, deadline=deadline)
+            CONTROLLER.observe_latency(time.monotonic() - started)
+
+        # Persist alerts when anomalous
+        log_alerts([result])
 
         # Response must match required format
-        response = {
-            "pred": result.get("pred"),
-            "score": float(result.get("score")),
-            "sev": result.get("sev"),
-            "anom": bool(result.get("anom")),
-            "meta": result.get("meta"),
-            "all_results": result.get("all_results")
-        }
+        t0 = time.perf_counter()
+        response = jsonify(notify_payload(result))
+        STAGE_SECONDS.observe(time.perf_counter() - t0, ("serialize",))
 
-        return jsonify(response), 200
+        return response, 200
     
+    except DecodeError as e:
+        return jsonify({
+            "error": "Invalid JSON: {}".format(e)
+        }), 400
     except Exception as e:
         return jsonify({
             "error": str(e)
@@ -104,6 +257,9 @@ def fhir_batch():
     """
     Batch detection endpoint
     
+    Honours X-Deadline-Ms like /fhir/notify, for the batch as a whole.
+    At most FHIR_BATCH_MAX_SAMPLES samples per request (413 beyond).
+    
     Expected JSON format:
     {
         "samples": [
@@ -114,7 +270,14 @@ def fhir_batch():
     }
     """
     try:
+        deadline_ms = request_deadline_ms(request.headers)
+    except ValueError:
+        return jsonify({"error": "Invalid {} header".format(DEADLINE_HEADER)}), 400
+
+    try:
+        t0 = time.perf_counter()
         data = request.get_json()
+        STAGE_SECONDS.observe(time.perf_counter() - t0, ("decode",))
         
         if not data or "samples" not in data:
             return jsonify({
@@ -122,23 +285,323 @@ def fhir_batch():
             }), 400
         
         samples = data["samples"]
+        if config.FHIR_BATCH_MAX_SAMPLES and len(samples) > config.FHIR_BATCH_MAX_SAMPLES:
+            return jsonify({
+                "error": "Too many samples ({} > {}); split the request".format(
+                    len(samples), config.FHIR_BATCH_MAX_SAMPLES)
+            }), 413
         
-        # Extract all features
+        # Extract all features and run them through one batched inference
         features = [s["features"] for s in samples]
+        metas = [s.get("metadata", {}) for s in samples]
 
-        results = []
-        for sample in samples:
-            res = model.infer(sample.get("features"), meta=sample.get("metadata", {}))
-            results.append(res)
+        deadline = time.monotonic() + deadline_ms / 1000.0 if deadline_ms else None
+        results = model.infer_batch(features, metas=metas, deadline=deadline)
+        log_alerts(results)
+
+        t0 = time.perf_counter()
+        response = jsonify({"count": len(results), "results": results})
+        STAGE_SECONDS.observe(time.perf_counter() - t0, ("serialize",))
+
+        return response, 200
+    
+    except Exception as e:
+        return jsonify({
+            "error": str(e)
+        }), 500
 
-        return jsonify({"count": len(results), "results": results}), 200
+
+@app.route("/fhir/Bundle", methods=["POST"])
+def fhir_bundle():
+    """
+    Bulk detection for a FHIR Bundle (batch / transaction / searchset)
     
+    Every entry[].resource that is an AuditEvent is scored in one batched
+    inference. The body is parsed incrementally, so only the feature matrix
+    is kept in memory, not the resources.
+    
+    Response format:
+    {
+        "resourceType": "Bundle",
+        "type": "batch-response",
+        "total": <AuditEvents scored>,
+        "entry": [
+            {"fullUrl": "...", "response": {"status": "200 OK"}, "result": {...}},
+            {"fullUrl": "...", "response": {"status": "422 Unprocessable Entity",
+                                            "outcome": {OperationOutcome}}},
+            ...
+        ]
+    }
+    """
+    if not MODEL_READY:
+        return jsonify({"error": "Model not loaded"}), 500
+
+    try:
+        header = {}
+        urls = []       # fullUrl per entry, in bundle order
+        scored = []     # entry index -> row in X (None when skipped)
+        chunks, metas = [], []
+        pending = []
+
+        extract_time = [0.0]
+
+        def flush():
+            t = time.perf_counter()
+            X, chunk_metas = extract_batch(pending)
+            extract_time[0] += time.perf_counter() - t
+            chunks.append(X)
+            metas.extend(chunk_metas)
+            del pending[:]
+
+        t0 = time.perf_counter()
+
+        for entry in iter_bundle_entries(request.stream, header):
+            entry = entry if isinstance(entry, dict) else {}
+            resource = entry.get("resource")
+            urls.append(entry.get("fullUrl"))
+            if isinstance(resource, dict) and resource.get("resourceType") == "AuditEvent":
+                scored.append(len(metas) + len(pending))
+                pending.append(resource)
+                if len(pending) >= BUNDLE_CHUNK_SIZE:
+                    flush()
+            else:
+                scored.append(None)
+        if pending:
+            flush()
+        STAGE_SECONDS.observe(time.perf_counter() - t0 - extract_time[0], ("decode",))
+        STAGE_SECONDS.observe(extract_time[0], ("extract",))
+
+        if header.get("resourceType") != "Bundle":
+            return jsonify({
+                "error": "Expected a FHIR Bundle resource"
+            }), 400
+
+        results = []
+        if metas:
+            X = chunks[0] if len(chunks) == 1 else np.concatenate(chunks)
+            results = model.infer_batch(X, metas=metas)
+            log_alerts(results)
+
+        t0 = time.perf_counter()
+        entries = []
+        for url, row in zip(urls, scored):
+            if row is None:
+                entries.append({
+                    "fullUrl": url,
+                    "response": {
+                        "status": "422 Unprocessable Entity",
+                        "outcome": {
+                            "resourceType": "OperationOutcome",
+                            "issue": [{
+                                "severity": "warning",
+                                "code": "not-supported",
+                                "diagnostics": "Entry is not an AuditEvent; skipped"
+                            }]
+                        }
+                    }
+                })
+            else:
+                entries.append({
+                    "fullUrl": url,
+                    "response": {"status": "200 OK"},
+                    "result": results[row]
+                })
+
+        response = jsonify({
+            "resourceType": "Bundle",
+            "type": "batch-response",
+            "total": len(results),
+            "entry": entries
+        })
+        STAGE_SECONDS.observe(time.perf_counter() - t0, ("serialize",))
+
+        return response, 200
+
+    except DecodeError as e:
+        return jsonify({
+            "error": "Invalid JSON: {}".format(e)
+        }), 400
     except Exception as e:
         return jsonify({
             "error": str(e)
         }), 500
 
 
+@app.route("/fhir/stream", methods=["POST"])
+def fhir_stream():
+    """
+    Streaming detection for NDJSON AuditEvent exports
+    
+    The request body holds one AuditEvent per line. Lines are read
+    incrementally, scored in batches of STREAM_BATCH_SIZE and streamed back
+    as NDJSON in input order as each batch finishes:
+    
+        {"line": 0, "pred": "...", "score": ..., "sev": "...", "anom": ..., ...}
+        {"line": 1, "error": "Expected a FHIR AuditEvent resource"}
+    """
+    if not MODEL_READY:
+        return jsonify({"error": "Model not loaded"}), 500
+
+    stream = request.stream
+
+    def score(pending, buf):
+        events = [event for _, event in pending if isinstance(event, dict)]
+        results = []
+        if events:
+            try:
+                t0 = time.perf_counter()
+                X, metas = extract_batch(events, out=buf)
+                STAGE_SECONDS.observe(time.perf_counter() - t0, ("extract",))
+                results = model.infer_batch(X, metas=metas)
+                log_alerts(results)
+            except Exception as e:
+                results = [{"error": str(e)}] * len(events)
+
+        t0 = time.perf_counter()
+        results = iter(results)
+        lines = []
+        for line, event in pending:
+            out = {"line": line}
+            out.update(next(results) if isinstance(event, dict) else {"error": event})
+            lines.append(json.dumps(out) + "\n")
+        STAGE_SECONDS.observe(time.perf_counter() - t0, ("serialize",))
+        return lines
+
+    def generate():
+        buf = np.empty((config.STREAM_BATCH_SIZE, fhir_features.EXPECTED_FEATURES), dtype=np.float32)
+        pending = []    # (line number, AuditEvent dict or error message)
+        try:
+            for line, raw in enumerate(iter_ndjson(stream, config.STREAM_READ_BYTES)):
+                try:
+                    event = decode_audit_event(raw)
+                    if not isinstance(event, dict) or event.get("resourceType") != "AuditEvent":
+                        event = "Expected a FHIR AuditEvent resource"
+                except DecodeError as e:
+                    event = "Invalid JSON: {}".format(e)
+                pending.append((line, event))
+
+                if len(pending) >= config.STREAM_BATCH_SIZE:
+                    yield "".join(score(pending, buf))
+                    pending = []
+        except Exception as e:
+            # Body read failed mid-stream: score what arrived, then report
+            pending.append((None, "Stream aborted: {}".format(e)))
+
+        if pending:
+            yield "".join(score(pending, buf))
+
+    return Response(stream_with_context(generate()), mimetype="application/x-ndjson")
+
+
+@app.route("/metrics", methods=["GET"])
+def prometheus_metrics():
+    """
+    Prometheus scrape endpoint (text exposition format)
+    """
+    return Response(metrics.REGISTRY.render(), mimetype="text/plain; version=0.0.4")
+
+
+@app.route("/admin/profile", methods=["GET", "POST"])
+def admin_profile():
+    """
+    Sample live traffic and return collapsed stacks
+    
+    Query parameters:
+        seconds      profile duration (default 10, capped by PROFILE_MAX_SECONDS)
+        requests     stop early after this many requests completed (default 0 = off)
+        interval_ms  sampling period (default 5)
+        format       'collapsed' (flamegraph.pl / speedscope input, default) or 'json'
+    """
+    if not admin_authorized():
+        return jsonify({"error": "Forbidden"}), 403
+
+    try:
+        seconds = float(request.args.get("seconds", 10))
+        requests = int(request.args.get("requests", 0))
+        interval_ms = float(request.args.get("interval_ms", 5))
+    except ValueError:
+        return jsonify({"error": "Invalid profile parameters"}), 400
+
+    try:
+        result = profiler.profile(seconds=seconds, requests=requests, interval_ms=interval_ms)
+    except ProfilerBusy as e:
+        return jsonify({"error": str(e)}), 409
+
+    if request.args.get("format") == "json":
+        return jsonify({
+            "samples": result["samples"],
+            "idle_samples": result["idle_samples"],
+            "requests": result["requests"],
+            "duration_s": result["duration_s"],
+            "interval_ms": result["interval_ms"],
+            "top": top_functions(result["stacks"]),
+            "collapsed": collapsed(result["stacks"])
+        }), 200
+
+    filename = "profile-{}.folded".format(datetime.datetime.utcnow().strftime("%Y%m%dT%H%M%SZ"))
+    return Response(collapsed(result["stacks"]), mimetype="text/plain", headers={
+        "Content-Disposition": "attachment; filename={}".format(filename),
+        "X-Profile-Samples": str(result["samples"]),
+        "X-Profile-Requests": str(result["requests"]),
+    })
+
+
+@app.route("/admin/reload", methods=["POST"])
+def admin_reload():
+    """
+    Reload model artifacts from MODELS_DIR and swap them in
+    
+    In-flight requests finish on the previous model. The result cache and
+    the AE score quantiles belong to the model, so both start over. On
+    failure the running model is kept.
+    """
+    global model, MODEL_READY
+
+    if not admin_authorized():
+        return jsonify({"error": "Forbidden"}), 403
+
+    try:
+        new_model = HybridDeployedModel(config.MODELS_DIR)
+    except ModelLoadError as e:
+        return jsonify({"error": str(e)}), 500
+
+    old_model, model = model, new_model
+    if batcher is not None:
+        batcher.model = new_model
+    MODEL_READY = True
+    if old_model is not None and old_model.result_cache is not None:
+        old_model.result_cache.clear()
+    # Score quantiles and the adapted low threshold belong to the old model
+    AE_SCORES.reset()
+
+    return jsonify({
+        "status": "reloaded",
+        "version": new_model.version,
+        "previous_version": old_model.version if old_model is not None else None
+    }), 200
+
+
+@app.route("/batcher/stats", methods=["GET"])
+def batcher_stats():
+    """
+    Micro-batcher queue depth and realized batch sizes
+    """
+    if batcher is None:
+        return jsonify({"enabled": False}), 200
+
+    stats = batcher.stats()
+    stats["enabled"] = True
+    return jsonify(stats), 200
+
+
+@app.route("/alerts/stats", methods=["GET"])
+def alerts_stats():
+    """
+    Alert writer queue depth, written and dropped counts
+    """
+    return jsonify(alert_sink.stats()), 200
+
+
 @app.route("/model/info", methods=["GET"])
 def model_info():
     """
@@ -149,10 +612,25 @@ def model_info():
     
     return jsonify({
         "model": "RF + XGB + CNN AutoEncoder",
-        "classes": list(model.label_encoder.classes_),
+        "version": model.version,
+        "ae_backend": model.ae_backend,
+        "classes": list(model.classes_),
         "n_features": len(model.feature_mask),
-        "rf_estimators": getattr(model.rf, 'n_estimators', None),
-        "xgb_estimators": getattr(model.xgb, 'n_estimators', None)
+        "rf_estimators": model.n_estimators.get("rf"),
+        "xgb_estimators": model.n_estimators.get("xgb"),
+        "bundle": model.bundle.path if model.bundle is not None else None,
+        "compiled_forest": {
+            "rf": model.rf_compiled is not None,
+            "xgb": model.xgb_compiled is not None,
+            "max_batch": config.COMPILED_FOREST_MAX_BATCH
+        },
+        "classifier_pool": model.classifier_pool.stats() if model.classifier_pool is not None else None,
+        "cascade": {"first": model.cascade[0], "margin": model.cascade_margin} if model.cascade else None,
+        "predictor_threads": model.library_threads,
+        "thread_budget": model.thread_budget,
+        "ae_thresholds": AE_SCORES.stats(),
+        "result_cache": model.result_cache.stats() if model.result_cache is not None else None,
+        "load_control": CONTROLLER.stats()
     }), 200
 
 
@@ -164,9 +642,16 @@ if __name__ == "__main__":
     print("="*60)
     print("📍 Endpoints:")
     print("   - GET  /health         : Health check")
-    print("   - POST /fhir/notify    : Single detection")
+    print("   - POST /fhir/notify    : Single detection (AuditEvent or features)")
     print("   - POST /fhir/batch     : Batch detection")
+    print("   - POST /fhir/Bundle    : FHIR Bundle of AuditEvents")
+    print("   - POST /fhir/stream    : NDJSON AuditEvents, streamed NDJSON results")
     print("   - GET  /model/info     : Model information")
+    print("   - GET  /batcher/stats  : Micro-batcher statistics")
+    print("   - GET  /alerts/stats   : Alert writer statistics")
+    print("   - GET  /metrics        : Prometheus metrics")
+    print("   - GET  /admin/profile  : Sampling profiler (collapsed stacks)")
+    print("   - POST /admin/reload   : Reload model artifacts")
     print("="*60 + "\n")
     
     app.run(
@@ -0,0 +1,162 @@
+"""One CPU budget for every native thread pool the model loads.
+
+sklearn (n_jobs), xgboost (nthread), torch (intra-op threads), ONNX Runtime
+(session threads) and the BLAS under NumPy each size their pool from the
+core count on their own. With several serving workers on a 4-core Jetson
+that adds up to many runnable threads per core, and tail latency pays for
+every context switch.
+
+plan() splits CPU_BUDGET deterministically at model load:
+
+    per worker   CPU_BUDGET // SERVING_WORKERS, at least 1 (app.prefork sets
+                 SERVING_WORKERS before the model loads)
+    AE           torch, ONNX Runtime (intra-op; inter-op 1) and BLAS get the
+                 whole share: the AE stage runs before the classifiers,
+                 never beside them
+    classifiers  RF and XGB get half the share each when the classifier pool
+                 runs them side by side, the whole share otherwise
+
+A per-library setting above 0 (RF_N_JOBS, XGB_N_JOBS, ORT_INTRA_OP_THREADS,
+ORT_INTER_OP_THREADS, TORCH_THREADS, BLAS_THREADS) wins over the split.
+With THREAD_BUDGET=0 only those settings apply; the rest keep their
+library defaults.
+
+BLAS is limited through threadpoolctl when it is installed (it ships with
+scikit-learn); without it, set OPENBLAS_NUM_THREADS / OMP_NUM_THREADS in the
+environment before the server starts.
+"""
+
+import os
+import sys
+
+from app import config
+
+try:
+    from threadpoolctl import threadpool_info, threadpool_limits
+except ImportError:
+    threadpool_info = threadpool_limits = None
+
+# Last plan applied in this process (inherited by forked workers)
+_APPLIED = None
+
+
+def visible_cpus():
+    """CPUs this process may run on (affinity mask, cgroup-pinned containers)."""
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
+def plan(budget=None, workers=None, parallel=None):
+    """Thread count per library; None leaves the library default.
+
+    Args:
+        budget: total CPUs (default: CPU_BUDGET, 0 = visible_cpus())
+        workers: processes sharing the budget (default: SERVING_WORKERS)
+        parallel: RF and XGB run side by side (default: classifier pool on)
+
+    Returns:
+        dict with the budget, workers, per-worker share, one entry per
+        library (rf, xgb, torch, ort_intra, ort_inter, blas) and the names
+        set explicitly in "explicit"
+    """
+    budget = budget if budget is not None else config.CPU_BUDGET
+    budget = budget if budget > 0 else visible_cpus()
+    workers = max(1, int(workers if workers is not None else config.SERVING_WORKERS))
+    if parallel is None:
+        # Imported here: app.classifier_pool sizes itself with visible_cpus()
+        from app.classifier_pool import pool_enabled
+        parallel = pool_enabled()
+    share = max(1, budget // workers)
+
+    split = {
+        "rf": max(1, share // 2) if parallel else share,
+        "xgb": max(1, share // 2) if parallel else share,
+        "torch": share,
+        "ort_intra": share,
+        "ort_inter": 1,
+        "blas": share,
+    }
+    explicit = {
+        "rf": config.RF_N_JOBS,
+        "xgb": config.XGB_N_JOBS,
+        "torch": config.TORCH_THREADS,
+        "ort_intra": config.ORT_INTRA_OP_THREADS,
+        "ort_inter": config.ORT_INTER_OP_THREADS,
+        "blas": config.BLAS_THREADS,
+    }
+
+    result = {
+        "enabled": config.THREAD_BUDGET,
+        "budget": budget,
+        "workers": workers,
+        "per_worker": share,
+        "explicit": sorted(name for name, n in explicit.items() if n > 0),
+    }
+    for name in split:
+        if explicit[name] > 0:
+            result[name] = explicit[name]
+        else:
+            result[name] = split[name] if config.THREAD_BUDGET else None
+    return result
+
+
+def limit_blas(threads):
+    """Cap the BLAS pools loaded in this process.
+
+    Returns:
+        names of the BLAS libraries limited (empty without threadpoolctl)
+    """
+    if threads is None or threadpool_limits is None:
+        return []
+    try:
+        threadpool_limits(limits=threads, user_api="blas")
+        return sorted({info["internal_api"] for info in threadpool_info() if info["user_api"] == "blas"})
+    except Exception as e:
+        print("[Thread Budget] ⚠ Could not limit BLAS threads: {}".format(e))
+        return []
+
+
+def set_torch_threads(threads):
+    """Apply the torch share; call after torch is imported (torch AE backend)."""
+    if threads is None or "torch" not in sys.modules:
+        return False
+    import torch
+    torch.set_num_threads(threads)
+    try:
+        # Only allowed before torch runs its first parallel region
+        torch.set_num_interop_threads(1)
+    except RuntimeError:
+        pass
+    return True
+
+
+def apply():
+    """Compute the plan and set the process-wide pools (BLAS, torch if loaded).
+
+    sklearn, xgboost and ONNX Runtime take their counts from current() when
+    the estimators are loaded and the session is created.
+
+    Returns:
+        the plan, with "blas_libraries" limited
+    """
+    global _APPLIED
+    result = plan()
+    if threadpool_limits is None and result["blas"] is not None:
+        print("[Thread Budget] threadpoolctl not installed; BLAS keeps its default "
+              "(set OPENBLAS_NUM_THREADS before start)")
+    result["blas_libraries"] = limit_blas(result["blas"])
+    set_torch_threads(result["torch"])
+    _APPLIED = result
+    return result
+
+
+def current():
+    """The plan applied by the last apply(), else a freshly computed one."""
+    return _APPLIED if _APPLIED is not None else plan()
+
+
+if __name__ == "__main__":
+    import json
+    print(json.dumps(plan(), indent=2))
@@ -0,0 +1,7 @@
+"""Benchmark suite for the hybrid inference pipeline.
+
+    python -m tools.bench --out bench.json
+    python -m tools.bench --compare bench.json --threshold 0.10
+
+See tools/README.md.
+"""
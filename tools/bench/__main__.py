@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+"""Microbenchmark each inference stage and compare against a saved baseline.
+
+Usage:
+    python -m tools.bench                                   # synthetic artifacts
+    python -m tools.bench --models-dir models --out bench.json
+    python -m tools.bench --compare bench.json --threshold 0.10
+
+Exit codes: 0 success, 1 regression beyond --threshold, 2 setup failure.
+"""
+
+import argparse
+import datetime
+import json
+import os
+import shutil
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", ".."))
+
+from tools.bench.runner import STAGES, compare, environment, quiet, run_stages  # noqa: E402
+
+
+def _parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--models-dir", help="benchmark real artifacts instead of synthetic ones")
+    parser.add_argument("--artifacts-dir", help="build synthetic artifacts here and keep them")
+    parser.add_argument("--batch-sizes", default="1,8,64,512", help="comma-separated (default: 1,8,64,512)")
+    parser.add_argument("--stages", default=",".join(STAGES),
+                        help="comma-separated subset of: {}".format(", ".join(STAGES)))
+    parser.add_argument("--repeat", type=int, default=5, help="timed rounds per case (default: 5)")
+    parser.add_argument("--target-ms", type=float, default=200.0,
+                        help="approximate time spent per case (default: 200)")
+    parser.add_argument("--out", help="write results JSON here")
+    parser.add_argument("--compare", metavar="BASELINE", help="results JSON to compare against")
+    parser.add_argument("--threshold", type=float, default=0.10,
+                        help="slowdown ratio flagged as a regression (default: 0.10 = 10%%)")
+    return parser.parse_args(argv)
+
+
+def _print_comparison(rows, threshold):
+    print("\n{:<28} {:>12} {:>12} {:>8}  {}".format("case", "base us", "now us", "ratio", "status"))
+    for name, base, cur, ratio, status in rows:
+        print("{:<28} {:>12} {:>12} {:>8}  {}".format(
+            name,
+            "-" if base is None else "{:.1f}".format(base),
+            "-" if cur is None else "{:.1f}".format(cur),
+            "-" if ratio is None else "{:.2f}x".format(ratio),
+            status))
+    print("(regression threshold: +{:.0f}%)".format(threshold * 100))
+
+
+def main(argv=None):
+    args = _parse_args(argv)
+    batch_sizes = [int(b) for b in args.batch_sizes.split(",") if b.strip()]
+    stages = [s.strip() for s in args.stages.split(",") if s.strip()]
+    unknown = set(stages) - set(STAGES)
+    if unknown:
+        print("Unknown stages: {}".format(", ".join(sorted(unknown))))
+        return 2
+
+    tmp_dir = None
+    if args.models_dir:
+        models_dir = args.models_dir
+    else:
+        from app.fhir_features import EXPECTED_FEATURES
+        from tools.bench.artifacts import build_artifacts
+        models_dir = args.artifacts_dir or tempfile.mkdtemp(prefix="fhir-bench-")
+        tmp_dir = None if args.artifacts_dir else models_dir
+        print("Building synthetic artifacts in {} ...".format(models_dir))
+        with quiet():
+            written = build_artifacts(models_dir, n_raw=EXPECTED_FEATURES)
+        print("  {}".format(", ".join(written)))
+
+    try:
+        from app.edge_model import HybridDeployedModel, ModelLoadError
+        try:
+            with quiet():
+                model = HybridDeployedModel(models_dir)
+        except ModelLoadError as e:
+            print("Model loading failed: {}".format(e))
+            return 2
+        # Repeated inputs would otherwise be timed as result cache hits
+        model.result_cache = None
+
+        print("AE backend: {}   batch sizes: {}".format(model.ae_backend, batch_sizes))
+        results = run_stages(model, models_dir, batch_sizes, stages=stages,
+                             target_s=args.target_ms / 1000.0, repeat=args.repeat)
+    finally:
+        if tmp_dir is not None:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+
+    report = {
+        "created": datetime.datetime.utcnow().isoformat() + "Z",
+        "environment": environment(),
+        "models": "synthetic" if not args.models_dir else os.path.abspath(args.models_dir),
+        "batch_sizes": batch_sizes,
+        "results": results,
+    }
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+        print("\nResults written to {}".format(args.out))
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        rows, regressions = compare(baseline.get("results", {}), results, args.threshold)
+        _print_comparison(rows, args.threshold)
+        if regressions:
+            print("\n❌ {} regression(s): {}".format(len(regressions), ", ".join(regressions)))
+            return 1
+        print("\n✅ No regressions")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
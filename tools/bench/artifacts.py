@@ -0,0 +1,132 @@
+"""Synthetic model artifacts for benchmarking (same layout as models/).
+
+Mirrors tools/generate_models.py, but at production shape: 46 raw features,
+a 25-feature mask, 7 classes, RF/XGB of the deployed size and an AE with
+the CNNAutoEncoder architecture. AE weights are written as ae.npz (NumPy
+only); ae.pth and ae.onnx are added when torch (and onnx) are installed so
+every AE backend has an artifact to load.
+"""
+
+import os
+import pickle
+import warnings
+from collections import OrderedDict
+
+import numpy as np
+
+CLASSES = ("BruteForce", "DDoS", "DoS", "Mirai", "Recon", "Spoofing", "Web")
+
+# Linear layer indices and widths of app.ae_runtime.CNNAutoEncoder(25, 8);
+# each hidden Linear is followed by ReLU and BatchNorm1d
+AE_ENCODER = ((0, 64), (3, 32), (6, 16), (9, 8))
+AE_DECODER = ((0, 16), (3, 32), (6, 64), (9, None))
+
+
+def synthetic_data(n_samples, n_raw=46, seed=0):
+    """Feature matrix shaped like extracted AuditEvent features plus labels."""
+    rng = np.random.default_rng(seed)
+    X = rng.normal(size=(n_samples, n_raw)) * 50.0 + 10.0
+    y = rng.integers(0, len(CLASSES), n_samples)
+    return X.astype(np.float32), y
+
+
+def ae_state_dict(input_dim=25, seed=0):
+    """Random eval-mode CNNAutoEncoder state_dict as float32 arrays."""
+    rng = np.random.default_rng(seed)
+    state = OrderedDict()
+    for prefix, layers in (("encoder", AE_ENCODER), ("decoder", AE_DECODER)):
+        fan_in = input_dim if prefix == "encoder" else AE_ENCODER[-1][1]
+        for idx, width in layers:
+            width = input_dim if width is None else width
+            state["{}.{}.weight".format(prefix, idx)] = (
+                rng.normal(size=(width, fan_in)) / np.sqrt(fan_in)).astype(np.float32)
+            state["{}.{}.bias".format(prefix, idx)] = (rng.normal(size=width) * 0.01).astype(np.float32)
+            if idx != 9:
+                bn = "{}.{}".format(prefix, idx + 2)
+                state[bn + ".weight"] = rng.uniform(0.5, 1.5, width).astype(np.float32)
+                state[bn + ".bias"] = (rng.normal(size=width) * 0.1).astype(np.float32)
+                state[bn + ".running_mean"] = rng.uniform(0.0, 1.0, width).astype(np.float32)
+                state[bn + ".running_var"] = rng.uniform(0.5, 2.0, width).astype(np.float32)
+                state[bn + ".num_batches_tracked"] = np.array(100, dtype=np.int64)
+            fan_in = width
+    return state
+
+
+def _save_torch_ae(state, out_dir, input_dim):
+    try:
+        import torch
+        from app.ae_runtime import CNNAutoEncoder, LATENT_DIM
+    except ImportError:
+        return []
+    model = CNNAutoEncoder(input_dim, LATENT_DIM)
+    model.load_state_dict(OrderedDict((k, torch.from_numpy(np.array(v))) for k, v in state.items()))
+    model.eval()
+    torch.save(model.state_dict(), os.path.join(out_dir, "ae.pth"))
+    written = ["ae.pth"]
+
+    try:
+        import onnx  # noqa: F401  (torch.onnx.export needs it)
+        kwargs = dict(input_names=["input"], output_names=["output"],
+                      dynamic_axes={"input": {0: "batch"}, "output": {0: "batch"}})
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore")
+            try:
+                # torch >= 2.5 defaults to the dynamo exporter; keep the TorchScript one
+                torch.onnx.export(model, torch.zeros(1, input_dim), os.path.join(out_dir, "ae.onnx"),
+                                  dynamo=False, **kwargs)
+            except TypeError:
+                torch.onnx.export(model, torch.zeros(1, input_dim), os.path.join(out_dir, "ae.onnx"),
+                                  **kwargs)
+        written.append("ae.onnx")
+    except Exception as e:
+        print("[bench] ae.onnx not exported: {}".format(e))
+    return written
+
+
+def build_artifacts(out_dir, n_raw=46, n_selected=25, rf_trees=50, rf_depth=7,
+                    xgb_rounds=50, xgb_depth=5, n_train=4000, seed=0):
+    """Train and write synthetic artifacts into `out_dir`.
+
+    Returns:
+        list of the artifact filenames written
+    """
+    import joblib
+    from sklearn.ensemble import RandomForestClassifier
+    from sklearn.preprocessing import LabelEncoder, StandardScaler
+
+    os.makedirs(out_dir, exist_ok=True)
+    rng = np.random.default_rng(seed)
+    X, y = synthetic_data(n_train, n_raw, seed)
+
+    scaler = StandardScaler().fit(X)
+    mask = np.sort(rng.choice(n_raw, n_selected, replace=False)).astype(np.int64)
+    X_sel = scaler.transform(X)[:, mask]
+
+    le = LabelEncoder().fit(np.array(CLASSES))
+    rf = RandomForestClassifier(n_estimators=rf_trees, max_depth=rf_depth, random_state=seed, n_jobs=1)
+    rf.fit(X_sel, y)
+
+    try:
+        import xgboost as xgb
+        booster = xgb.XGBClassifier(n_estimators=xgb_rounds, max_depth=xgb_depth,
+                                    random_state=seed, n_jobs=1)
+    except ImportError:
+        # Same predict_proba interface; benchmarked through the native path
+        from sklearn.ensemble import HistGradientBoostingClassifier
+        booster = HistGradientBoostingClassifier(max_iter=xgb_rounds, max_depth=xgb_depth,
+                                                 random_state=seed)
+    booster.fit(X_sel, y)
+
+    joblib.dump(scaler, os.path.join(out_dir, "scaler.pkl"))
+    np.save(os.path.join(out_dir, "feature_mask.npy"), mask)
+    with open(os.path.join(out_dir, "label_encoder.pkl"), "wb") as f:
+        pickle.dump(le, f)
+    joblib.dump(rf, os.path.join(out_dir, "rf_model.pkl"))
+    joblib.dump(booster, os.path.join(out_dir, "xgb_model.pkl"))
+    written = ["scaler.pkl", "feature_mask.npy", "label_encoder.pkl", "rf_model.pkl", "xgb_model.pkl"]
+
+    state = ae_state_dict(n_selected, seed)
+    np.savez(os.path.join(out_dir, "ae.npz"), **state)
+    written.append("ae.npz")
+    written += _save_torch_ae(state, out_dir, n_selected)
+    return written
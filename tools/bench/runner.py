@@ -0,0 +1,233 @@
+"""Timing, stage registry and baseline comparison for tools/bench."""
+
+import contextlib
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+
+import numpy as np
+
+REPO_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", ".."))
+
+STAGES = ("extract", "preprocess", "ae", "quantiles", "rf", "xgb", "classify", "infer")
+
+
+def measure(fn, target_s=0.2, repeat=5):
+    """Time `fn()`, auto-scaling the inner loop so each round takes ~target_s/repeat.
+
+    Returns:
+        dict of per-call statistics in microseconds
+    """
+    fn()  # warmup (lazy init, caches)
+    round_s = max(target_s / max(repeat, 1), 1e-3)
+    number = 1
+    while True:
+        start = time.perf_counter()
+        for _ in range(number):
+            fn()
+        elapsed = time.perf_counter() - start
+        if elapsed >= round_s * 0.2 or number >= 1000000:
+            break
+        number *= 10
+    number = max(1, int(number * round_s / max(elapsed, 1e-9)))
+
+    per_call = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for _ in range(number):
+            fn()
+        per_call.append((time.perf_counter() - start) / number * 1e6)
+    return {
+        "median_us": statistics.median(per_call),
+        "min_us": min(per_call),
+        "max_us": max(per_call),
+        "number": number,
+        "repeat": repeat,
+    }
+
+
+def synthetic_events(n, seed=0):
+    """AuditEvent dicts with varying users, IPs, actions and outcomes."""
+    rng = np.random.default_rng(seed)
+    actions = ("C", "R", "U", "D", "E")
+    events = []
+    for i in range(n):
+        events.append({
+            "resourceType": "AuditEvent",
+            "action": actions[i % len(actions)],
+            "outcome": "0" if rng.random() < 0.9 else "4",
+            "outcomeDesc": "failed login" if i % 17 == 0 else "",
+            "event": {"type": {"code": "rest"}, "subtype": [{"code": "read"}]},
+            "agent": [{
+                "userId": "user_{}".format(int(rng.integers(0, 200))),
+                "network": {"address": "10.0.{}.{}".format(int(rng.integers(0, 4)), int(rng.integers(1, 255)))},
+            }],
+        })
+    return events
+
+
+def environment():
+    """Interpreter, library and commit information stored with each run."""
+    info = {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "machine": platform.machine(),
+        "cpu_count": os.cpu_count(),
+        "numpy": np.__version__,
+    }
+    for name in ("sklearn", "xgboost", "torch", "onnxruntime"):
+        module = sys.modules.get(name)
+        if module is not None:
+            info[name] = getattr(module, "__version__", "?")
+    try:
+        info["commit"] = subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=REPO_ROOT,
+            stderr=subprocess.DEVNULL).decode().strip()
+    except Exception:
+        info["commit"] = None
+    return info
+
+
+@contextlib.contextmanager
+def quiet():
+    """Silence the model's per-batch print() while timing."""
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        yield
+
+
+def run_stages(model, models_dir, batch_sizes, stages=STAGES, target_s=0.2, repeat=5, log=print):
+    """Benchmark every requested stage at every batch size.
+
+    Returns:
+        dict name -> measurement, with names like "ae/numpy/64"
+    """
+    from app import config
+    from app.ae_backends import available_backends, create_ae_runtime
+    from app.fhir_features import extract_batch, extract_features
+
+    results = {}
+    max_batch = max(batch_sizes)
+    events = synthetic_events(max(max_batch, 1024))
+    X_raw, _ = extract_batch(events)
+    X_sel = model.preprocess(X_raw)
+
+    def record(name, fn, batch):
+        with quiet():
+            m = measure(fn, target_s=target_s, repeat=repeat)
+        m["batch"] = batch
+        m["per_sample_us"] = m["median_us"] / batch
+        results[name] = m
+        log("  {:<28} {:>12.1f} us   {:>9.2f} us/sample".format(name, m["median_us"], m["per_sample_us"]))
+
+    if "extract" in stages:
+        event = events[0]
+        record("extract/single/1", lambda: extract_features(event), 1)
+        for b in batch_sizes:
+            batch = events[:b]
+            record("extract/batch/{}".format(b), lambda batch=batch: extract_batch(batch), b)
+
+    if "preprocess" in stages:
+        for b in batch_sizes:
+            X = X_raw[:b]
+            record("preprocess/{}".format(b), lambda X=X: model.preprocess(X), b)
+
+    if "ae" in stages:
+        for name in available_backends():
+            if name == "tensorrt" and not config.USE_TENSORRT:
+                continue
+            try:
+                with quiet():
+                    _, runtime = create_ae_runtime(models_dir, backend=name,
+                                                   use_tensorrt=config.USE_TENSORRT)
+            except Exception as e:
+                log("  ae/{:<25} skipped ({})".format(name, e))
+                continue
+            for b in batch_sizes:
+                X = X_sel[:b]
+                record("ae/{}/{}".format(name, b), lambda X=X, r=runtime: r.score_batch(X), b)
+
+    if "quantiles" in stages:
+        # AE score tracking added to every inference call (app/quantiles.py);
+        # a private instance so the live thresholds are not touched
+        from app.quantiles import AE_SCORES, ScoreQuantiles
+        sketch = ScoreQuantiles(AE_SCORES.configured, window=AE_SCORES.window,
+                                sample_rows=AE_SCORES.sample_rows)
+        scores = np.asarray(model.ae.score_batch(X_sel[:max_batch]), dtype=np.float64)
+        for b in batch_sizes:
+            s = scores[:b]
+            record("quantiles/observe/{}".format(b), lambda s=s: sketch.observe(s), b)
+
+    for stage, estimator, compiled in (("rf", model.rf_model, model.rf_compiled),
+                                       ("xgb", model.xgb_model, model.xgb_compiled)):
+        if stage not in stages:
+            continue
+        for b in batch_sizes:
+            X = X_sel[:b]
+            if estimator is not None:
+                record("{}/native/{}".format(stage, b), lambda X=X, e=estimator: e.predict_proba(X), b)
+            if compiled is not None:
+                record("{}/compiled/{}".format(stage, b), lambda X=X, c=compiled: c.predict_proba(X), b)
+
+    if "classify" in stages:
+        # RF + XGB one after the other vs side by side on the classifier pool
+        from app.classifier_pool import ClassifierPool
+        configured = model.classifier_pool
+        pool = configured or ClassifierPool()
+        try:
+            for b in batch_sizes:
+                X = X_sel[:b]
+                model.classifier_pool = None
+                record("classify/sequential/{}".format(b), lambda X=X: model._classify(X), b)
+                model.classifier_pool = pool
+                record("classify/parallel/{}".format(b), lambda X=X: model._classify(X), b)
+                seq = results["classify/sequential/{}".format(b)]["median_us"]
+                par = results["classify/parallel/{}".format(b)]["median_us"]
+                results["classify/parallel/{}".format(b)]["saved_us"] = seq - par
+                log("  {:<28} {:>12.1f} us   {:>9.0%} of sequential".format(
+                    "  saved", seq - par, (seq - par) / seq if seq else 0.0))
+        finally:
+            model.classifier_pool = configured
+            if configured is None:
+                pool.close()
+
+    if "infer" in stages:
+        x0 = X_raw[0]
+        # Pinned to the full pipeline: load control must not skew the numbers
+        record("infer/single/1", lambda: model.infer(x0, mode="full"), 1)
+        for b in batch_sizes:
+            X = X_raw[:b]
+            record("infer/batch/{}".format(b), lambda X=X: model.infer_batch(X, mode="full"), b)
+
+    return results
+
+
+def compare(baseline, current, threshold=0.10):
+    """Compare two result dicts by median time.
+
+    Returns:
+        (rows, regressions) where rows are (name, base_us, cur_us, ratio, status)
+    """
+    rows = []
+    regressions = []
+    for name in sorted(set(baseline) | set(current)):
+        base = baseline.get(name)
+        cur = current.get(name)
+        if base is None:
+            rows.append((name, None, cur["median_us"], None, "new"))
+            continue
+        if cur is None:
+            rows.append((name, base["median_us"], None, None, "missing"))
+            continue
+        ratio = cur["median_us"] / base["median_us"] if base["median_us"] else float("inf")
+        if ratio > 1.0 + threshold:
+            status = "REGRESSION"
+            regressions.append(name)
+        elif ratio < 1.0 / (1.0 + threshold):
+            status = "improved"
+        else:
+            status = "ok"
+        rows.append((name, base["median_us"], cur["median_us"], ratio, status))
+    return rows, regressions
@@ -0,0 +1,272 @@
+#!/usr/bin/env python3
+"""Calibrate the RF/XGB confidence cascade (CASCADE_FIRST, CASCADE_MARGIN).
+
+Scores a labeled dataset with both classifiers and sweeps the margin gate:
+a row is decided by the first classifier alone when its top-1 minus top-2
+probability reaches the margin, otherwise by the 50/50 ensemble. For every
+margin it reports how many rows skip the second classifier, how often the
+decision differs from the full ensemble, accuracy against the labels, and
+the estimated classifier cost relative to always running both.
+
+Only rows that pass the AE gate reach the classifiers in production, so by
+default only those rows are used (--no-gate uses every row).
+
+Datasets:
+    .npz     arrays X (raw features, n x n_raw) and y (class names or indices)
+    .csv     header row; --label-column holds the class, the other columns
+             are the raw features in order
+    .ndjson  one AuditEvent per line with the class in --label-field
+
+Usage:
+    python3 tools/calibrate_cascade.py --models-dir models --data labeled.npz
+    python3 tools/calibrate_cascade.py --models-dir models --data audit.ndjson --max-change 0.002
+    python3 tools/calibrate_cascade.py --synthetic 5000          # synthetic models and data
+
+Exit codes: 0 success, 2 models or data could not be loaded.
+"""
+
+import argparse
+import csv
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+DEFAULT_MARGINS = [round(0.05 * i, 2) for i in range(1, 20)] + [0.98, 0.99]
+
+
+def load_dataset(path, label_column="label", label_field="label"):
+    """Raw feature matrix and labels from .npz, .csv or .ndjson.
+
+    Returns:
+        (X float32 (n, n_raw), labels list)
+    """
+    ext = os.path.splitext(path)[1].lower()
+    if ext == ".npz":
+        data = np.load(path, allow_pickle=False)
+        X = data["X"] if "X" in data else data["features"]
+        y = data["y"] if "y" in data else data["labels"]
+        return np.asarray(X, dtype=np.float32), list(y.tolist())
+    if ext == ".csv":
+        with open(path, newline="") as f:
+            reader = csv.reader(f)
+            header = next(reader)
+            if label_column not in header:
+                raise ValueError("no '{}' column in {}".format(label_column, path))
+            li = header.index(label_column)
+            rows, labels = [], []
+            for row in reader:
+                if not row:
+                    continue
+                labels.append(row[li])
+                rows.append([float(v) for i, v in enumerate(row) if i != li])
+        return np.asarray(rows, dtype=np.float32), labels
+    if ext in (".ndjson", ".jsonl"):
+        from app.fhir_features import extract_batch
+        events, labels = [], []
+        with open(path) as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                event = json.loads(line)
+                labels.append(event.pop(label_field, None))
+                events.append(event)
+        X, _ = extract_batch(events)
+        return np.asarray(X, dtype=np.float32), labels
+    raise ValueError("unsupported dataset type {!r} (use .npz, .csv or .ndjson)".format(ext))
+
+
+def label_indices(labels, classes):
+    """Class index per label (-1 when the label is not a model class)."""
+    lookup = {str(c): i for i, c in enumerate(classes)}
+    out = np.full(len(labels), -1, dtype=np.int64)
+    for i, label in enumerate(labels):
+        if isinstance(label, (int, np.integer)) and 0 <= int(label) < len(classes):
+            out[i] = int(label)
+        elif label is not None:
+            out[i] = lookup.get(str(label), -1)
+    return out
+
+
+def per_row_cost(fn, X, batch_size):
+    """Seconds per row of `fn` applied in chunks of `batch_size` rows."""
+    fn(X[:batch_size])  # warmup
+    t0 = time.perf_counter()
+    for start in range(0, X.shape[0], batch_size):
+        fn(X[start:start + batch_size])
+    return (time.perf_counter() - t0) / max(1, X.shape[0])
+
+
+def sweep(first_probs, full_pred, margins, y=None, cost_first=1.0, cost_second=1.0):
+    """Skip rate, decision changes and accuracy of the cascade at each margin."""
+    from app.edge_model import top_margin
+
+    margin = top_margin(first_probs)
+    first_pred = np.argmax(first_probs, axis=1)
+    labeled = None if y is None else (y >= 0)
+    rows = []
+    for m in margins:
+        decided = margin >= m
+        pred = np.where(decided, first_pred, full_pred)
+        skip = float(decided.mean())
+        row = {
+            "margin": m,
+            "skip_rate": skip,
+            "changed_rate": float((pred != full_pred).mean()),
+            "cost_ratio": (cost_first + (1.0 - skip) * cost_second) / (cost_first + cost_second),
+        }
+        if labeled is not None and labeled.any():
+            row["accuracy"] = float((pred[labeled] == y[labeled]).mean())
+        rows.append(row)
+    return rows
+
+
+def recommend(rows, max_change):
+    """Highest skip rate whose decision change rate stays within `max_change`."""
+    ok = [r for r in rows if r["changed_rate"] <= max_change and r["skip_rate"] > 0]
+    return max(ok, key=lambda r: (r["skip_rate"], -r["changed_rate"])) if ok else None
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--models-dir", help="artifacts to calibrate (default: synthetic)")
+    parser.add_argument("--data", help="labeled dataset (.npz, .csv, .ndjson)")
+    parser.add_argument("--synthetic", type=int, metavar="N", help="use N synthetic rows instead of --data")
+    parser.add_argument("--label-column", default="label", help="CSV label column (default: label)")
+    parser.add_argument("--label-field", default="label", help="NDJSON label field (default: label)")
+    parser.add_argument("--first", choices=("rf", "xgb", "both"), default="both")
+    parser.add_argument("--margins", help="comma-separated margins (default: 0.05 .. 0.99)")
+    parser.add_argument("--max-change", type=float, default=0.005,
+                        help="largest tolerated decision change rate (default: 0.005 = 0.5%%)")
+    parser.add_argument("--no-gate", action="store_true", help="use every row, not only AE-gated ones")
+    parser.add_argument("--low-threshold", type=float, help="AE gate (default: AE_THRESHOLD_LOW)")
+    parser.add_argument("--batch-size", type=int, default=64, help="batch size for cost timing (default: 64)")
+    parser.add_argument("--json", metavar="FILE", help="write the sweep as JSON")
+    args = parser.parse_args(argv)
+
+    if not args.data and not args.synthetic:
+        parser.error("one of --data or --synthetic is required")
+    margins = DEFAULT_MARGINS if not args.margins else [float(m) for m in args.margins.split(",") if m.strip()]
+
+    from tools.bench.runner import quiet
+
+    tmp_dir = None
+    models_dir = args.models_dir
+    try:
+        if models_dir is None:
+            from app.fhir_features import EXPECTED_FEATURES
+            from tools.bench.artifacts import build_artifacts
+            models_dir = tmp_dir = tempfile.mkdtemp(prefix="fhir-cascade-")
+            print("Building synthetic models ...")
+            with quiet():
+                build_artifacts(models_dir, n_raw=EXPECTED_FEATURES)
+
+        from app.edge_model import HybridDeployedModel, ModelLoadError
+        try:
+            with quiet():
+                model = HybridDeployedModel(models_dir)
+        except ModelLoadError as e:
+            print("Model loading failed: {}".format(e))
+            return 2
+
+        if args.data:
+            try:
+                X_raw, labels = load_dataset(args.data, args.label_column, args.label_field)
+            except (OSError, ValueError, KeyError) as e:
+                print("Could not load {}: {}".format(args.data, e))
+                return 2
+        else:
+            from app.fhir_features import EXPECTED_FEATURES
+            from tools.bench.artifacts import synthetic_data
+            X_raw, y_idx = synthetic_data(args.synthetic, n_raw=model.preprocess_plan.n_raw
+                                          if model.preprocess_plan is not None else EXPECTED_FEATURES)
+            labels = [model.classes_[i % len(model.classes_)] for i in y_idx]
+
+        try:
+            X_sel = np.ascontiguousarray(model.preprocess(X_raw), dtype=np.float32)
+        except ValueError as e:
+            print("Dataset does not match the model: {}".format(e))
+            return 2
+        y = label_indices(labels, model.classes_)
+
+        if not args.no_gate:
+            if args.low_threshold is None:
+                from app import config
+                args.low_threshold = config.AE_THRESHOLD_LOW
+            ae_scores = np.asarray(model.ae.score_batch(X_sel), dtype=np.float64).reshape(-1)
+            keep = ae_scores >= args.low_threshold
+            print("{} rows, {} pass the AE gate (low threshold {})".format(
+                X_sel.shape[0], int(keep.sum()), args.low_threshold))
+            X_sel, y = X_sel[keep], y[keep]
+        if X_sel.shape[0] == 0:
+            print("No rows reach the classifiers; nothing to calibrate (try --no-gate)")
+            return 2
+
+        predict = {
+            "rf": lambda X: model._predict_proba(model.rf_model, model.rf_compiled, X),
+            "xgb": lambda X: model._predict_proba(model.xgb_model, model.xgb_compiled, X),
+        }
+        probs = {name: fn(X_sel) for name, fn in predict.items()}
+        cost = {name: per_row_cost(fn, X_sel, args.batch_size) for name, fn in predict.items()}
+        full_pred = np.argmax((probs["rf"] + probs["xgb"]) * 0.5, axis=1)
+        labeled = y >= 0
+    finally:
+        if tmp_dir is not None:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+
+    print("Classifier cost per row (batch {}): RF {:.1f} us, XGB {:.1f} us".format(
+        args.batch_size, cost["rf"] * 1e6, cost["xgb"] * 1e6))
+    if labeled.any():
+        print("Full ensemble accuracy: {:.2%} on {} labeled rows".format(
+            float((full_pred[labeled] == y[labeled]).mean()), int(labeled.sum())))
+    else:
+        print("No labels match the model classes; accuracy is not reported")
+
+    report = {"rows": int(X_sel.shape[0]), "cost_us_per_row": {k: v * 1e6 for k, v in cost.items()},
+              "max_change": args.max_change, "sweeps": {}}
+    firsts = ("rf", "xgb") if args.first == "both" else (args.first,)
+    best = []
+    for first in firsts:
+        second = "xgb" if first == "rf" else "rf"
+        rows = sweep(probs[first], full_pred, margins, y if labeled.any() else None,
+                     cost_first=cost[first], cost_second=cost[second])
+        report["sweeps"][first] = rows
+
+        print("\n{} first, {} when unsure".format(first.upper(), second.upper()))
+        print("  {:>6} {:>8} {:>9} {:>9} {:>9}".format("margin", "skip", "changed", "accuracy", "cost"))
+        for r in rows:
+            print("  {:>6.2f} {:>8.1%} {:>9.2%} {:>9} {:>8.0%}".format(
+                r["margin"], r["skip_rate"], r["changed_rate"],
+                "{:.2%}".format(r["accuracy"]) if "accuracy" in r else "-", r["cost_ratio"]))
+        pick = recommend(rows, args.max_change)
+        if pick is not None:
+            best.append((pick["cost_ratio"], first, pick))
+
+    if best:
+        cost_ratio, first, pick = min(best, key=lambda b: b[0])
+        print("\nRecommended (decision change <= {:.2%}): CASCADE_FIRST={} CASCADE_MARGIN={}".format(
+            args.max_change, first, pick["margin"]))
+        print("  skips {:.1%} of second-classifier calls, {:.0%} of the classifier cost".format(
+            pick["skip_rate"], cost_ratio))
+        report["recommended"] = {"first": first, "margin": pick["margin"]}
+    else:
+        print("\nNo margin keeps the decision change rate within {:.2%}; leave CASCADE_MARGIN=0".format(
+            args.max_change))
+        report["recommended"] = None
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2)
+        print("\nResults written to {}".format(args.json))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
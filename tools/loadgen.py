@@ -0,0 +1,505 @@
+#!/usr/bin/env python3
+"""Open-loop HTTP load generator for the FHIR detection service.
+
+Requests are scheduled at fixed (or Poisson) intervals from the start of the
+run, independent of how fast the server answers. Latency is measured from
+each request's *scheduled* send time, so a stalled server is charged for
+every request it delayed (no coordinated omission); the uncorrected
+service time from the actual send is reported alongside.
+
+Usage:
+    # In-process Flask server with synthetic models, no external services
+    python3 tools/loadgen.py --local --rate 200 --duration 30
+
+    # Remote node, 80% single events / 20% bundles of 50
+    python3 tools/loadgen.py --url http://jetson:5001 --rate 500 \\
+        --mix notify=0.8,bundle=0.2 --events-per-request 50
+
+    # Replay recorded AuditEvents (JSON array, Bundle, NDJSON or one event)
+    python3 tools/loadgen.py --url http://localhost:5001 --events audit.ndjson
+"""
+
+import argparse
+import contextlib
+import http.client
+import json
+import math
+import os
+import queue
+import random
+import shutil
+import sys
+import tempfile
+import threading
+import time
+from urllib.parse import urlsplit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+ENDPOINTS = ("notify", "batch", "bundle", "stream")
+PERCENTILES = (50.0, 90.0, 99.0, 99.9)
+
+
+# ======================== HISTOGRAM ========================
+
+class LatencyHistogram:
+    """HDR-style log-linear histogram of integer microseconds.
+
+    Values below 2**sub_bits are exact; above, every power of two is split
+    into 2**(sub_bits-1) linear sub-buckets, bounding the relative error at
+    1 / 2**(sub_bits-1) (<1% for the default 8 bits) with a few KB of state.
+    """
+
+    def __init__(self, sub_bits=8):
+        self.sub_bits = sub_bits
+        self._exact = 1 << sub_bits
+        self._half = 1 << (sub_bits - 1)
+        self.counts = {}
+        self.total = 0
+        self.min = None
+        self.max = 0
+        self.sum = 0
+
+    def _index(self, v):
+        if v < self._exact:
+            return v
+        shift = v.bit_length() - self.sub_bits
+        return self._exact + (shift - 1) * self._half + ((v >> shift) - self._half)
+
+    def _upper(self, idx):
+        # Highest value that maps to bucket idx (reported for percentiles)
+        if idx < self._exact:
+            return idx
+        shift, sub = divmod(idx - self._exact, self._half)
+        shift += 1
+        return (((sub + self._half) + 1) << shift) - 1
+
+    def record(self, us):
+        v = max(0, int(us))
+        idx = self._index(v)
+        self.counts[idx] = self.counts.get(idx, 0) + 1
+        self.total += 1
+        self.sum += v
+        self.max = max(self.max, v)
+        self.min = v if self.min is None else min(self.min, v)
+
+    def merge(self, other):
+        for idx, c in other.counts.items():
+            self.counts[idx] = self.counts.get(idx, 0) + c
+        self.total += other.total
+        self.sum += other.sum
+        self.max = max(self.max, other.max)
+        if other.min is not None:
+            self.min = other.min if self.min is None else min(self.min, other.min)
+
+    def percentile(self, p):
+        if not self.total:
+            return None
+        rank = max(1, int(math.ceil(p / 100.0 * self.total)))
+        seen = 0
+        for idx in sorted(self.counts):
+            seen += self.counts[idx]
+            if seen >= rank:
+                return min(self._upper(idx), self.max)
+        return self.max
+
+    def summary(self):
+        out = {"count": self.total}
+        if self.total:
+            out["min_ms"] = self.min / 1000.0
+            out["mean_ms"] = self.sum / self.total / 1000.0
+            out["max_ms"] = self.max / 1000.0
+            for p in PERCENTILES:
+                out["p{:g}_ms".format(p)] = self.percentile(p) / 1000.0
+        return out
+
+
+# ======================== WORKLOAD ========================
+
+def synthetic_events(n, seed=0):
+    """AuditEvents shaped like sample_audit.json with varied users, IPs and outcomes."""
+    rng = random.Random(seed)
+    codes = ("110112", "110113", "110114", "110110", "110100")
+    actions = ("C", "R", "U", "D", "E")
+    events = []
+    for i in range(n):
+        outcome = "0" if rng.random() < 0.85 else rng.choice(("4", "8", "12"))
+        action = rng.choice(actions)
+        events.append({
+            "resourceType": "AuditEvent",
+            "event": {"type": {"code": rng.choice(codes)}, "action": action, "outcome": outcome},
+            "action": action,
+            "outcome": outcome,
+            "agent": [{
+                "userId": "{}_{}".format(rng.choice(("doctor", "nurse", "admin", "svc")), rng.randint(1, 300)),
+                "network": {"address": "192.168.{}.{}".format(rng.randint(0, 7), rng.randint(1, 254))},
+            }],
+        })
+    return events
+
+
+def load_events(path):
+    """Read AuditEvents from a JSON array, a Bundle, NDJSON or a single resource."""
+    with open(path) as f:
+        text = f.read()
+    try:
+        doc = json.loads(text)
+    except ValueError:
+        return [json.loads(line) for line in text.splitlines() if line.strip()]
+    if isinstance(doc, list):
+        return doc
+    if doc.get("resourceType") == "Bundle":
+        return [e["resource"] for e in doc.get("entry", []) if isinstance(e.get("resource"), dict)]
+    return [doc]
+
+
+def _features(events, n_features):
+    """Feature vectors for /fhir/batch (app.fhir_features when importable)."""
+    try:
+        from app.fhir_features import extract_features
+        return [extract_features(e)[0].tolist() for e in events]
+    except Exception:
+        rng = random.Random(1)
+        return [[rng.uniform(0, 10000) for _ in range(n_features)] for _ in events]
+
+
+class Workload:
+    """Pre-encoded request bodies per endpoint, cycled through during the run."""
+
+    def __init__(self, events, per_request, n_features=46, variants=64):
+        self.per_request = per_request
+        self.bodies = {"notify": [], "batch": [], "bundle": [], "stream": []}
+        features = _features(events[:max(per_request * variants, 1)], n_features)
+        for v in range(variants):
+            start = (v * per_request) % len(events)
+            chunk = [events[(start + j) % len(events)] for j in range(per_request)]
+            feats = [features[(start + j) % len(features)] for j in range(per_request)]
+            self.bodies["notify"].append(json.dumps(events[v % len(events)]).encode())
+            self.bodies["batch"].append(json.dumps(
+                {"samples": [{"features": f, "metadata": {"i": j}} for j, f in enumerate(feats)]}).encode())
+            self.bodies["bundle"].append(json.dumps({
+                "resourceType": "Bundle", "type": "batch",
+                "entry": [{"fullUrl": "urn:uuid:{}-{}".format(v, j), "resource": e}
+                          for j, e in enumerate(chunk)]}).encode())
+            self.bodies["stream"].append(("\n".join(json.dumps(e) for e in chunk) + "\n").encode())
+
+    REQUESTS = {
+        "notify": ("/fhir/notify", "application/fhir+json"),
+        "batch": ("/fhir/batch", "application/json"),
+        "bundle": ("/fhir/Bundle", "application/fhir+json"),
+        "stream": ("/fhir/stream", "application/x-ndjson"),
+    }
+
+    def request(self, endpoint, i):
+        path, ctype = self.REQUESTS[endpoint]
+        bodies = self.bodies[endpoint]
+        return path, ctype, bodies[i % len(bodies)]
+
+    def events_in(self, endpoint):
+        return 1 if endpoint == "notify" else self.per_request
+
+
+# ======================== RUNNER ========================
+
+class _Stats:
+    def __init__(self):
+        self.corrected = LatencyHistogram()
+        self.service = LatencyHistogram()
+        self.ok = 0
+        self.events = 0
+        self.errors = {}
+
+    def merge(self, other):
+        self.corrected.merge(other.corrected)
+        self.service.merge(other.service)
+        self.ok += other.ok
+        self.events += other.events
+        for k, v in other.errors.items():
+            self.errors[k] = self.errors.get(k, 0) + v
+
+
+class LoadRunner:
+    """Dispatches scheduled requests to a pool of keep-alive connections."""
+
+    def __init__(self, url, workload, rate, duration, warmup=0.0, mix=None,
+                 connections=16, timeout=30.0, poisson=False, seed=0):
+        parts = urlsplit(url)
+        self.host = parts.hostname
+        self.port = parts.port or 80
+        self.workload = workload
+        self.rate = float(rate)
+        self.duration = float(duration)
+        self.warmup = float(warmup)
+        self.mix = mix or {"notify": 1.0}
+        self.connections = int(connections)
+        self.timeout = float(timeout)
+        self.poisson = poisson
+        self.rng = random.Random(seed)
+
+        self._jobs = queue.Queue()
+        self._lock = threading.Lock()
+        self._stats = {}
+        self.max_dispatch_lag = 0.0
+
+    def _schedule(self):
+        """(scheduled time offset, endpoint) pairs covering warmup + duration."""
+        names = list(self.mix)
+        weights = [self.mix[n] for n in names]
+        t = 0.0
+        end = self.warmup + self.duration
+        i = 0
+        while t < end:
+            yield t, self.rng.choices(names, weights)[0], i
+            i += 1
+            t = self.rng.expovariate(self.rate) + t if self.poisson else i / self.rate
+
+    def _worker(self, start):
+        local = {}
+        conn = None
+        while True:
+            job = self._jobs.get()
+            if job is None:
+                break
+            offset, endpoint, i = job
+            path, ctype, body = self.workload.request(endpoint, i)
+            scheduled = start + offset
+            sent = time.perf_counter()
+            error = None
+            try:
+                if conn is None:
+                    conn = http.client.HTTPConnection(self.host, self.port, timeout=self.timeout)
+                conn.request("POST", path, body=body, headers={"Content-Type": ctype})
+                resp = conn.getresponse()
+                resp.read()
+                if resp.status >= 400:
+                    error = "HTTP {}".format(resp.status)
+                if resp.getheader("Connection", "").lower() == "close" or resp.version == 10:
+                    conn.close()
+                    conn = None
+            except Exception as e:
+                error = type(e).__name__
+                if conn is not None:
+                    conn.close()
+                conn = None
+            done = time.perf_counter()
+
+            if offset < self.warmup:
+                continue
+            stats = local.get(endpoint)
+            if stats is None:
+                stats = local[endpoint] = _Stats()
+            if error is None:
+                stats.ok += 1
+                stats.events += self.workload.events_in(endpoint)
+                stats.corrected.record((done - scheduled) * 1e6)
+                stats.service.record((done - sent) * 1e6)
+            else:
+                stats.errors[error] = stats.errors.get(error, 0) + 1
+
+        if conn is not None:
+            conn.close()
+        with self._lock:
+            for endpoint, stats in local.items():
+                self._stats.setdefault(endpoint, _Stats()).merge(stats)
+
+    def run(self):
+        start = time.perf_counter() + 0.05
+        workers = [threading.Thread(target=self._worker, args=(start,), daemon=True)
+                   for _ in range(self.connections)]
+        for w in workers:
+            w.start()
+
+        for offset, endpoint, i in self._schedule():
+            delay = start + offset - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            else:
+                self.max_dispatch_lag = max(self.max_dispatch_lag, -delay)
+            self._jobs.put((offset, endpoint, i))
+        dispatched = time.perf_counter()
+
+        for _ in workers:
+            self._jobs.put(None)
+        for w in workers:
+            w.join()
+        finished = time.perf_counter()
+        return self._report(start, dispatched, finished)
+
+    def _report(self, start, dispatched, finished):
+        measured = max(finished - start - self.warmup, 1e-9)
+        total = _Stats()
+        per_endpoint = {}
+        for endpoint, stats in sorted(self._stats.items()):
+            total.merge(stats)
+            per_endpoint[endpoint] = self._summary(stats, measured)
+        return {
+            "target_rps": self.rate,
+            "duration_s": self.duration,
+            "warmup_s": self.warmup,
+            "schedule": "poisson" if self.poisson else "uniform",
+            "connections": self.connections,
+            "mix": self.mix,
+            "elapsed_s": measured,
+            "drain_s": finished - dispatched,
+            "max_dispatch_lag_ms": self.max_dispatch_lag * 1000.0,
+            "total": self._summary(total, measured),
+            "endpoints": per_endpoint,
+        }
+
+    @staticmethod
+    def _summary(stats, elapsed):
+        n_err = sum(stats.errors.values())
+        n = stats.ok + n_err
+        return {
+            "requests": n,
+            "ok": stats.ok,
+            "errors": n_err,
+            "error_rate": (n_err / n) if n else 0.0,
+            "error_kinds": stats.errors,
+            "throughput_rps": stats.ok / elapsed,
+            "events_per_s": stats.events / elapsed,
+            "latency": stats.corrected.summary(),
+            "service_time": stats.service.summary(),
+        }
+
+
+# ======================== LOCAL SERVER ========================
+
+def start_local_server(models_dir=None):
+    """Serve app.server in-process on 127.0.0.1 (synthetic models unless given).
+
+    Returns:
+        (base_url, shutdown callable)
+    """
+    tmp = tempfile.mkdtemp(prefix="fhir-loadgen-")
+    if models_dir is None:
+        from app.fhir_features import EXPECTED_FEATURES
+        from tools.bench.artifacts import build_artifacts
+        models_dir = os.path.join(tmp, "models")
+        print("Building synthetic models in {} ...".format(models_dir))
+        build_artifacts(models_dir, n_raw=EXPECTED_FEATURES)
+    os.environ["MODELS_DIR"] = models_dir
+    os.environ.setdefault("LOG_FILE", os.path.join(tmp, "alerts.log"))
+
+    import logging
+    logging.getLogger("werkzeug").setLevel(logging.ERROR)
+    from werkzeug.serving import make_server
+    from app import server
+
+    if not server.MODEL_READY:
+        raise RuntimeError("model failed to load from {}".format(models_dir))
+    httpd = make_server("127.0.0.1", 0, server.app, threaded=True)
+    thread = threading.Thread(target=httpd.serve_forever, name="loadgen-server", daemon=True)
+    thread.start()
+
+    def shutdown():
+        httpd.shutdown()
+        shutil.rmtree(tmp, ignore_errors=True)
+
+    return "http://127.0.0.1:{}".format(httpd.server_port), shutdown
+
+
+# ======================== CLI ========================
+
+def _parse_mix(text):
+    mix = {}
+    for part in text.split(","):
+        name, _, weight = part.partition("=")
+        name = name.strip()
+        if name not in ENDPOINTS:
+            raise argparse.ArgumentTypeError("unknown endpoint '{}' (choose from {})".format(
+                name, ", ".join(ENDPOINTS)))
+        mix[name] = float(weight) if weight else 1.0
+    return mix
+
+
+def _print_report(report):
+    def row(name, s):
+        lat = s["latency"]
+        pct = " ".join("{:>9}".format("{:.2f}".format(lat["p{:g}_ms".format(p)]) if s["ok"] else "-")
+                       for p in PERCENTILES)
+        print("{:<8} {:>8} {:>9.1f} {:>9.1f} {:>7.2%} {}  {:>9}".format(
+            name, s["requests"], s["throughput_rps"], s["events_per_s"], s["error_rate"], pct,
+            "{:.2f}".format(lat["max_ms"]) if s["ok"] else "-"))
+
+    print("\nTarget {:.0f} req/s ({}) for {:.0f}s over {} connections".format(
+        report["target_rps"], report["schedule"], report["duration_s"], report["connections"]))
+    print("{:<8} {:>8} {:>9} {:>9} {:>7} {}  {:>9}".format(
+        "endpoint", "requests", "req/s", "events/s", "errors",
+        " ".join("{:>9}".format("p{:g} ms".format(p)) for p in PERCENTILES), "max ms"))
+    for name, s in report["endpoints"].items():
+        row(name, s)
+    if len(report["endpoints"]) > 1:
+        row("total", report["total"])
+
+    svc = report["total"]["service_time"]
+    if svc["count"]:
+        print("\nService time (from actual send, not CO-corrected): p50 {:.2f} ms  p99 {:.2f} ms".format(
+            svc["p50_ms"], svc["p99_ms"]))
+    for name, s in report["endpoints"].items():
+        if s["error_kinds"]:
+            print("Errors on {}: {}".format(name, s["error_kinds"]))
+    if report["max_dispatch_lag_ms"] > 5.0:
+        print("⚠ Dispatcher fell behind schedule by up to {:.1f} ms; the generator itself "
+              "may be saturated".format(report["max_dispatch_lag_ms"]))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    target = parser.add_mutually_exclusive_group(required=True)
+    target.add_argument("--url", help="base URL of a running server, e.g. http://localhost:5001")
+    target.add_argument("--local", action="store_true", help="start app.server in-process on a free port")
+    parser.add_argument("--models-dir", help="with --local: real artifacts instead of synthetic ones")
+    parser.add_argument("--rate", type=float, default=100.0, help="requests per second (default: 100)")
+    parser.add_argument("--duration", type=float, default=30.0, help="measured seconds (default: 30)")
+    parser.add_argument("--warmup", type=float, default=2.0, help="unrecorded seconds first (default: 2)")
+    parser.add_argument("--mix", type=_parse_mix, default={"notify": 1.0},
+                        help="endpoint weights, e.g. notify=0.8,bundle=0.2 (choose from {})".format(
+                            ", ".join(ENDPOINTS)))
+    parser.add_argument("--events-per-request", type=int, default=50,
+                        help="events per batch/bundle/stream request (default: 50)")
+    parser.add_argument("--events", help="AuditEvents to replay (JSON array, Bundle, NDJSON or one event)")
+    parser.add_argument("--connections", type=int, default=16, help="concurrent connections (default: 16)")
+    parser.add_argument("--timeout", type=float, default=30.0, help="per-request timeout in seconds")
+    parser.add_argument("--poisson", action="store_true", help="exponential inter-arrival times")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", metavar="FILE", help="write the full report as JSON")
+    args = parser.parse_args(argv)
+
+    events = load_events(args.events) if args.events else synthetic_events(4096, args.seed)
+    if not events:
+        print("No events to send")
+        return 2
+
+    shutdown = None
+    url = args.url
+    if args.local:
+        url, shutdown = start_local_server(args.models_dir)
+        print("Local server at {} (shares this process's CPU and GIL)".format(url))
+
+    try:
+        workload = Workload(events, args.events_per_request)
+        runner = LoadRunner(url, workload, args.rate, args.duration, warmup=args.warmup,
+                            mix=args.mix, connections=args.connections, timeout=args.timeout,
+                            poisson=args.poisson, seed=args.seed)
+        if args.local:
+            # Keep the in-process model's per-batch prints off the terminal
+            with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+                report = runner.run()
+        else:
+            report = runner.run()
+    finally:
+        if shutdown is not None:
+            shutdown()
+
+    report["url"] = url
+    _print_report(report)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2)
+        print("\nReport written to {}".format(args.json))
+    return 0 if report["total"]["ok"] else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
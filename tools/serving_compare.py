@@ -0,0 +1,229 @@
+#!/usr/bin/env python3
+"""Compare single-process and pre-fork serving: throughput, latency and memory.
+
+Starts `python -m app.prefork --single` and `python -m app.prefork --workers N`
+in turn on a free local port, drives each with tools/loadgen.py at the same
+open-loop rate and samples the memory of the server's process tree: RSS, and
+PSS, which splits shared (copy-on-write) pages between the processes mapping
+them and so shows what pre-forking actually costs.
+
+Usage:
+    python3 tools/serving_compare.py --workers 4 --rate 300 --duration 20
+    python3 tools/serving_compare.py --models-dir models --bundle --mix batch=1
+"""
+
+import argparse
+import json
+import os
+import shutil
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.request
+
+REPO_ROOT = os.path.abspath(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+sys.path.insert(0, REPO_ROOT)
+
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def _tree(pid):
+    """pid and all of its descendants (Linux /proc)."""
+    pids = [pid]
+    for p in pids:
+        try:
+            with open("/proc/{0}/task/{0}/children".format(p)) as f:
+                pids.extend(int(c) for c in f.read().split())
+        except OSError:
+            pass
+    return pids
+
+
+def _memory(pids):
+    """(RSS, PSS) in bytes summed over `pids`; PSS is None without smaps_rollup."""
+    rss = pss = 0
+    for pid in pids:
+        try:
+            with open("/proc/{}/smaps_rollup".format(pid)) as f:
+                for line in f:
+                    if line.startswith("Rss:"):
+                        rss += int(line.split()[1]) * 1024
+                    elif line.startswith("Pss:"):
+                        pss += int(line.split()[1]) * 1024
+        except OSError:
+            try:
+                with open("/proc/{}/status".format(pid)) as f:
+                    for line in f:
+                        if line.startswith("VmRSS:"):
+                            rss += int(line.split()[1]) * 1024
+                pss = None
+            except OSError:
+                pass
+    return rss, pss
+
+
+def _wait_healthy(url, proc, timeout=120.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if proc.poll() is not None:
+            return False
+        try:
+            with urllib.request.urlopen(url + "/health", timeout=1.0) as resp:
+                if json.load(resp).get("model_ready"):
+                    return True
+        except Exception:
+            pass
+        time.sleep(0.25)
+    return False
+
+
+def run_mode(name, server_args, env, loadgen_args, work_dir):
+    """Serve with `server_args`, drive it with loadgen and sample memory.
+
+    Returns:
+        dict with the loadgen report and memory figures, or None on failure
+    """
+    port = _free_port()
+    url = "http://127.0.0.1:{}".format(port)
+    log_path = os.path.join(work_dir, "{}.log".format(name))
+    with open(log_path, "w") as log:
+        proc = subprocess.Popen(
+            [sys.executable, "-m", "app.prefork", "--host", "127.0.0.1", "--port", str(port)] + server_args,
+            cwd=REPO_ROOT, env=env, stdout=log, stderr=subprocess.STDOUT)
+    try:
+        if not _wait_healthy(url, proc):
+            print("  {}: server did not become ready (see {})".format(name, log_path))
+            return None
+        time.sleep(0.5)
+        pids = _tree(proc.pid)
+        idle_rss, idle_pss = _memory(pids)
+
+        peak = {"rss": idle_rss, "pss": idle_pss}
+        done = threading.Event()
+
+        def sample():
+            while not done.wait(0.5):
+                rss, pss = _memory(_tree(proc.pid))
+                peak["rss"] = max(peak["rss"], rss)
+                if pss is not None and peak["pss"] is not None:
+                    peak["pss"] = max(peak["pss"], pss)
+
+        sampler = threading.Thread(target=sample, daemon=True)
+        sampler.start()
+        report_path = os.path.join(work_dir, "{}.json".format(name))
+        subprocess.run([sys.executable, os.path.join(REPO_ROOT, "tools", "loadgen.py"),
+                        "--url", url, "--json", report_path] + loadgen_args,
+                       cwd=REPO_ROOT, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        done.set()
+        sampler.join()
+        if not os.path.exists(report_path):
+            print("  {}: load generator failed".format(name))
+            return None
+        with open(report_path) as f:
+            report = json.load(f)
+        return {
+            "processes": len(pids),
+            "idle_rss": idle_rss, "idle_pss": idle_pss,
+            "peak_rss": peak["rss"], "peak_pss": peak["pss"],
+            "report": report,
+        }
+    finally:
+        proc.send_signal(signal.SIGTERM)
+        try:
+            proc.wait(timeout=15)
+        except subprocess.TimeoutExpired:
+            proc.kill()
+            proc.wait()
+
+
+def _mb(value):
+    return "-" if value is None else "{:.1f}".format(value / 1048576.0)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--models-dir", help="real artifacts (default: synthetic, production-shaped)")
+    parser.add_argument("--bundle", action="store_true", help="convert the artifacts to model.bundle first")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 2)
+    parser.add_argument("--rate", type=float, default=200.0, help="target requests/s (default: 200)")
+    parser.add_argument("--duration", type=float, default=15.0)
+    parser.add_argument("--warmup", type=float, default=2.0)
+    parser.add_argument("--mix", default="notify=0.5,batch=0.5")
+    parser.add_argument("--events-per-request", type=int, default=32)
+    parser.add_argument("--connections", type=int, default=32)
+    parser.add_argument("--json", metavar="FILE", help="write both runs as JSON")
+    args = parser.parse_args(argv)
+
+    work_dir = tempfile.mkdtemp(prefix="fhir-serving-")
+    try:
+        models_dir = os.path.join(work_dir, "models")
+        if args.models_dir:
+            shutil.copytree(args.models_dir, models_dir)
+        else:
+            from app.fhir_features import EXPECTED_FEATURES
+            from tools.bench.artifacts import build_artifacts
+            from tools.bench.runner import quiet
+            print("Building synthetic models ...")
+            with quiet():
+                build_artifacts(models_dir, n_raw=EXPECTED_FEATURES)
+        bundle_path = os.path.join(models_dir, "model.bundle")
+        if args.bundle:
+            from app.model_bundle import build_bundle
+            build_bundle(models_dir, log=lambda *a: None)
+        elif os.path.exists(bundle_path):
+            os.remove(bundle_path)
+
+        env = dict(os.environ,
+                   MODELS_DIR=models_dir,
+                   LOG_FILE=os.path.join(work_dir, "alerts.log"),
+                   # Repeated synthetic events would be cache hits; measure inference
+                   RESULT_CACHE_SIZE="0",
+                   PYTHONPATH=REPO_ROOT + os.pathsep + os.environ.get("PYTHONPATH", ""))
+        loadgen_args = ["--rate", str(args.rate), "--duration", str(args.duration),
+                        "--warmup", str(args.warmup), "--mix", args.mix,
+                        "--events-per-request", str(args.events_per_request),
+                        "--connections", str(args.connections)]
+
+        runs = {}
+        for name, server_args in (("single", ["--single"]),
+                                  ("prefork", ["--workers", str(args.workers)])):
+            print("Running {} ({}) ...".format(name, " ".join(server_args)))
+            runs[name] = run_mode(name, server_args, env, loadgen_args, work_dir)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    print("\nTarget {:.0f} req/s for {:.0f}s, mix {}, {} events per batch request, {} CPUs".format(
+        args.rate, args.duration, args.mix, args.events_per_request, os.cpu_count()))
+    print("{:<9} {:>5} {:>9} {:>9} {:>9} {:>9} {:>7} {:>9} {:>9} {:>9}".format(
+        "mode", "procs", "req/s", "events/s", "p50 ms", "p99 ms", "errors",
+        "idle RSS", "peak RSS", "peak PSS"))
+    for name, run in runs.items():
+        if run is None:
+            print("{:<9} failed".format(name))
+            continue
+        total = run["report"]["total"]
+        lat = total["latency"]
+        print("{:<9} {:>5} {:>9.1f} {:>9.1f} {:>9} {:>9} {:>7.2%} {:>9} {:>9} {:>9}".format(
+            name, run["processes"], total["throughput_rps"], total["events_per_s"],
+            "{:.2f}".format(lat["p50_ms"]) if total["ok"] else "-",
+            "{:.2f}".format(lat["p99_ms"]) if total["ok"] else "-",
+            total["error_rate"], _mb(run["idle_rss"]), _mb(run["peak_rss"]), _mb(run["peak_pss"])))
+    print("(memory in MB over the whole process tree; PSS counts shared pages once)")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"args": vars(args), "cpu_count": os.cpu_count(), "runs": runs}, f, indent=2)
+        print("\nResults written to {}".format(args.json))
+    return 0 if all(runs.values()) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())